@@ -1,11 +1,37 @@
+import csv
+import itertools
 import os
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, LoginForm, MessageForm, UserUpdateForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Likes, Follows
+from pagination import Page, paginate, current_cursor, page_size
+import search
+from search import search_users, autocomplete_users
+import assets
+import compression
+import conditional
+import counters
+import followgraph
+import follows
+import fragments
+import hashing
+import likes
+import loader
+import media
+import metrics
+import migrations
+import principal
+import replicas
+import streaming
+import timeline
+import viewer
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +46,127 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Authors with more followers than this are merged into timelines on read
+# instead of being fanned out on write (None: always fan out on write).
+app.config['TIMELINE_FANOUT_THRESHOLD'] = 10000
+# How many of a newly followed user's messages to copy into the timeline.
+app.config['TIMELINE_BACKFILL_LIMIT'] = 100
+# Rows per page on timelines and user lists.
+app.config['PAGE_SIZE'] = 100
+# Most users returned by a search and by navbar autocomplete.
+app.config['USER_SEARCH_LIMIT'] = 50
+app.config['USER_AUTOCOMPLETE_LIMIT'] = 8
+# In message search, a message this many days newer gains as much score as
+# a much better text match.
+app.config['MESSAGE_SEARCH_RECENCY_DAYS'] = 30
+# Rendered message cards kept per worker process.
+app.config['FRAGMENT_CACHE_SIZE'] = 10000
+# Seconds a worker may serve the logged-in user's username and avatar
+# without asking the database.
+app.config['CURRENT_USER_TTL'] = 30
+# Most users' identities each worker keeps, least recently used dropped first.
+app.config['CURRENT_USER_CACHE_SIZE'] = 10000
+# bcrypt work factor (see `flask benchmark-hashing`), and the size and
+# backlog of each worker's password hashing pool.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASHING_WORKERS'] = 4
+app.config['HASHING_MAX_PENDING'] = 64
+# Read replicas (comma-separated URLs). GET requests read from a replica
+# unless the user wrote within REPLICA_PIN_SECONDS; replicas more than
+# REPLICA_MAX_LAG_SECONDS behind, or failing, are skipped.
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if uri]
+app.config['REPLICA_PIN_SECONDS'] = 10
+app.config['REPLICA_MAX_LAG_SECONDS'] = 5
+app.config['REPLICA_CHECK_SECONDS'] = 5
+app.config['REPLICA_RETRY_SECONDS'] = 30
+# Bearer token Prometheus must send to scrape /metrics (None: not served).
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Cache-Control by endpoint; other endpoints get CACHE_CONTROL_DEFAULT.
+# Profiles and messages are revalidated with their ETags (conditional.py),
+# and are made private for logged-in users. Fingerprinted assets never
+# change (see `flask build-assets`). CACHE_RELEASE changes every ETag
+# (default: a digest of the templates).
+app.config['CACHE_CONTROL'] = {
+    'users_show': 'public, no-cache',
+    'messages_show': 'public, no-cache',
+    'static': 'public, no-cache',
+    'assets': 'public, max-age=31536000, immutable',
+    'media': 'public, max-age=31536000, immutable',
+}
+app.config['CACHE_CONTROL_DEFAULT'] = 'no-cache, no-store, must-revalidate'
+app.config['CACHE_RELEASE'] = os.environ.get('RELEASE')
+# Response compression: gzip level (1-9) and brotli quality (0-11), and the
+# smallest body worth compressing for each content type. Other types
+# (images, fonts) are sent as they are.
+app.config['COMPRESSION_GZIP_LEVEL'] = 6
+app.config['COMPRESSION_BROTLI_QUALITY'] = 5
+app.config['COMPRESSION_MIN_SIZE'] = {
+    'text/html': 1024,
+    'text/css': 1024,
+    'text/plain': 1024,
+    'text/csv': 1024,
+    'application/javascript': 1024,
+    'application/json': 512,
+    'image/svg+xml': 1024,
+}
+# Uploaded images: where they're stored, the largest accepted, the
+# thumbnail sizes made for each kind (twice the size they're shown at, for
+# high-DPI screens), and the size and backlog of each worker's resizing pool.
+app.config['MEDIA_FOLDER'] = os.environ.get(
+    'MEDIA_FOLDER', os.path.join(app.instance_path, 'media'))
+app.config['MEDIA_MAX_BYTES'] = 8 * 2 ** 20
+app.config['MEDIA_MAX_PIXELS'] = 40000000
+app.config['MEDIA_SIZES'] = {
+    'avatar': {'sm': (96, 96), 'md': (140, 140), 'lg': (400, 400)},
+    'header': {'md': (720, 240)},
+}
+app.config['MEDIA_JPEG_QUALITY'] = 85
+app.config['MEDIA_WORKERS'] = 2
+app.config['MEDIA_MAX_PENDING'] = 32
+# Message like counts are written behind: each worker buffers changes and
+# writes them every LIKE_COUNT_FLUSH_SECONDS, or once this many messages
+# have changes pending (see likes.py and `flask reconcile-like-counts`).
+app.config['LIKE_COUNT_FLUSH_SECONDS'] = 1.0
+app.config['LIKE_COUNT_FLUSH_SIZE'] = 500
+# Most users one request may follow at once (see import_following; the
+# `flask import-follows` command has no limit).
+app.config['FOLLOW_IMPORT_MAX'] = 5000
+# Answer follow lookups from an in-memory index of the follow graph (needs
+# NumPy; see followgraph.py and `flask build-follow-graph`). Snapshots older
+# than FOLLOW_GRAPH_MAX_AGE seconds are not used; workers look for a newer
+# one every FOLLOW_GRAPH_REFRESH_SECONDS.
+app.config['FOLLOW_GRAPH_ENABLED'] = bool(os.environ.get(
+    'FOLLOW_GRAPH_ENABLED'))
+app.config['FOLLOW_GRAPH_FOLDER'] = os.environ.get(
+    'FOLLOW_GRAPH_FOLDER', os.path.join(app.instance_path, 'follow-graph'))
+app.config['FOLLOW_GRAPH_MAX_AGE'] = 600
+app.config['FOLLOW_GRAPH_REFRESH_SECONDS'] = 30
+# Endpoints whose pages are streamed: the head is sent before the list is
+# queried, and the list is read STREAM_BATCH_SIZE rows at a time, with
+# STREAM_PAGE_SIZE rows per page (None: the whole list on one page).
+# Chunks of about STREAM_CHUNK_SIZE characters are sent as they render.
+app.config['STREAMED_ENDPOINTS'] = set(filter(None, os.environ.get(
+    'STREAMED_ENDPOINTS', '').split(',')))
+app.config['STREAM_PAGE_SIZE'] = 1000
+app.config['STREAM_BATCH_SIZE'] = 100
+app.config['STREAM_CHUNK_SIZE'] = 8192
+
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+replicas.init_app(app)
+metrics.init_app(app, db)
+fragments.init_app(app)
+likes.init_app(app)
+followgraph.init_app(app)
+assets.init_app(app)
+media.init_app(app)
+conditional.init_app(app)
+streaming.init_app(app)
+compression.init_app(app)
 
 
 ##############################################################################
@@ -31,9 +175,14 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user is only loaded from the database once something reads it.
+    """
+    metrics.start_request()
+
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = principal.CurrentUser(session[CURR_USER_KEY])
     else:
         g.user = None
 
@@ -41,6 +190,7 @@ def add_user_to_g():
 def do_login(user):
     """Log in user."""
     session[CURR_USER_KEY] = user.id
+    principal.remember(user)
 
 
 def do_logout():
@@ -57,12 +207,17 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():   
+        uploads = save_uploads(form, {'image': 'avatar'})
+        if uploads is None:
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
                 password=form.password.data,
                 email=form.email.data,
-                image_url=form.image_url.data or User.image_url.default.arg,
+                image_url=(uploads.get('image') or form.image_url.data
+                           or User.image_url.default.arg),
             )
             db.session.commit()
 
@@ -89,6 +244,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate may have upgraded the stored hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -106,6 +263,42 @@ def logout():
     return redirect('/login')
 
 
+def save_uploads(form, kinds):
+    """Store the images uploaded to `form`; `kinds` maps field names to
+    image kinds.
+
+    Returns {field name: URL} for the fields that had an upload, or None if
+    one was rejected, with the reason added to that field's errors.
+    """
+
+    urls = {}
+    for name, kind in kinds.items():
+        field = form[name]
+        if field.data:
+            try:
+                urls[name] = media.save_upload(field.data, kind)
+            except media.InvalidImage as error:
+                field.errors.append(str(error))
+                return None
+    return urls
+
+
+@app.errorhandler(hashing.HashingBusy)
+def hashing_busy(error):
+    """Too many logins/signups in flight: ask the client to retry."""
+
+    return ("Too many sign-ins right now; please try again in a moment.",
+            503, {'Retry-After': '1'})
+
+
+@app.errorhandler(media.MediaBusy)
+def media_busy(error):
+    """Too many uploads being resized: ask the client to retry."""
+
+    return ("Too many image uploads right now; please try again in a moment.",
+            503, {'Retry-After': '1'})
+
+
 ##############################################################################
 # General user routes:
 
@@ -117,29 +310,52 @@ def list_users():
     """
 
     search = request.args.get('q')
+    state = viewer.BatchedViewerState(g.user)
 
-    if not search:
-        users = User.query.all()
+    if search:
+        page = Page(search_users(search))
+        state.resolve_batch(users=page.items)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = streaming.paginate(User.query, (User.id,),
+                                  lambda user: (user.id,), current_cursor(),
+                                  on_batch=lambda users:
+                                  state.resolve_batch(users=users))
+
+    return streaming.render_template('users/index.html', users=page,
+                                     page=page, viewer=state)
+
+
+@app.route('/api/users/autocomplete')
+def users_autocomplete():
+    """JSON list of users whose username starts with the 'q' param."""
 
-    return render_template('users/index.html', users=users)
+    users = autocomplete_users(request.args.get('q'))
+
+    return jsonify(users=[dict(id=id, username=username,
+                               image_url=media.thumbnail(image_url, 'sm'))
+                          for id, username, image_url in users])
 
 
 @app.route('/users/<int:user_id>')
+@conditional.validated(conditional.profile_stamp)
 def users_show(user_id):
     """Show user profile."""
 
     user = User.query.get_or_404(user_id)
 
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    query = (Message
+             .query
+             .options(joinedload(Message.user))
+             .filter(Message.user_id == user_id))
+    page = paginate(query,
+                    (Message.timestamp, Message.id),
+                    timeline.message_key,
+                    current_cursor())
 
-    return render_template('users/show.html', user=user, messages=messages)
+    return render_template('users/show.html', user=user,
+                           messages=page.items, page=page,
+                           viewer=viewer.resolve(g.user, messages=page.items,
+                                                 users=[user]))
 
 
 @app.route('/users/<int:user_id>/following')
@@ -151,7 +367,20 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+
+    query = (User
+             .query
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id))
+    state = viewer.BatchedViewerState(g.user, users=[user])
+    page = streaming.paginate(query, (Follows.user_being_followed_id,),
+                              lambda followed: (followed.id,),
+                              current_cursor(),
+                              on_batch=lambda users:
+                              state.resolve_batch(users=users))
+
+    return streaming.render_template('users/following.html', user=user,
+                                     users=page, page=page, viewer=state)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -163,7 +392,20 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+
+    query = (User
+             .query
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id))
+    state = viewer.BatchedViewerState(g.user, users=[user])
+    page = streaming.paginate(query, (Follows.user_following_id,),
+                              lambda follower: (follower.id,),
+                              current_cursor(),
+                              on_batch=lambda users:
+                              state.resolve_batch(users=users))
+
+    return streaming.render_template('users/followers.html', user=user,
+                                     users=page, page=page, viewer=state)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -174,8 +416,13 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    if follow_id == g.user.id:
+        flash("You can't follow yourself.", "danger")
+        return redirect(f"/users/{g.user.id}")
+
+    if not follows.set_following(g.user.id, follow_id, True):
+        if not follows.user_exists(follow_id):
+            abort(404)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -189,13 +436,36 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    if not follows.set_following(g.user.id, follow_id, False):
+        if not follows.user_exists(follow_id):
+            abort(404)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
+@app.route('/users/following/import', methods=['POST'])
+def import_following():
+    """Follow every user in the JSON body's `following` list of ids, e.g.
+    when moving an account here. Follows that exist, and ids that aren't
+    users, are skipped."""
+
+    if not g.user:
+        return jsonify(error="Log in to follow users."), 401
+
+    user_ids = (request.get_json(silent=True) or {}).get('following')
+    if (not isinstance(user_ids, list)
+            or not all(type(id) is int for id in user_ids)):
+        return jsonify(error="'following' must be a list of user ids."), 400
+    limit = app.config['FOLLOW_IMPORT_MAX']
+    if len(user_ids) > limit:
+        return jsonify(error=f"At most {limit} users at a time."), 413
+
+    added = follows.import_follows((g.user.id, id) for id in user_ids)
+    db.session.commit()
+    return jsonify(added=added)
+
+
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
@@ -206,10 +476,13 @@ def profile():
     form = UserUpdateForm()
     
     if form.validate_on_submit():
-        user = User.authenticate(g.user.username, form.password.data)
+        user = User.authenticate(g.user.load().username, form.password.data)
         if user:
-            update_user(user, form)
-            return redirect(f'/users/{user.id}')
+            uploads = save_uploads(form, {'image': 'avatar',
+                                          'header_image': 'header'})
+            if uploads is not None:
+                update_user(user, form, uploads)
+                return redirect(f'/users/{user.id}')
         else:
             flash("Incorrect password.", 'error')
         
@@ -225,16 +498,18 @@ def update_form(user, form):
     form.bio.data = user.bio if user.bio else None
     return form
 
-def update_user(user, form):
+def update_user(user, form, uploads):
     '''Update a user object and commit to the database'''
     user.username = form.username.data if form.username.data else user.username
     user.email = form.email.data if form.email.data else user.email
-    user.image_url = form.image_url.data if form.image_url.data else user.image_url
-    user.header_image_url = form.header_image_url.data if form.header_image_url.data else user.header_image_url
+    user.image_url = uploads.get('image') or form.image_url.data or user.image_url
+    user.header_image_url = uploads.get('header_image') or form.header_image_url.data or user.header_image_url
     user.bio = form.bio.data if form.bio.data else user.bio
+    user.profile_version = User.profile_version + 1
+    user.updated_at = datetime.utcnow()
     db.session.add(user)
     db.session.commit()
-    pass
+    principal.remember(user)
 
     
 
@@ -249,8 +524,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    counters.user_deleted(g.user.id)
+    timeline.user_deleted(g.user.id)
+    db.session.delete(g.user.load())
     db.session.commit()
+    principal.forget(g.user.id)
 
     return redirect("/signup")
 
@@ -271,18 +549,42 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        counters.adjust(g.user.id, messages_count=1)
+        timeline.fan_out_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
+@app.route('/messages/search')
+def messages_search():
+    """Full-text search over messages, best and newest first."""
+
+    text = request.args.get('q', '').strip()
+
+    page = Page([])
+    if text:
+        query, keys = search.search_messages(text)
+        query = query.options(joinedload(Message.user))
+        page = paginate(query, keys, lambda row: (row.score, row[0].id),
+                        current_cursor())
+        page.items = [msg for msg, score in page.items]
+
+    return render_template('messages/search.html', query=text,
+                           messages=page.items, page=page,
+                           viewer=viewer.resolve(g.user, messages=page.items))
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@conditional.validated(conditional.message_stamp)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = Message.query.get_or_404(message_id)
+    return render_template('messages/show.html', message=msg,
+                           viewer=viewer.resolve(g.user, users=[msg.user]))
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -293,9 +595,11 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
+    msg = Message.query.get_or_404(message_id)
+    counters.message_deleted(msg)
     db.session.delete(msg)
     db.session.commit()
+    fragments.evict_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -309,39 +613,30 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time
     """
 
     if g.user:
-        friend_ids = [user.id for user in g.user.following]
-        friend_ids.append(g.user.id)
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(friend_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        return render_template('home.html', messages=messages, user = g.user)
+        page = timeline.home_timeline(g.user.id, page_size(),
+                                      current_cursor())
+        return render_template('home.html', messages=page.items,
+                               page=page, user = g.user,
+                               viewer=viewer.resolve(g.user,
+                                                     messages=page.items))
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Caching headers (see CACHE_CONTROL)
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add the endpoint's caching headers to every response."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
+    conditional.apply_cache_control(req)
+    metrics.finish_request(req)
     return req
 
 ##############################################################################
@@ -350,24 +645,174 @@ def add_header(req):
 def show_likes(user_id):
     '''Show the messages that a user likes'''
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user)
 
-@app.route('/users/add_like/<int:msg_id>', methods=['GET'])
-def handle_likes(msg_id):
-    '''Add a liked message for a particular user to the database'''
+    query = (Message
+             .query
+             .options(joinedload(Message.user))
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user_id))
+    state = viewer.BatchedViewerState(g.user, users=[user])
+    page = streaming.paginate(query, (Likes.message_id,),
+                              lambda msg: (msg.id,), current_cursor(),
+                              on_batch=lambda messages:
+                              state.resolve_batch(messages=messages))
+
+    return streaming.render_template('users/likes.html', user=user,
+                                     messages=page, page=page, viewer=state)
+
+@app.route('/messages/<int:message_id>/like', methods=['POST'])
+def like_message(message_id):
+    """Like or unlike a message, as the `liked` field says.
+
+    Repeating a request changes nothing. Scripts posting JSON get the new
+    state and the message's like count back; plain forms are redirected
+    back to the page they were on.
+    """
+
+    if request.is_json:
+        liked = (request.get_json(silent=True) or {}).get('liked')
+        if not isinstance(liked, bool):
+            return jsonify(error="'liked' must be true or false."), 400
+    else:
+        liked = request.form.get('liked') in ('true', '1')
+
     if not g.user:
+        if request.is_json:
+            return jsonify(error="Log in to like messages."), 401
         return redirect('/login')
 
-    message = Message.query.get_or_404(msg_id)
-    like = Likes(message_id = message.id, user_id = g.user.id)
-    db.session.add(like)
+    changed = likes.set_liked(g.user.id, message_id, liked)
+    if not changed and not likes.message_exists(message_id):
+        abort(404)
     db.session.commit()
-    return redirect(request.referrer)
-    
-@app.route('/users/delete_like/<int:msg_id>', methods=['GET'])
-def remove_like(msg_id):
-    '''Remove a liked message for a particular user from the database'''
-    if g.user:
-        Likes.query.filter(Likes.message_id==msg_id, Likes.user_id==g.user.id).delete()
+
+    if request.is_json:
+        return jsonify(liked=liked,
+                       likes=likes.current_like_count(message_id))
+    return redirect(request.referrer or f'/messages/{message_id}')
+
+
+@app.route('/users/add_like/<int:msg_id>')
+@app.route('/users/delete_like/<int:msg_id>')
+def legacy_like(msg_id):
+    """Old like and unlike links, which changed likes on GET. They only
+    show the message now; liking it takes a POST."""
+
+    return redirect(f'/messages/{msg_id}', 301)
+
+
+##############################################################################
+# Maintenance commands
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True,
+              help='List migrations instead of applying them.')
+def migrate_command(status):
+    '''Bring the database schema up to date.'''
+    if status:
+        for migration, applied in migrations.status():
+            state = 'applied' if applied else 'pending'
+            click.echo(f'{state:8} {migration.id}: {migration.description}')
+        return
+
+    if not migrations.migrate(echo=click.echo):
+        click.echo('Nothing to migrate.')
+
+
+@app.cli.command('repair-counters')
+def repair_counters_command():
+    '''Recompute every user's message, follow and like counters.'''
+    counters.repair_counters()
+    db.session.commit()
+
+
+@app.cli.command('reconcile-like-counts')
+@click.option('--batch-size', default=10000,
+              help='Message ids recounted per transaction.')
+def reconcile_like_counts_command(batch_size):
+    '''Recount messages' likes where the written-behind count drifted.'''
+    fixed = likes.reconcile(batch_size, echo=click.echo)
+    click.echo(f'Fixed {fixed} like counts.')
+
+
+@app.cli.command('import-follows')
+@click.argument('path', type=click.File())
+@click.option('--chunk-rows', default=100000,
+              help='Follows imported per transaction.')
+def import_follows_command(path, chunk_rows):
+    '''Import follows from a CSV with user_being_followed_id and
+    user_following_id columns, skipping those that exist.'''
+    rows = csv.DictReader(path)
+    added = 0
+    while True:
+        chunk = [(row['user_following_id'], row['user_being_followed_id'])
+                 for row in itertools.islice(rows, chunk_rows)]
+        if not chunk:
+            break
+        added += follows.import_follows(chunk)
         db.session.commit()
-        return redirect(request.referrer)
+    click.echo(f'Added {added} follows.')
+
+
+@app.cli.command('build-follow-graph')
+def build_follow_graph_command():
+    '''Snapshot the follow graph for workers to memory-map.'''
+    if followgraph.np is None:
+        raise click.ClickException('The follow graph index needs NumPy.')
+    with db.engine.connect() as conn:
+        graph = followgraph.FollowGraph.build(conn)
+    path = graph.save(app.config['FOLLOW_GRAPH_FOLDER'])
+    click.echo(f'Wrote {len(graph)} follows to {path}.')
+
+
+@app.cli.command('load-csvs')
+@click.argument('directory', default='generator')
+@click.option('--chunk-rows', default=loader.DEFAULT_CHUNK_ROWS,
+              help='Rows per COPY chunk (and per commit).')
+@click.option('--incremental', is_flag=True,
+              help='Add to the existing data instead of replacing it.')
+@click.option('--resume', is_flag=True,
+              help='Continue an interrupted load from its last chunk.')
+def load_csvs_command(directory, chunk_rows, incremental, resume):
+    '''Bulk-load the generator CSVs with PostgreSQL COPY.'''
+    loader.load(directory, chunk_rows, incremental, resume)
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    '''Rebuild the full-text message index (SQLite only).'''
+    search.rebuild_message_index()
+    db.session.commit()
+
+
+@app.cli.command('benchmark-hashing')
+@click.option('--budget-ms', default=250,
+              help='Longest acceptable time for one password hash.')
+def benchmark_hashing_command(budget_ms):
+    '''Time bcrypt costs and suggest BCRYPT_LOG_ROUNDS for a latency budget.'''
+    timings, best = hashing.benchmark(budget_ms / 1000)
+    for cost, seconds in timings:
+        click.echo(f'cost {cost:2d}: {seconds * 1000:8.1f} ms')
+    if best is None:
+        click.echo('No cost fits the budget; use the minimum of 4.')
+    else:
+        click.echo(f'BCRYPT_LOG_ROUNDS={best}')
+
+
+@app.cli.command('vendor-assets')
+def vendor_assets_command():
+    '''Download the pinned third-party CSS, JS and fonts into static/.'''
+    assets.vendor(app.static_folder, echo=click.echo)
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    '''Fingerprint and precompress static/ into static/dist.'''
+    assets.build(app.static_folder, echo=click.echo)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    '''Recompute every home timeline from messages and follows.'''
+    timeline.rebuild_timelines()
+    db.session.commit()
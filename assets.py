@@ -0,0 +1,250 @@
+"""Fingerprinted, precompressed static assets.
+
+    flask vendor-assets   # download the pinned third-party assets
+    flask build-assets    # fingerprint and compress static/ into static/dist
+
+`vendor-assets` downloads the pinned Bootstrap, jQuery, Popper and Font
+Awesome files in VENDOR into static/vendor, so pages no longer depend on
+unpkg and use.fontawesome.com.
+
+`build-assets` copies every file under static/ to static/dist with a
+digest of its content in the name (style.css -> style.1a2b3c4d5e6f.css),
+rewriting url() references in stylesheets to the fingerprinted names, and
+writes gzip and (if the brotli package is installed) brotli variants next
+to each compressible file. static/dist/manifest.json maps each original
+path to its fingerprinted one. Files from earlier builds are left in
+place, so pages rendered before a deploy can still load theirs.
+
+Templates link assets with `asset_url(path)`. It returns the fingerprinted
+URL once the assets are built, the plain /static URL before that, and for
+a vendored file that hasn't been downloaded yet, its CDN URL. A
+fingerprinted URL changes whenever its content does, so the `assets`
+route serves them as immutable for a year (see CACHE_CONTROL), picking
+the precompressed variant the client accepts.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+FONT_AWESOME = 'https://use.fontawesome.com/releases/v5.3.1'
+
+# static path -> pinned source URL
+VENDOR = {
+    'vendor/bootstrap/bootstrap.min.css':
+        'https://unpkg.com/bootstrap@4.1.3/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/bootstrap.min.js':
+        'https://unpkg.com/bootstrap@4.1.3/dist/js/bootstrap.min.js',
+    'vendor/jquery/jquery.min.js':
+        'https://unpkg.com/jquery@3.3.1/dist/jquery.min.js',
+    'vendor/popper/popper.min.js':
+        'https://unpkg.com/popper.js@1.14.4/dist/umd/popper.min.js',
+    'vendor/fontawesome/css/all.css': f'{FONT_AWESOME}/css/all.css',
+}
+
+# all.css loads its fonts from ../webfonts/
+VENDOR.update({
+    f'vendor/fontawesome/webfonts/{font}.{ext}':
+        f'{FONT_AWESOME}/webfonts/{font}.{ext}'
+    for font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900')
+    for ext in ('eot', 'svg', 'ttf', 'woff', 'woff2')
+})
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.ico', '.eot',
+                '.ttf'}
+
+# (Accept-Encoding token, file suffix), most preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+mimetypes.add_type('font/woff', '.woff')
+mimetypes.add_type('font/woff2', '.woff2')
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+# a url() target and its ?query or #fragment, e.g. fa-solid-900.eot?#iefix
+URL_SUFFIX = re.compile(r'([^?#]*)(.*)')
+
+
+##############################################################################
+# Building
+
+def vendor(static_folder, echo=print):
+    """Download every VENDOR file into `static_folder`."""
+
+    for path, url in sorted(VENDOR.items()):
+        target = os.path.join(static_folder, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with urllib.request.urlopen(url) as resp, open(target, 'wb') as f:
+            shutil.copyfileobj(resp, f)
+        echo(f'{path} <- {url}')
+
+
+def source_files(static_folder):
+    """Paths (relative, with /) of the files to build, stylesheets last so
+    the files they refer to are fingerprinted first."""
+
+    paths = []
+    for root, dirs, files in os.walk(static_folder):
+        rel = os.path.relpath(root, static_folder)
+        if rel == DIST:
+            dirs[:] = []
+            continue
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if not name.startswith('.'):
+                paths.append(posixpath.normpath(
+                    posixpath.join(rel.replace(os.sep, '/'), name)))
+    return sorted(paths, key=lambda path: (path.endswith('.css'), path))
+
+
+def fingerprint(path, content):
+    """`path` with a digest of `content` before its extension."""
+
+    base, ext = posixpath.splitext(path)
+    return f'{base}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+
+def rewrite_css(path, css, manifest):
+    """Point url() references in stylesheet `path` at fingerprinted
+    files."""
+
+    def replace(match):
+        quote, url = match.groups()
+        target, rest = URL_SUFFIX.match(url).groups()
+        if target.startswith('/static/'):
+            ref = target[len('/static/'):]
+        elif '//' in target or target.startswith(('data:', '/')):
+            return match.group(0)
+        else:
+            ref = posixpath.normpath(
+                posixpath.join(posixpath.dirname(path), target))
+
+        if ref not in manifest:
+            return match.group(0)
+        url = f'/static/{DIST}/{manifest[ref]}{rest}'
+        return f'url({quote}{url}{quote})'
+
+    return CSS_URL.sub(replace, css)
+
+
+def compress(target):
+    """Write the compressed variants of `target` that are smaller."""
+
+    with open(target, 'rb') as f:
+        content = f.read()
+
+    variants = [('.gz', gzip.compress(content, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+
+    for suffix, compressed in variants:
+        if len(compressed) < len(content):
+            with open(target + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def build(static_folder, echo=print):
+    """Fingerprint and compress `static_folder` into its dist folder;
+    return the manifest."""
+
+    dist = os.path.join(static_folder, DIST)
+
+    manifest = {}
+    for path in source_files(static_folder):
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = rewrite_css(path, content.decode(),
+                                  manifest).encode()
+
+        manifest[path] = fingerprint(path, content)
+        target = os.path.join(dist, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+        if posixpath.splitext(path)[1] in COMPRESSIBLE:
+            compress(target)
+        echo(f'{path} -> {DIST}/{manifest[path]}')
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+##############################################################################
+# Serving
+
+class Manifest:
+    """The built assets in `folder`, if there are any."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        try:
+            with open(os.path.join(folder, MANIFEST)) as f:
+                self.files = json.load(f)
+        except FileNotFoundError:
+            self.files = {}
+
+    def url(self, path):
+        if path in self.files:
+            return url_for('assets', filename=self.files[path])
+
+        static = os.path.join(current_app.static_folder, path)
+        if path in VENDOR and not os.path.exists(static):
+            return VENDOR[path]
+        return url_for('static', filename=path)
+
+
+def asset_url(path):
+    """URL of static file `path` (relative to static/)."""
+
+    return current_app.extensions['assets'].url(path)
+
+
+def send_asset(filename):
+    """Send a fingerprinted file, precompressed if the client accepts."""
+
+    folder = current_app.extensions['assets'].folder
+    mimetype = mimetypes.guess_type(filename)[0]
+
+    for encoding, suffix in ENCODINGS:
+        if not request.accept_encodings[encoding]:
+            continue
+        try:
+            response = send_from_directory(folder, filename + suffix,
+                                           mimetype=mimetype)
+        except NotFound:
+            continue
+        response.headers['Content-Encoding'] = encoding
+        break
+    else:
+        response = send_from_directory(folder, filename, mimetype=mimetype)
+
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Serve `app`'s built assets and expose `asset_url` to templates."""
+
+    app.extensions['assets'] = Manifest(os.path.join(app.static_folder,
+                                                     DIST))
+    app.add_url_rule(f'{app.static_url_path}/{DIST}/<path:filename>',
+                     'assets', send_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
@@ -0,0 +1,468 @@
+"""End-to-end benchmark for Warbler's routes.
+
+    BENCH_DATABASE_URL=postgresql:///warbler-bench python bench.py \\
+        --users 5000 --messages 100000 --requests 5000
+
+Seeds a fresh dataset in BENCH_DATABASE_URL (dropping every table in it),
+then replays a seeded, mixed read/write workload of logged-in and
+anonymous requests through `app.test_client()`, or through a real WSGI
+server with --server. For each route it reports throughput, p50/p95/p99
+latency and SQL statements per request, the latter from the count metrics.py
+keeps for each request, so statements run by background threads meanwhile
+aren't included.
+
+With --baseline, results are compared to a stored run and the script exits
+non-zero if any route's p95 latency grew by more than --tolerance or its
+SQL statements per request by more than --sql-tolerance. --save-baseline
+records the current run instead. Baselines are only comparable on the same
+hardware and with the same dataset flags, which are stored alongside them.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', 'postgresql:///warbler-bench')
+
+from flask import g, request_finished
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, Likes
+import counters
+import hashing
+import search
+import timeline
+
+# Dataset flags that must match for two runs to be comparable.
+DATASET_FLAGS = ('users', 'messages', 'follows', 'likes', 'viewers',
+                 'requests', 'seed')
+
+
+##############################################################################
+# Dataset
+
+def skewed_id(rng, n):
+    """Id in 1..n, log-uniformly skewed towards low ids."""
+
+    return min(int(n ** rng.random()), n)
+
+
+def seed_dataset(options):
+    """Recreate the schema and fill it with a seeded dataset."""
+
+    rng = random.Random(options.seed)
+    db.drop_all()
+    db.create_all()
+
+    password = hashing.hash_password('password')
+    db.session.bulk_insert_mappings(User, [
+        dict(username=f'user{i}', email=f'user{i}@bench.test',
+             password=password, bio=f'Benchmark user {i}',
+             location='Benchland')
+        for i in range(1, options.users + 1)])
+
+    start = datetime(2020, 1, 1)
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=f'Benchmark warble {i}',
+             timestamp=start + timedelta(minutes=i),
+             user_id=skewed_id(rng, options.users))
+        for i in range(1, options.messages + 1)])
+
+    follows = set()
+    likes = set()
+    for user_id in range(1, options.users + 1):
+        for _ in range(rng.randint(0, 2 * options.follows)):
+            followed = skewed_id(rng, options.users)
+            if followed != user_id:
+                follows.add((followed, user_id))
+        for _ in range(rng.randint(0, 2 * options.likes)):
+            likes.add((user_id, skewed_id(rng, options.messages)))
+
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=followed, user_following_id=follower)
+        for followed, follower in sorted(follows)])
+    db.session.bulk_insert_mappings(Likes, [
+        dict(user_id=user_id, message_id=message_id)
+        for user_id, message_id in sorted(likes)])
+
+    counters.repair_counters()
+    timeline.rebuild_timelines()
+    search.rebuild_message_index()
+    db.session.commit()
+
+
+##############################################################################
+# Workload
+
+class WorkloadState:
+    """What the logged-in viewers like and follow, so writes can toggle."""
+
+    def __init__(self, options):
+        self.options = options
+        self.viewers = list(range(1, options.viewers + 1))
+        self.likes = set(db.session
+                         .query(Likes.user_id, Likes.message_id)
+                         .filter(Likes.user_id.in_(self.viewers))
+                         .all())
+        self.follows = set(db.session
+                           .query(Follows.user_following_id,
+                                  Follows.user_being_followed_id)
+                           .filter(Follows.user_following_id
+                                   .in_(self.viewers))
+                           .all())
+        db.session.remove()
+
+    def viewer(self, rng):
+        return rng.choice(self.viewers)
+
+    def user(self, rng):
+        return skewed_id(rng, self.options.users)
+
+    def message(self, rng):
+        return rng.randint(1, self.options.messages)
+
+
+# Each scenario returns (method, path, user id or None, form data).
+
+def homepage(state, rng):
+    return 'GET', '/', state.viewer(rng), None
+
+
+def homepage_anon(state, rng):
+    return 'GET', '/', None, None
+
+
+def users_show(state, rng):
+    viewer = state.viewer(rng) if rng.random() < 0.5 else None
+    return 'GET', f'/users/{state.user(rng)}', viewer, None
+
+
+def list_users(state, rng):
+    return 'GET', '/users', state.viewer(rng), None
+
+
+def search_users(state, rng):
+    return 'GET', f'/users?q=user{state.user(rng)}', state.viewer(rng), None
+
+
+def messages_show(state, rng):
+    return 'GET', f'/messages/{state.message(rng)}', None, None
+
+
+def like_toggle(state, rng):
+    viewer, message_id = state.viewer(rng), state.message(rng)
+    if (viewer, message_id) in state.likes:
+        state.likes.remove((viewer, message_id))
+        return ('POST', f'/messages/{message_id}/like', viewer,
+                dict(liked='false'))
+    state.likes.add((viewer, message_id))
+    return ('POST', f'/messages/{message_id}/like', viewer,
+            dict(liked='true'))
+
+
+def follow_toggle(state, rng):
+    viewer, user_id = state.viewer(rng), state.user(rng)
+    if user_id == viewer:
+        return homepage(state, rng)
+    if (viewer, user_id) in state.follows:
+        state.follows.remove((viewer, user_id))
+        return 'POST', f'/users/stop-following/{user_id}', viewer, None
+    state.follows.add((viewer, user_id))
+    return 'POST', f'/users/follow/{user_id}', viewer, None
+
+
+def messages_add(state, rng):
+    return ('POST', '/messages/new', state.viewer(rng),
+            dict(text=f'Benchmark post {rng.getrandbits(32)}'))
+
+
+# (scenario, relative weight)
+WORKLOAD = [
+    (homepage, 30),
+    (homepage_anon, 5),
+    (users_show, 20),
+    (list_users, 5),
+    (search_users, 5),
+    (messages_show, 10),
+    (like_toggle, 12),
+    (follow_toggle, 5),
+    (messages_add, 8),
+]
+
+
+##############################################################################
+# Drivers
+
+class TestClientDriver:
+    """Send requests through Flask's test client."""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess.pop(CURR_USER_KEY, None)
+            if user_id is not None:
+                sess[CURR_USER_KEY] = user_id
+
+    def send(self, method, path, data):
+        resp = self.client.open(path, method=method, data=data,
+                                headers={'Referer': '/'})
+        return resp.status_code
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerDriver:
+    """Send requests over HTTP to the app in a real WSGI server thread."""
+
+    def __init__(self):
+        self.server = make_server('127.0.0.1', 0, app,
+                                  request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie = None
+
+    def login(self, user_id):
+        if user_id is None:
+            self.cookie = None
+        else:
+            value = self.serializer.dumps({CURR_USER_KEY: user_id})
+            self.cookie = f'{app.session_cookie_name}={value}'
+
+    def send(self, method, path, data):
+        conn = http.client.HTTPConnection('127.0.0.1',
+                                          self.server.server_address[1])
+        headers = {'Referer': '/'}
+        body = None
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn.request(method, path, body, headers)
+        resp = conn.getresponse()
+        resp.read()
+        conn.close()
+        return resp.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+##############################################################################
+# Measurement and reporting
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of `values`."""
+
+    ordered = sorted(values)
+    rank = max(math.ceil(fraction * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class RequestStatements:
+    """SQL statements run by the last request, as counted in `g` by
+    metrics.py, so ones from other threads are left out."""
+
+    def __init__(self):
+        self.last = 0
+        request_finished.connect(self.finished, app)
+
+    def finished(self, sender, response, **extra):
+        self.last = g.get('sql_statements', 0)
+
+    def close(self):
+        request_finished.disconnect(self.finished, app)
+
+
+def run_workload(driver, state, count, rng):
+    """Replay `count` requests; return {route: [(seconds, sql, status)]}."""
+
+    scenarios = [scenario for scenario, weight in WORKLOAD]
+    weights = [weight for scenario, weight in WORKLOAD]
+    samples = {}
+    statements = RequestStatements()
+
+    try:
+        for _ in range(count):
+            scenario = rng.choices(scenarios, weights)[0]
+            method, path, user_id, data = scenario(state, rng)
+            driver.login(user_id)
+
+            statements.last = 0
+            start = time.perf_counter()
+            status = driver.send(method, path, data)
+            elapsed = time.perf_counter() - start
+
+            samples.setdefault(scenario.__name__, []).append(
+                (elapsed, statements.last, status))
+    finally:
+        statements.close()
+
+    return samples
+
+
+def summarize(samples, wall_seconds):
+    """Per-route statistics from `run_workload` samples."""
+
+    routes = {}
+    for route, rows in sorted(samples.items()):
+        seconds = [row[0] for row in rows]
+        routes[route] = dict(
+            requests=len(rows),
+            errors=sum(1 for row in rows if row[2] >= 500),
+            rps=len(rows) / sum(seconds),
+            p50_ms=percentile(seconds, .50) * 1000,
+            p95_ms=percentile(seconds, .95) * 1000,
+            p99_ms=percentile(seconds, .99) * 1000,
+            sql=sum(row[1] for row in rows) / len(rows),
+        )
+
+    total = sum(len(rows) for rows in samples.values())
+    return dict(routes=routes, requests=total,
+                rps=total / wall_seconds if wall_seconds else 0.0)
+
+
+def format_report(summary):
+    lines = [f"{'route':<16}{'reqs':>7}{'err':>5}{'req/s':>9}"
+             f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql':>7}"]
+    for route, stats in summary['routes'].items():
+        lines.append(f"{route:<16}{stats['requests']:>7}{stats['errors']:>5}"
+                     f"{stats['rps']:>9.1f}{stats['p50_ms']:>9.2f}"
+                     f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+                     f"{stats['sql']:>7.2f}")
+    lines.append(f"{summary['requests']} requests, "
+                 f"{summary['rps']:.1f} req/s overall")
+    return '\n'.join(lines)
+
+
+def compare(summary, baseline, tolerance, sql_tolerance=0.05):
+    """Regressions of `summary` against `baseline`, as messages.
+
+    `tolerance` and `sql_tolerance` are the fractional growth allowed in a
+    route's p95 latency and SQL statements per request.
+    """
+
+    problems = []
+    if summary.get('dataset') != baseline.get('dataset'):
+        problems.append('baseline was recorded with different dataset flags: '
+                        f"{baseline.get('dataset')}")
+        return problems
+
+    for route, stats in summary['routes'].items():
+        if stats['errors']:
+            problems.append(f"{route}: {stats['errors']} server errors")
+
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        if stats['sql'] > before['sql'] * (1 + sql_tolerance):
+            problems.append(f"{route}: {stats['sql']:.2f} SQL statements per "
+                            f"request, was {before['sql']:.2f}")
+        if stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            problems.append(f"{route}: p95 {stats['p95_ms']:.2f} ms, was "
+                            f"{before['p95_ms']:.2f} ms")
+    return problems
+
+
+def benchmark(options):
+    """Seed, warm up and run the workload; return the summary."""
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    # the cheapest bcrypt cost, for seeding: the workload never logs in
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+    with app.app_context():
+        if not options.skip_seed:
+            seed_dataset(options)
+        state = WorkloadState(options)
+
+    rng = random.Random(options.seed)
+    driver = ServerDriver() if options.server else TestClientDriver()
+    try:
+        run_workload(driver, state, options.warmup, rng)
+        start = time.perf_counter()
+        samples = run_workload(driver, state, options.requests, rng)
+        wall = time.perf_counter() - start
+    finally:
+        driver.close()
+
+    summary = summarize(samples, wall)
+    summary['dataset'] = {flag: getattr(options, flag)
+                          for flag in DATASET_FLAGS}
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark Warbler's routes with a mixed workload.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20,
+                        help="mean follows per user")
+    parser.add_argument('--likes', type=int, default=20,
+                        help="mean likes per user")
+    parser.add_argument('--viewers', type=int, default=50,
+                        help="users the logged-in requests are made as")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the dataset from the previous run")
+    parser.add_argument('--server', action='store_true',
+                        help="drive a real WSGI server over HTTP")
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed fractional p95 growth per route")
+    parser.add_argument('--sql-tolerance', type=float, default=0.05,
+                        help="allowed fractional growth in SQL statements "
+                             "per request per route")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    summary = benchmark(options)
+    print(format_report(summary))
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {options.baseline}")
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print(f"No baseline at {options.baseline}; "
+              f"record one with --save-baseline")
+        return 0
+
+    with open(options.baseline) as f:
+        problems = compare(summary, json.load(f), options.tolerance,
+                           options.sql_tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Response compression middleware.
+
+CompressionMiddleware wraps the WSGI app and compresses response bodies
+with brotli (if the brotli package is installed) or gzip, whichever the
+client's Accept-Encoding prefers. Only content types listed in
+COMPRESSION_MIN_SIZE are compressed, and only bodies at least that many
+bytes long: small responses aren't worth the CPU and images and fonts are
+already compressed. Responses that already carry a Content-Encoding (the
+precompressed assets) or ask for `no-transform` are left alone.
+
+A response with a Content-Length is compressed in one go and gets a new
+Content-Length. A streamed response is buffered only until it reaches the
+size threshold, then compressed chunk by chunk, flushing after each one so
+the client still sees the page arrive as it is produced. Data an app
+passes to the legacy WSGI `write()` callable is taken as the start of the
+body.
+
+Compression ratio, bytes in and out and the CPU time spent compressing
+are exported as metrics.
+"""
+
+import time
+import zlib
+from itertools import chain
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_options_header
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_RATIO = metrics.Histogram(
+    'warbler_compression_ratio',
+    'Compressed size as a fraction of the original, per response.',
+    ['encoding'], buckets=(.05, .1, .15, .2, .3, .4, .5, .6, .8, 1))
+
+COMPRESSION_CPU_SECONDS = metrics.Histogram(
+    'warbler_compression_cpu_seconds',
+    'CPU time spent compressing a response.',
+    ['encoding'], buckets=(.0001, .00025, .0005, .001, .0025, .005, .01,
+                           .025, .05, .1))
+
+COMPRESSION_BYTES = metrics.Counter(
+    'warbler_compression_bytes',
+    'Response body bytes before ("in") and after ("out") compression.',
+    ['encoding', 'direction'])
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, config):
+        # wbits 31: a gzip header and trailer around the deflate stream
+        self._zlib = zlib.compressobj(config['COMPRESSION_GZIP_LEVEL'],
+                                      zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._zlib.compress(data)
+
+    def flush(self):
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._zlib.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, config):
+        self._brotli = brotli.Compressor(
+            quality=config['COMPRESSION_BROTLI_QUALITY'])
+
+    def compress(self, data):
+        return self._brotli.process(data)
+
+    def flush(self):
+        return self._brotli.flush()
+
+    def finish(self):
+        return self._brotli.finish()
+
+
+# most preferred first, when the client likes them equally
+ENCODERS = [GzipEncoder] if brotli is None else [BrotliEncoder, GzipEncoder]
+
+
+def negotiate(accept_encoding):
+    """The encoder class the client prefers, or None."""
+
+    accept = parse_accept_header(accept_encoding)
+    best = accept.best_match([encoder.name for encoder in ENCODERS])
+    for encoder in ENCODERS:
+        if encoder.name == best:
+            return encoder
+    return None
+
+
+class CompressedBody:
+    """The body of one response, compressed if it qualifies."""
+
+    def __init__(self, body, response, start_response, encoder, config,
+                 written=()):
+        self.body = body
+        self.written = written
+        self.response = response
+        self.start_response = start_response
+        self.encoder = encoder
+        self.config = config
+        self.cpu_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+    def threshold(self, status, headers):
+        """Smallest body worth compressing, or None to send it as it is."""
+
+        code = int(status.split(None, 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return None
+        if 'Content-Encoding' in headers:
+            return None
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return None
+
+        mimetype = parse_options_header(headers.get('Content-Type', ''))[0]
+        return self.config['COMPRESSION_MIN_SIZE'].get(mimetype)
+
+    def __iter__(self):
+        chunks = chain(self.written, self.body)
+
+        # apps that start the response lazily do so by their first chunk
+        pending = _first(chunks) if not self.response else []
+
+        status, header_list, exc_info = self.response
+        headers = Headers(header_list)
+        threshold = self.threshold(status, headers)
+        length = headers.get('Content-Length', type=int)
+
+        if threshold is None or (length is not None and length < threshold):
+            self.start_response(status, header_list, exc_info)
+            yield from pending
+            yield from chunks
+            return
+
+        # buffer until the body is big enough to be worth compressing
+        size = sum(len(chunk) for chunk in pending)
+        while size < threshold:
+            chunk = next(chunks, None)
+            if chunk is None:
+                self.start_response(status, header_list, exc_info)
+                yield from pending
+                return
+            pending.append(chunk)
+            size += len(chunk)
+
+        if length is not None:
+            # the whole body is in memory anyway: compress it in one go
+            pending.extend(chunks)
+            body = (self.run(self.encoder.compress, b''.join(pending))
+                    + self.run(self.encoder.finish))
+            self.set_headers(headers, len(body))
+            self.start_response(status, headers.to_wsgi_list(), exc_info)
+            self.record()
+            yield body
+            return
+
+        self.set_headers(headers, None)
+        self.start_response(status, headers.to_wsgi_list(), exc_info)
+        for chunk in chain(pending, chunks):
+            if chunk:
+                yield (self.run(self.encoder.compress, chunk)
+                       + self.run(self.encoder.flush))
+        yield self.run(self.encoder.finish)
+        self.record()
+
+    def run(self, operation, data=None):
+        """Run an encoder operation, counting its bytes and CPU time."""
+
+        start = time.thread_time()
+        if data is None:
+            out = operation()
+        else:
+            self.bytes_in += len(data)
+            out = operation(data)
+        self.cpu_seconds += time.thread_time() - start
+        self.bytes_out += len(out)
+        return out
+
+    def set_headers(self, headers, length):
+        headers['Content-Encoding'] = self.encoder.name
+        headers.remove('Accept-Ranges')
+        if length is None:
+            headers.remove('Content-Length')
+        else:
+            headers['Content-Length'] = str(length)
+
+        vary = [value.strip() for value in headers.get('Vary', '').split(',')
+                if value.strip()]
+        if 'accept-encoding' not in (value.lower() for value in vary):
+            headers['Vary'] = ', '.join(vary + ['Accept-Encoding'])
+
+        # the encoded bytes differ, so a strong validator no longer holds
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+
+    def record(self):
+        name = self.encoder.name
+        if self.bytes_in:
+            COMPRESSION_RATIO.observe(self.bytes_out / self.bytes_in,
+                                      encoding=name)
+        COMPRESSION_CPU_SECONDS.observe(self.cpu_seconds, encoding=name)
+        COMPRESSION_BYTES.inc(self.bytes_in, encoding=name, direction='in')
+        COMPRESSION_BYTES.inc(self.bytes_out, encoding=name, direction='out')
+
+
+def _first(chunks):
+    """The first chunk of `chunks`, as a list of zero or one."""
+
+    for chunk in chunks:
+        return [chunk]
+    return []
+
+
+class CompressionMiddleware:
+    """Compress `app`'s responses for clients that accept it."""
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.config = config
+
+    def __call__(self, environ, start_response):
+        encoder = negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoder is None or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        response = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return written.append
+
+        body = self.wsgi_app(environ, capture)
+        return CompressedBody(body, response, start_response,
+                              encoder(self.config), self.config, written)
+
+
+def init_app(app):
+    """Compress `app`'s responses."""
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config)
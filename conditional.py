@@ -0,0 +1,234 @@
+"""HTTP conditional requests and per-route Cache-Control.
+
+Routes decorated with `validated(stamp)` compute their validators from
+cheap version stamps before doing any work: `stamp(**view_args)` reads a
+few columns (profile and like/follow versions, counters, the latest message
+id) and returns the parts of the ETag and the Last-Modified time. A request
+whose If-None-Match or If-Modified-Since still matches gets a 304 without
+the view running or its template being rendered.
+
+The ETag is weak, since the compressed and uncompressed bodies differ, and
+covers the logged-in viewer as well as the page: their navbar and their
+like and follow buttons. Last-Modified is only sent once a whole second
+has passed since the last change, so a change later in that same second
+can't hide behind an If-Modified-Since for it.
+
+Every response gets the Cache-Control policy configured for its endpoint
+in CACHE_CONTROL, or CACHE_CONTROL_DEFAULT, unless the view chose one for
+this response in `g.cache_control`. Pages seen by a logged-in user
+are always marked private.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from werkzeug.datastructures import ResponseCacheControl
+from werkzeug.http import is_resource_modified, parse_cache_control_header
+
+from models import db, Message, User
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+# Columns whose values are shown on a user's profile, or decide which like
+# and follow buttons they see.
+STAMP_COLUMNS = (User.id, User.profile_version, User.messages_count,
+                 User.followers_count, User.following_count,
+                 User.likes_count, User.likes_version, User.follows_version,
+                 User.updated_at)
+
+
+class Validators:
+    """What a page's ETag is derived from, and when it last changed."""
+
+    def __init__(self, parts, last_modified=None):
+        self.parts = parts
+        self.last_modified = last_modified
+
+    def etag(self):
+        digest = hashlib.sha1(repr((release(), self.parts)).encode())
+        return digest.hexdigest()[:32]
+
+
+def release():
+    """Stamp of the deployed templates; a new release changes every ETag."""
+
+    return current_app.extensions['conditional_release']
+
+
+def user_stamps(*user_ids):
+    """{user id: stamp row} for those of `user_ids` that exist."""
+
+    rows = (db.session
+            .query(*STAMP_COLUMNS)
+            .filter(User.id.in_(set(user_ids)))
+            .all())
+    return {row.id: row for row in rows}
+
+
+def stamp_users(user_id):
+    """Stamps of `user_id` and of the viewer, or None if either is gone.
+
+    The viewer's include the navbar as this worker renders it from its
+    identity cache.
+    """
+
+    if not g.get('user'):
+        stamps = user_stamps(user_id)
+        return (stamps[user_id], None) if user_id in stamps else None
+
+    stamps = user_stamps(user_id, g.user.id)
+    if user_id not in stamps or g.user.id not in stamps:
+        return None
+    return (stamps[user_id],
+            (stamps[g.user.id], g.user.username, g.user.image_url))
+
+
+def latest(*times):
+    """The latest of `times`, or None if any is unknown."""
+
+    if None in times:
+        return None
+    return max(times)
+
+
+##############################################################################
+# Stamps for each route
+
+def profile_stamp(user_id):
+    """Validators for a user's profile page, or None if there's no such
+    user."""
+
+    stamps = stamp_users(user_id)
+    if stamps is None:
+        return None
+    user, viewer = stamps
+
+    newest = (db.session
+              .query(Message.id)
+              .filter(Message.user_id == user_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(1)
+              .scalar())
+
+    times = [user.updated_at] + ([viewer[0].updated_at] if viewer else [])
+    return Validators((user, newest, viewer), latest(*times))
+
+
+def message_stamp(message_id):
+    """Validators for a message's page, or None if there's no such
+    message."""
+
+    message = (db.session
+               .query(Message.id, Message.user_id, Message.timestamp,
+                      Message.like_count)
+               .filter(Message.id == message_id)
+               .first())
+    if message is None:
+        return None
+
+    stamps = stamp_users(message.user_id)
+    if stamps is None:
+        return None
+    author, viewer = stamps
+
+    times = ([message.timestamp, author.updated_at]
+             + ([viewer[0].updated_at] if viewer else []))
+    return Validators((tuple(message), author.profile_version, viewer),
+                      latest(*times))
+
+
+##############################################################################
+# Applying validators and policies
+
+def validated(stamp):
+    """Decorate a view to answer conditional requests from `stamp`."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # a 304 would swallow pending flashed messages
+            if (request.method not in CONDITIONAL_METHODS
+                    or '_flashes' in session):
+                return view(**kwargs)
+
+            validators = stamp(**kwargs)
+            if validators is None:
+                return view(**kwargs)
+
+            etag = validators.etag()
+            last_modified = settled(validators.last_modified)
+
+            if is_resource_modified(request.environ, etag=etag,
+                                    last_modified=last_modified):
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = current_app.response_class(status=304)
+
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
+def settled(last_modified):
+    """`last_modified` if it is a whole second in the past, else None."""
+
+    if last_modified is None:
+        return None
+
+    last_modified = last_modified.replace(microsecond=0)
+    if last_modified + timedelta(seconds=1) > datetime.utcnow():
+        return None
+    return last_modified
+
+
+def apply_cache_control(response):
+    """Set the Cache-Control policy for the current endpoint."""
+
+    config = current_app.config
+    policy = g.get('cache_control') or config['CACHE_CONTROL'].get(
+        request.endpoint, config['CACHE_CONTROL_DEFAULT'])
+    cache_control = parse_cache_control_header(policy,
+                                               cls=ResponseCacheControl)
+    # whether anyone is logged in, without loading them: even static
+    # files would cost a query for the user otherwise
+    if g.get('user') is not None and not cache_control.no_store:
+        cache_control.public = False
+        cache_control.private = True
+
+    response.headers['Cache-Control'] = cache_control.to_header()
+    if cache_control.no_store:
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    else:
+        # send_file's own Expires would contradict the policy
+        response.expires = None
+    return response
+
+
+def template_digest(app):
+    """Digest of every template's source and of the asset URLs they
+    link to."""
+
+    digest = hashlib.sha1()
+    for name in sorted(app.jinja_env.list_templates(extensions=['html'])):
+        source, filename, uptodate = app.jinja_loader.get_source(
+            app.jinja_env, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+    digest.update(repr(sorted(app.extensions['assets'].files.items()))
+                  .encode())
+    return digest.hexdigest()
+
+
+def init_app(app):
+    """Stamp `app`'s release for its ETags; call after assets.init_app."""
+
+    app.extensions['conditional_release'] = (
+        app.config['CACHE_RELEASE'] or template_digest(app))
@@ -0,0 +1,171 @@
+"""Denormalized per-user counters.
+
+`users.messages_count`, `followers_count`, `following_count` and
+`likes_count` are adjusted with relative UPDATEs (`col = col + n`) inside
+the transaction that changes what they count, so concurrent requests never
+lose an increment. `repair_counters()` recomputes them all from scratch.
+
+Every adjustment also stamps `users.updated_at`, and a change to
+`likes_count` or `following_count` bumps `likes_version` or
+`follows_version`, which conditional.py builds its validators from.
+
+`messages.like_count` is written behind instead (see likes.py), and
+`repair_like_counts()` reconciles it with the likes table.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from models import Follows, Likes, Message, User
+
+# counter -> the version column bumped whenever it changes
+VERSIONS = {
+    'likes_count': User.likes_version,
+    'following_count': User.follows_version,
+}
+
+
+def stamped(values, *versions):
+    """`values` for an UPDATE of users, also bumping `versions` and
+    `updated_at`."""
+
+    values = dict(values)
+    for version in versions:
+        values[version] = version + 1
+    values[User.updated_at] = datetime.utcnow()
+    return values
+
+
+def adjust(user_id, **deltas):
+    """Add `deltas` (counter name -> amount) to one user's counters."""
+
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+    versions = [VERSIONS[name] for name in deltas if name in VERSIONS]
+
+    (User
+     .query
+     .filter(User.id == user_id)
+     .update(stamped(values, *versions), synchronize_session=False))
+
+
+def adjust_many(name, deltas):
+    """Add `deltas` (user id -> amount) to many users' `name` counter, with
+    one UPDATE per distinct amount."""
+
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(user_id)
+
+    column = getattr(User, name)
+    versions = [VERSIONS[name]] if name in VERSIONS else []
+    for delta, user_ids in sorted(by_delta.items()):
+        (User
+         .query
+         .filter(User.id.in_(user_ids))
+         .update(stamped({column: column + delta}, *versions),
+                 synchronize_session=False))
+
+
+def message_deleted(message):
+    """Adjust counters for a message that is about to be deleted.
+
+    Its likes go with it through the foreign key cascade, so everyone who
+    liked it loses one from `likes_count` too.
+    """
+
+    adjust(message.user_id, messages_count=-1)
+
+    likers = select([Likes.user_id]).where(Likes.message_id == message.id)
+    (User
+     .query
+     .filter(User.id.in_(likers))
+     .update(stamped({User.likes_count: User.likes_count - 1},
+                     User.likes_version),
+             synchronize_session=False))
+
+
+def user_deleted(user_id):
+    """Adjust other users' counters for a user that is about to be deleted."""
+
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user_id))
+    (User
+     .query
+     .filter(User.id.in_(followed))
+     .update(stamped({User.followers_count: User.followers_count - 1}),
+             synchronize_session=False))
+
+    followers = (select([Follows.user_following_id])
+                 .where(Follows.user_being_followed_id == user_id))
+    (User
+     .query
+     .filter(User.id.in_(followers))
+     .update(stamped({User.following_count: User.following_count - 1},
+                     User.follows_version),
+             synchronize_session=False))
+
+    liked = Likes.__table__.join(Message.__table__,
+                                 Message.id == Likes.message_id)
+    likers = (select([Likes.user_id])
+              .select_from(liked)
+              .where(Message.user_id == user_id))
+    lost_likes = (select([func.count()])
+                  .select_from(liked)
+                  .where(Likes.user_id == User.id)
+                  .where(Message.user_id == user_id)
+                  .as_scalar())
+    (User
+     .query
+     .filter(User.id.in_(likers), User.id != user_id)
+     .update(stamped({User.likes_count: User.likes_count - lost_likes},
+                     User.likes_version),
+             synchronize_session=False))
+
+
+def repair_counters():
+    """Recompute every user's counters, and every message's like count,
+    from the underlying tables."""
+
+    def count(table, column):
+        return (select([func.count()])
+                .select_from(table)
+                .where(column == User.id)
+                .as_scalar())
+
+    (User
+     .query
+     .update(stamped({
+         User.messages_count: count(Message.__table__, Message.user_id),
+         User.followers_count: count(Follows.__table__,
+                                     Follows.user_being_followed_id),
+         User.following_count: count(Follows.__table__,
+                                     Follows.user_following_id),
+         User.likes_count: count(Likes.__table__, Likes.user_id),
+     }), synchronize_session=False))
+
+    repair_like_counts()
+
+
+def repair_like_counts(first_id=None, last_id=None):
+    """Recompute the like counts of messages (with ids from `first_id` to
+    `last_id`) that have drifted; return how many were fixed."""
+
+    likes = (select([func.count()])
+             .select_from(Likes.__table__)
+             .where(Likes.message_id == Message.id)
+             .as_scalar())
+
+    query = Message.query.filter(Message.like_count != likes)
+    if first_id is not None:
+        query = query.filter(Message.id >= first_id)
+    if last_id is not None:
+        query = query.filter(Message.id <= last_id)
+    return query.update({Message.like_count: likes},
+                        synchronize_session=False)
@@ -0,0 +1,419 @@
+"""Read-optimized index of who follows whom.
+
+With NumPy installed, each worker keeps the follow graph as two CSR
+(compressed sparse row) arrays: for every user id, a sorted slice of the ids
+they follow, and another of their followers. "Does A follow B?" is a binary
+search in A's slice, and the users on a page a viewer follows are a sorted
+intersection with it. Follower and following counts come from the
+denormalized columns on users (see counters.py), not from here.
+
+Snapshots are written under FOLLOW_GRAPH_FOLDER (`flask build-follow-graph`,
+e.g. at deploy and from cron) and memory-mapped, so workers share one copy
+in the page cache. Each worker loads the newest snapshot from a background
+thread started on first use, checks for a newer one every
+FOLLOW_GRAPH_REFRESH_SECONDS, and builds and writes one itself (one worker
+at a time) once the newest is half FOLLOW_GRAPH_MAX_AGE old. Follows and
+unfollows committed in a worker are applied to its index as they happen.
+
+Other workers' changes only arrive with the next snapshot, so the index is
+stale after FOLLOW_GRAPH_MAX_AGE, and for a user who followed or unfollowed
+anyone since it was built (their session is stamped). Lookups then, and
+without NumPy, use SQL instead.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+
+from flask import has_request_context, session
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from metrics import Counter, Gauge
+from models import db, Follows
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SESSION_KEY = 'follow_changes'
+CHANGED_KEY = 'follows_changed_at'
+CURRENT = 'CURRENT'
+ARRAYS = ('out_indptr', 'out_indices', 'in_indptr', 'in_indices')
+
+# follows fetched at a time while building
+FETCH_ROWS = 100000
+# snapshots kept on disk, so workers still reading an older one can finish
+KEEP_SNAPSHOTS = 2
+
+FOLLOW_GRAPH_LOOKUPS = Counter(
+    'warbler_follow_graph_lookups',
+    'Follow relationship lookups, by what answered them.',
+    ['source'])
+
+FOLLOW_GRAPH_AGE = Gauge(
+    'warbler_follow_graph_age_seconds',
+    'Age of the follow graph snapshot this worker has loaded.')
+
+FOLLOW_GRAPH_EDGES = Gauge(
+    'warbler_follow_graph_edges',
+    'Follows in the follow graph snapshot this worker has loaded.')
+
+
+##############################################################################
+# The graph
+
+def compress(rows, columns, size):
+    """CSR arrays (indptr, indices) of the edges `rows` -> `columns`, for
+    row ids below `size`; each row's columns are sorted."""
+
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, columns[order].astype(np.int32)
+
+
+class FollowGraph:
+    """Snapshot of the follows table as CSR arrays, plus the changes made
+    since it was built."""
+
+    def __init__(self, arrays, built_at):
+        self.out_indptr, self.out_indices, self.in_indptr, self.in_indices = (
+            arrays[name] for name in ARRAYS)
+        self.built_at = built_at
+        # user id -> {other user id: (following?, when)}
+        self._out = defaultdict(dict)
+        self._in = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_edges(cls, followers, followed, built_at):
+        """Graph of the follows `followers[i]` -> `followed[i]`."""
+
+        followers = np.asarray(followers, dtype=np.int32)
+        followed = np.asarray(followed, dtype=np.int32)
+        size = int(max(followers.max(initial=0), followed.max(initial=0))) + 1
+        out_indptr, out_indices = compress(followers, followed, size)
+        in_indptr, in_indices = compress(followed, followers, size)
+        return cls(dict(out_indptr=out_indptr, out_indices=out_indices,
+                        in_indptr=in_indptr, in_indices=in_indices), built_at)
+
+    @classmethod
+    def build(cls, conn):
+        """Graph of every follow, read on `conn`."""
+
+        built_at = time.time()
+        result = conn.execute(select([Follows.user_following_id,
+                                      Follows.user_being_followed_id]))
+        chunks = [np.zeros((0, 2), dtype=np.int32)]
+        while True:
+            rows = result.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int32))
+        edges = np.concatenate(chunks)
+        return cls.from_edges(edges[:, 0], edges[:, 1], built_at)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map the snapshot saved in `path`."""
+
+        with open(os.path.join(path, 'snapshot.json')) as f:
+            built_at = json.load(f)['built_at']
+        return cls({name: np.load(os.path.join(path, f'{name}.npy'),
+                                  mmap_mode='r')
+                    for name in ARRAYS}, built_at)
+
+    def save(self, folder):
+        """Write this snapshot under `folder` and make it the current one."""
+
+        name = f'{self.built_at:.6f}'
+        path = os.path.join(folder, name)
+        os.makedirs(path, exist_ok=True)
+        for array in ARRAYS:
+            np.save(os.path.join(path, f'{array}.npy'), getattr(self, array))
+        with open(os.path.join(path, 'snapshot.json'), 'w') as f:
+            json.dump({'built_at': self.built_at}, f)
+
+        pointer = os.path.join(folder, f'.{CURRENT}.{os.getpid()}')
+        with open(pointer, 'w') as f:
+            f.write(name)
+        os.replace(pointer, os.path.join(folder, CURRENT))
+
+        old = sorted((entry for entry in os.listdir(folder)
+                      if not entry.startswith('.') and entry != CURRENT),
+                     key=float)[:-KEEP_SNAPSHOTS]
+        for entry in old:
+            shutil.rmtree(os.path.join(folder, entry), ignore_errors=True)
+        return path
+
+    def __len__(self):
+        return len(self.out_indices)
+
+    def _row(self, indptr, indices, user_id):
+        if not 0 <= user_id < len(indptr) - 1:
+            return indices[:0]
+        return indices[indptr[user_id]:indptr[user_id + 1]]
+
+    def _merged(self, indptr, indices, changes, user_id):
+        row = self._row(indptr, indices, user_id)
+        with self._lock:
+            changed = dict(changes.get(user_id, ()))
+        if not changed:
+            return row
+        removed = [id for id, (on, _) in changed.items() if not on]
+        added = [id for id, (on, _) in changed.items() if on]
+        return np.union1d(np.setdiff1d(row, removed),
+                          np.array(added, dtype=np.int32))
+
+    def following(self, user_id):
+        """Sorted ids of the users `user_id` follows."""
+
+        return self._merged(self.out_indptr, self.out_indices, self._out,
+                            user_id)
+
+    def followers(self, user_id):
+        """Sorted ids of the users following `user_id`."""
+
+        return self._merged(self.in_indptr, self.in_indices, self._in,
+                            user_id)
+
+    def _base_follows(self, follower_id, followed_id):
+        row = self._row(self.out_indptr, self.out_indices, follower_id)
+        i = np.searchsorted(row, followed_id)
+        return bool(i < len(row) and row[i] == followed_id)
+
+    def is_following(self, follower_id, followed_id):
+        change = self._out.get(follower_id, {}).get(followed_id)
+        if change is not None:
+            return change[0]
+        return self._base_follows(follower_id, followed_id)
+
+    def apply(self, follower_id, followed_id, following, at):
+        """Record that `follower_id` started or stopped following
+        `followed_id` at `at`."""
+
+        base = self._base_follows(follower_id, followed_id)
+        with self._lock:
+            if following == base:
+                self._out[follower_id].pop(followed_id, None)
+                self._in[followed_id].pop(follower_id, None)
+            else:
+                self._out[follower_id][followed_id] = (following, at)
+                self._in[followed_id][follower_id] = (following, at)
+
+    def replay(self, older):
+        """Apply the changes made to `older` since this snapshot was
+        built."""
+
+        with older._lock:
+            changes = [(follower_id, followed_id, on, at)
+                       for follower_id, row in older._out.items()
+                       for followed_id, (on, at) in row.items()]
+        for follower_id, followed_id, on, at in changes:
+            if at >= self.built_at:
+                self.apply(follower_id, followed_id, on, at)
+
+
+##############################################################################
+# This worker's index
+
+def latest_snapshot(folder):
+    """Path of the current snapshot in `folder`, or None."""
+
+    try:
+        with open(os.path.join(folder, CURRENT)) as f:
+            return os.path.join(folder, f.read().strip())
+    except OSError:
+        return None
+
+
+class FollowGraphIndex:
+    """This worker's FollowGraph, kept fresh by a background thread started
+    on first use (so each forked worker gets its own)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.graph = None
+        self.path = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def current(self):
+        """The graph, unless it is missing or older than
+        FOLLOW_GRAPH_MAX_AGE."""
+
+        if not self.app.config['FOLLOW_GRAPH_ENABLED']:
+            return None
+        self._start()
+        graph = self.graph
+        if graph is None:
+            return None
+        age = time.time() - graph.built_at
+        FOLLOW_GRAPH_AGE.set(age)
+        if age > self.app.config['FOLLOW_GRAPH_MAX_AGE']:
+            return None
+        return graph
+
+    def apply(self, changes, at):
+        graph = self.graph
+        if graph is not None:
+            for follower_id, followed_id, following in changes:
+                graph.apply(follower_id, followed_id, following, at)
+
+    def refresh(self):
+        """Load a newer snapshot, or build one if the newest is getting old;
+        return the graph."""
+
+        config = self.app.config
+        folder = config['FOLLOW_GRAPH_FOLDER']
+        with self._refresh_lock:
+            graph = loaded = self.graph
+            try:
+                path = latest_snapshot(folder)
+                if path and path != self.path:
+                    newest = FollowGraph.load(path)
+                    if graph is None or newest.built_at > graph.built_at:
+                        loaded, self.path = newest, path
+                if (loaded is None or time.time() - loaded.built_at
+                        > config['FOLLOW_GRAPH_MAX_AGE'] / 2):
+                    loaded = self.build(folder) or loaded
+            except (OSError, ValueError, KeyError, SQLAlchemyError):
+                self.app.logger.exception('Could not refresh the follow graph')
+
+            if loaded is not graph:
+                if graph is not None:
+                    loaded.replay(graph)
+                self.graph = loaded
+                FOLLOW_GRAPH_EDGES.set(len(loaded))
+            return self.graph
+
+    def build(self, folder):
+        """Build and save a snapshot, unless another worker is; return it or
+        None."""
+
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, '.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            with db.engine.connect() as conn:
+                graph = FollowGraph.build(conn)
+            self.path = graph.save(folder)
+            return graph
+
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='follow-graph',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # refresh() logs what it expects to go wrong; anything else
+            # mustn't end the thread and leave the index to go stale
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception:
+                self.app.logger.exception('Follow graph refresh failed')
+            time.sleep(self.app.config['FOLLOW_GRAPH_REFRESH_SECONDS'])
+
+
+def index():
+    """This worker's fresh FollowGraph, or None if lookups should use
+    SQL."""
+
+    indexes = db.get_app().extensions.get('follow_graph')
+    graph = indexes.current() if indexes else None
+    if graph is None:
+        return None
+    if has_request_context() and session.get(CHANGED_KEY, 0) >= graph.built_at:
+        return None
+    return graph
+
+
+##############################################################################
+# Lookups
+
+def following_among(follower_id, user_ids):
+    """Subset of `user_ids` that `follower_id` is following."""
+
+    if not user_ids:
+        return set()
+
+    graph = index()
+    if graph is not None:
+        FOLLOW_GRAPH_LOOKUPS.inc(source='index')
+        found = np.intersect1d(graph.following(follower_id),
+                               np.fromiter(user_ids, dtype=np.int64,
+                                           count=len(user_ids)))
+        return set(found.tolist())
+
+    FOLLOW_GRAPH_LOOKUPS.inc(source='sql')
+    rows = (db.session
+            .query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == follower_id,
+                    Follows.user_being_followed_id.in_(user_ids))
+            .all())
+    return {row[0] for row in rows}
+
+
+def is_following(follower_id, followed_id):
+    """Does `follower_id` follow `followed_id`?"""
+
+    graph = index()
+    if graph is not None:
+        FOLLOW_GRAPH_LOOKUPS.inc(source='index')
+        return graph.is_following(follower_id, followed_id)
+
+    FOLLOW_GRAPH_LOOKUPS.inc(source='sql')
+    return Follows.query.get((followed_id, follower_id)) is not None
+
+
+##############################################################################
+# Setup
+
+def record(session, changes):
+    """Note `changes` ((follower id, followed id, following?) triples) to
+    apply to the index once `session` commits."""
+
+    session.info.setdefault(SESSION_KEY, []).extend(changes)
+
+
+def _committed(db_session):
+    changes = db_session.info.pop(SESSION_KEY, None)
+    if not changes:
+        return
+
+    now = time.time()
+    indexes = db.get_app().extensions.get('follow_graph')
+    if indexes:
+        indexes.apply(changes, now)
+    if has_request_context():
+        # this user's own follows may be missing from other workers' indexes
+        session[CHANGED_KEY] = now
+
+
+def _rolled_back(db_session):
+    db_session.info.pop(SESSION_KEY, None)
+
+
+def init_app(app):
+    """Answer `app`'s follow lookups from the index, if NumPy is
+    installed and FOLLOW_GRAPH_ENABLED."""
+
+    if np is not None:
+        app.extensions['follow_graph'] = FollowGraphIndex(app)
+    event.listen(Session, 'after_commit', _committed)
+    event.listen(Session, 'after_rollback', _rolled_back)
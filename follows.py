@@ -0,0 +1,160 @@
+"""Following and unfollowing users, one follow or thousands at a time.
+
+`set_following` makes a follow exist or not with a single statement that is
+safe to repeat, like likes.set_liked: an INSERT ... SELECT that skips an
+existing follow (ON CONFLICT DO NOTHING on PostgreSQL, INSERT OR IGNORE on
+SQLite) or a DELETE. Neither loads the follower's `following` collection,
+and counters and the home timeline only change when a row did.
+
+`import_follows` adds many follows at once, e.g. for an account migrating
+from another site: one multi-row INSERT per IMPORT_BATCH follows, skipping
+follows that exist and users that don't, then one counter UPDATE per
+distinct change (see counters.adjust_many) and one INSERT per IMPORT_BATCH
+follows to backfill the followers' timelines.
+"""
+
+from collections import Counter
+
+from sqlalchemy import literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, Follows, User
+import counters
+import followgraph
+import timeline
+
+# follows per INSERT, and user ids per lookup, when importing
+IMPORT_BATCH = 1000
+
+COLUMNS = ['user_following_id', 'user_being_followed_id']
+
+
+def is_postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def insert_follow(follower_id, followed_id):
+    """INSERT of `follower_id` following `followed_id`, if that user exists
+    and the follow doesn't."""
+
+    followed = (select([literal(follower_id, db.Integer), User.id])
+                .where(User.id == followed_id))
+
+    if is_postgresql():
+        return (pg_insert(Follows.__table__)
+                .from_select(COLUMNS, followed)
+                .on_conflict_do_nothing(index_elements=COLUMNS))
+
+    return (Follows.__table__
+            .insert()
+            .from_select(COLUMNS, followed)
+            .prefix_with('OR IGNORE', dialect='sqlite'))
+
+
+def set_following(follower_id, followed_id, following):
+    """Make `follower_id` follow `followed_id` or not; return the number of
+    follows added (1), removed (-1) or 0 if it already was that way. The
+    caller commits.
+
+    Raises ValueError for a user following themselves.
+    """
+
+    if following and follower_id == followed_id:
+        raise ValueError("Users can't follow themselves.")
+
+    if following:
+        changed = db.session.execute(insert_follow(follower_id,
+                                                   followed_id)).rowcount
+    else:
+        changed = -(Follows
+                    .query
+                    .filter(Follows.user_following_id == follower_id,
+                            Follows.user_being_followed_id == followed_id)
+                    .delete(synchronize_session=False))
+
+    counters.adjust(follower_id, following_count=changed)
+    counters.adjust(followed_id, followers_count=changed)
+    if changed:
+        followgraph.record(db.session,
+                           [(follower_id, followed_id, changed > 0)])
+    if changed > 0:
+        timeline.backfill(follower_id, followed_id)
+    elif changed < 0:
+        timeline.prune(follower_id, followed_id)
+        timeline.refill([followed_id], follower_id)
+    return changed
+
+
+def user_exists(user_id):
+    return db.session.query(
+        User.query.filter(User.id == user_id).exists()).scalar()
+
+
+##############################################################################
+# Importing
+
+def existing_users(user_ids):
+    """Those of `user_ids` that are users."""
+
+    user_ids = sorted(user_ids)
+    found = set()
+    for start in range(0, len(user_ids), IMPORT_BATCH):
+        found.update(id for id, in (db.session
+                                    .query(User.id)
+                                    .filter(User.id.in_(
+                                        user_ids[start:start + IMPORT_BATCH]))))
+    return found
+
+
+def insert_follows(edges):
+    """Insert the (follower id, followed id) `edges` that don't exist yet,
+    in one statement; return those that were added."""
+
+    table = Follows.__table__
+    rows = [dict(zip(COLUMNS, edge)) for edge in edges]
+
+    if is_postgresql():
+        statement = (pg_insert(table)
+                     .values(rows)
+                     .on_conflict_do_nothing(index_elements=COLUMNS)
+                     .returning(table.c.user_following_id,
+                                table.c.user_being_followed_id))
+        return [tuple(row) for row in db.session.execute(statement)]
+
+    # no RETURNING here, but SQLite writes one transaction at a time, so
+    # the follows that exist now are the ones the INSERT will skip
+    existing = set(db.session
+                   .query(Follows.user_following_id,
+                          Follows.user_being_followed_id)
+                   .filter(Follows.user_following_id.in_(
+                               {follower for follower, _ in edges}),
+                           Follows.user_being_followed_id.in_(
+                               {followed for _, followed in edges})))
+    db.session.execute(table.insert().values(rows).prefix_with('OR IGNORE'))
+    return [edge for edge in edges if edge not in existing]
+
+
+def import_follows(edges):
+    """Add the follows in `edges` ((follower id, followed id) pairs) that
+    don't exist yet, between users that do, skipping users following
+    themselves; return how many were added. The caller commits."""
+
+    edges = {(int(follower), int(followed)) for follower, followed in edges}
+    edges = {edge for edge in edges if edge[0] != edge[1]}
+    users = existing_users({id for edge in edges for id in edge})
+    edges = sorted(edge for edge in edges
+                   if edge[0] in users and edge[1] in users)
+
+    added = []
+    for start in range(0, len(edges), IMPORT_BATCH):
+        added += insert_follows(edges[start:start + IMPORT_BATCH])
+
+    counters.adjust_many('following_count',
+                         Counter(follower for follower, _ in added))
+    counters.adjust_many('followers_count',
+                         Counter(followed for _, followed in added))
+    followgraph.record(db.session, [(follower_id, followed_id, True)
+                                    for follower_id, followed_id in added])
+    for start in range(0, len(added), IMPORT_BATCH):
+        timeline.backfill_many(added[start:start + IMPORT_BATCH])
+    return len(added)
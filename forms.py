@@ -1,8 +1,12 @@
 from typing import Text
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length
 
+IMAGE_FILES = FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'],
+                          'Images must be JPEG, PNG, GIF or WebP.')
+
 
 class MessageForm(FlaskForm):
     """Form for adding/editing messages."""
@@ -16,6 +20,7 @@ class UserAddForm(FlaskForm):
     email = StringField('E-mail', validators=[DataRequired(), Email()])
     password = PasswordField('Password', validators=[Length(min=6)])
     image_url = StringField('(Optional) Image URL')
+    image = FileField('(Optional) Upload an image', validators=[IMAGE_FILES])
 
 class UserUpdateForm(FlaskForm):
     """Form for updating users."""
@@ -23,7 +28,10 @@ class UserUpdateForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = StringField('E-mail', validators=[DataRequired(), Email()])
     image_url = StringField('(Optional) Image URL')
+    image = FileField('(Optional) Upload an image', validators=[IMAGE_FILES])
     header_image_url = StringField('(Optional) Header Image URL')
+    header_image = FileField('(Optional) Upload a header image',
+                             validators=[IMAGE_FILES])
     bio = TextAreaField('(Optional) Bio')
     password = PasswordField('Confirm Password', validators=[DataRequired(), Length(min=6)])
 
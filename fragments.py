@@ -0,0 +1,131 @@
+"""Rendered-fragment cache for message cards.
+
+A message's text, author and timestamp never change after it is posted, so
+the card markup from `includes/message_card.html` is rendered once per
+message and kept in a bounded, per-process LRU cache. Entries are stamped
+with the author's `profile_version`; a profile update bumps it, so cards
+showing the old username or avatar are re-rendered on their next use.
+
+Anything that depends on the viewer (the like star) is left out of the
+cached markup: the card is stored as the HTML before and after a slot,
+and `includes/show_message.html` renders the viewer's bits in between.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import Markup, current_app
+
+from metrics import Counter, Gauge
+
+CARD_TEMPLATE = 'includes/message_card.html'
+VIEWER_SLOT = '<!-- viewer -->'
+
+MessageCard = namedtuple('MessageCard', ['head', 'tail'])
+
+CACHE_REQUESTS = Counter(
+    'warbler_fragment_cache_requests',
+    'Message card fragment cache lookups.',
+    ['result'])
+
+CACHE_ENTRIES = Gauge(
+    'warbler_fragment_cache_entries',
+    'Message cards held in the fragment cache.')
+
+
+class FragmentCache:
+    """Thread-safe LRU map of message id -> (profile version, card)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, message_id, version):
+        """Cached card for `message_id` at `version`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(message_id)
+                self.hits += 1
+                CACHE_REQUESTS.inc(result='hit')
+                return entry[1]
+
+            self.misses += 1
+            CACHE_REQUESTS.inc(result='miss')
+            return None
+
+    def set(self, message_id, version, card):
+        with self._lock:
+            self._entries[message_id] = (version, card)
+            self._entries.move_to_end(message_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def evict(self, message_id):
+        """Forget the card for `message_id`, e.g. once it is deleted."""
+
+        with self._lock:
+            self._entries.pop(message_id, None)
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        """Drop every card and reset the hit/miss counts."""
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            CACHE_ENTRIES.set(0)
+
+    def stats(self):
+        """Hit/miss counts and current size."""
+
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        entries=len(self._entries),
+                        max_entries=self.max_entries)
+
+
+def render_card(message):
+    """Render the viewer-independent parts of `message`'s card."""
+
+    template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+    html = template.render(message=message, viewer_slot=Markup(VIEWER_SLOT))
+    head, tail = html.split(VIEWER_SLOT)
+    return MessageCard(Markup(head), Markup(tail))
+
+
+def message_card(message):
+    """Cached card for `message`, rendering it on a miss."""
+
+    cache = current_app.extensions['fragment_cache']
+    version = message.user.profile_version
+
+    card = cache.get(message.id, version)
+    if card is None:
+        card = render_card(message)
+        cache.set(message.id, version, card)
+    return card
+
+
+def evict_message(message_id):
+    """Drop a deleted message's card from this process's cache."""
+
+    current_app.extensions['fragment_cache'].evict(message_id)
+
+
+def init_app(app):
+    """Create the app's fragment cache and expose `message_card` to
+    templates."""
+
+    app.extensions['fragment_cache'] = FragmentCache(
+        app.config['FRAGMENT_CACHE_SIZE'])
+    app.jinja_env.globals['message_card'] = message_card
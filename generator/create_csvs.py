@@ -2,76 +2,237 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --users 10000000 --messages 200000000 \\
+        --follows 500000000 --likes 1000000000 --out /data/warbler
+
+Output is reproducible: the same flags and --seed give byte-identical
+files, whatever --workers is. No network access is needed.
+
+Rows are generated in shards of --shard-size ids. Each shard is written by
+a worker process to its own part file and the parts are concatenated in
+order, so memory use stays flat however large the dataset is.
+
+- follows: each user follows a lognormally distributed number of others,
+  picked by a power law over a hidden popularity ranking, so a few users
+  have huge followings and most have a handful.
+- messages: authors are drawn by a power law over activity; timestamps
+  grow denser towards --end (by e ** --growth) and follow a daily cycle.
+- likes: each user likes a lognormal number of messages, drawn by a power
+  law so some messages go viral.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+import shutil
+from datetime import datetime
+from multiprocessing import Pool
+
 from faker import Faker
-from helpers import get_random_datetime
+from faker.providers.lorem.en_US import Provider as LoremProvider
+
+from helpers import (HEADER_IMAGE_URLS, Scatter, power_law_rank,
+                     skewed_count, skewed_datetime)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password',
+                     'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
+# Power-law exponents for who gets followed, who posts and what gets liked.
+FOLLOW_EXPONENT = 1.1
+POST_EXPONENT = 0.9
+LIKE_EXPONENT = 1.2
 
-# Generate random profile image URLs to use for users
+WORDS = LoremProvider.word_list
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
+def shard_random(options, table, shard):
+    """RNG for one shard of one table, independent of worker count."""
+
+    return random.Random(f"{options.seed}:{table}:{shard}")
+
+
+def id_range(shard, options, total):
+    """Ids (1-based) covered by `shard` out of `total`."""
+
+    first = shard * options.shard_size + 1
+    return range(first, min(first + options.shard_size, total + 1))
+
+
+def random_text(rng):
+    """A warble of lorem words, at most MAX_WARBLER_LENGTH characters."""
+
+    words = rng.choices(WORDS, k=rng.randint(3, 24))
+    return (' '.join(words).capitalize() + '.')[:MAX_WARBLER_LENGTH]
+
+
+def user_rows(options, shard, rng):
+    fake = Faker()
+    fake.seed_instance(rng.getrandbits(32))
+
+    for user_id in id_range(shard, options, options.users):
+        # user_name() never contains '_', so the suffix keeps it unique
+        username = f"{fake.user_name()}_{user_id}"
+        yield [user_id,
+               f"{username}@{fake.free_email_domain()}",
+               username,
+               rng.choice(IMAGE_URLS),
+               PASSWORD_HASH,
+               random_text(rng),
+               rng.choice(HEADER_IMAGE_URLS),
+               fake.city()]
+
+
+def message_rows(options, shard, rng):
+    authors = Scatter(options.users, options.seed + 1)
+
+    for message_id in id_range(shard, options, options.messages):
+        author = authors(power_law_rank(rng, options.users, POST_EXPONENT))
+        timestamp = skewed_datetime(rng, options.start, options.end,
+                                    options.growth)
+        yield [message_id, random_text(rng), timestamp, author]
+
+
+def distinct_draws(rng, count, n, exponent, scatter, exclude=None):
+    """Up to `count` distinct ids from 1..n drawn by a power law."""
+
+    chosen = set()
+    attempts = 0
+    while len(chosen) < count and attempts < count * 4:
+        attempts += 1
+        drawn = scatter(power_law_rank(rng, n, exponent))
+        if drawn != exclude:
+            chosen.add(drawn)
+    return sorted(chosen)
+
+
+def follow_rows(options, shard, rng):
+    popularity = Scatter(options.users, options.seed)
+    mean = options.follows / options.users
+
+    for follower in id_range(shard, options, options.users):
+        count = skewed_count(rng, mean, limit=options.users - 1)
+        for followed in distinct_draws(rng, count, options.users,
+                                       FOLLOW_EXPONENT, popularity,
+                                       exclude=follower):
+            yield [followed, follower]
+
+
+def like_rows(options, shard, rng):
+    if not options.messages:
+        return
+
+    virality = Scatter(options.messages, options.seed + 2)
+    mean = options.likes / options.users
+
+    for user_id in id_range(shard, options, options.users):
+        count = skewed_count(rng, mean, limit=options.messages)
+        for message_id in distinct_draws(rng, count, options.messages,
+                                         LIKE_EXPONENT, virality):
+            yield [user_id, message_id]
+
+
+# table -> (headers, row generator, option giving the number of shards)
+TABLES = {
+    'users': (USERS_CSV_HEADERS, user_rows, 'users'),
+    'messages': (MESSAGES_CSV_HEADERS, message_rows, 'messages'),
+    'follows': (FOLLOWS_CSV_HEADERS, follow_rows, 'users'),
+    'likes': (LIKES_CSV_HEADERS, like_rows, 'users'),
+}
+
+
+def part_path(options, table, shard):
+    return os.path.join(options.out, '.parts', f"{table}.{shard:06d}.csv")
+
+
+def write_shard(job):
+    """Write one shard of one table to its part file."""
+
+    options, table, shard = job
+    headers, rows, _ = TABLES[table]
+    rng = shard_random(options, table, shard)
+
+    with open(part_path(options, table, shard), 'w', newline='') as part:
+        csv.writer(part).writerows(rows(options, shard, rng))
+    return table, shard
+
+
+def shard_count(options, table):
+    total = getattr(options, TABLES[table][2])
+    return -(-total // options.shard_size)
+
+
+def generate(options):
+    os.makedirs(os.path.join(options.out, '.parts'), exist_ok=True)
+
+    jobs = [(options, table, shard)
+            for table in TABLES
+            for shard in range(shard_count(options, table))]
+
+    with Pool(options.workers) as pool:
+        for done, (table, shard) in enumerate(
+                pool.imap_unordered(write_shard, jobs), 1):
+            print(f"\r{done}/{len(jobs)} shards", end='', flush=True)
+    print()
+
+    for table, (headers, _, _) in TABLES.items():
+        with open(os.path.join(options.out, f"{table}.csv"), 'w',
+                  newline='') as out:
+            csv.writer(out).writerow(headers)
+            for shard in range(shard_count(options, table)):
+                path = part_path(options, table, shard)
+                with open(path, newline='') as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(path)
+
+    os.rmdir(os.path.join(options.out, '.parts'))
+
+
+def parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate Warbler CSVs for seeding and load testing.")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000,
+                        help="approximate total number of follows")
+    parser.add_argument('--likes', type=int, default=2000,
+                        help="approximate total number of likes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', type=parse_date,
+                        default=parse_date('2016-01-01'),
+                        help="earliest message date (YYYY-MM-DD)")
+    parser.add_argument('--end', type=parse_date,
+                        default=parse_date('2018-01-01'),
+                        help="latest message date (YYYY-MM-DD)")
+    parser.add_argument('--growth', type=float, default=2.0,
+                        help="messages per day grow by e ** GROWTH "
+                             "from --start to --end")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shard-size', type=int, default=100000)
+    parser.add_argument('--out', default=os.path.dirname(
+        os.path.abspath(__file__)))
+    return parser.parse_args(argv)
+
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    generate(parse_args())
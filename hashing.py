@@ -0,0 +1,175 @@
+"""Password hashing for Warbler.
+
+bcrypt is slow on purpose, so hashing runs in a small per-process thread
+pool (bcrypt releases the GIL) instead of on the request thread. That puts
+a ceiling on how much CPU a burst of logins can take away from other
+routes. The pool is bounded: once HASHING_MAX_PENDING hashes are queued or
+running, new work raises HashingBusy and the app answers 503 rather than
+piling up requests behind it.
+
+The work factor is BCRYPT_LOG_ROUNDS. Hashes made with a different cost
+are rehashed on the next successful login (see `needs_rehash`), and
+`flask benchmark-hashing` picks the highest cost that fits a latency
+budget on the current hardware.
+"""
+
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from flask_bcrypt import Bcrypt
+
+from metrics import BCRYPT_SECONDS, Counter, Gauge, Histogram
+
+bcrypt = Bcrypt()
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 64
+
+HASHING_PENDING = Gauge(
+    'warbler_hashing_pending',
+    'Password hashes queued or running in the hashing pool.')
+
+HASHING_WAIT_SECONDS = Histogram(
+    'warbler_hashing_wait_seconds',
+    'Time a password hash waited for a pool worker.')
+
+HASHING_REJECTED = Counter(
+    'warbler_hashing_rejected',
+    'Password hashes refused because the pool was full.')
+
+HASHING_REHASHED = Counter(
+    'warbler_hashing_rehashed',
+    'Stored hashes upgraded to the current cost on login.')
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool already has too much work queued."""
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def log_rounds():
+    """The configured bcrypt work factor."""
+
+    return _config('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+
+
+class HashingPool:
+    """Bounded thread pool for bcrypt work."""
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def run(self, operation, fn, *args):
+        """Run `fn(*args)` on a pool worker and wait for its result."""
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                HASHING_REJECTED.inc()
+                raise HashingBusy()
+            self._pending += 1
+            HASHING_PENDING.inc()
+
+        submitted = time.perf_counter()
+
+        def job():
+            HASHING_WAIT_SECONDS.observe(time.perf_counter() - submitted)
+            with BCRYPT_SECONDS.time(operation=operation):
+                return fn(*args)
+
+        try:
+            return self._executor.submit(job).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            HASHING_PENDING.dec()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """This process's hashing pool, started on first use so forked workers
+    each get their own threads."""
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashingPool(_config('HASHING_WORKERS', DEFAULT_WORKERS),
+                                _config('HASHING_MAX_PENDING',
+                                        DEFAULT_MAX_PENDING))
+        return _pool
+
+
+def _hash(password, rounds):
+    return bcrypt.generate_password_hash(password, rounds).decode('UTF-8')
+
+
+def hash_password(password):
+    """bcrypt hash of `password` at the configured cost."""
+
+    return pool().run('hash', _hash, password, log_rounds())
+
+
+def check_password(hashed, password):
+    """Does `password` match the stored `hashed`?"""
+
+    return pool().run('check', bcrypt.check_password_hash, hashed, password)
+
+
+def hash_cost(hashed):
+    """Work factor a stored hash was made with ('$2b$12$...' -> 12)."""
+
+    return int(hashed.split('$')[2])
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a different cost than the configured one?"""
+
+    return hash_cost(hashed) != log_rounds()
+
+
+def rehash(user, password):
+    """Rehash `user`'s password at the current cost, after `password` was
+    checked against it. The caller commits."""
+
+    user.password = hash_password(password)
+    HASHING_REHASHED.inc()
+
+
+def benchmark(budget_seconds, rounds=range(4, 17), samples=3):
+    """Time bcrypt at each cost in `rounds` on this machine.
+
+    Returns ([(cost, median seconds)...], the highest cost whose median
+    fits `budget_seconds`). Stops once a cost is over budget, since each
+    step doubles the time.
+    """
+
+    timings = []
+    best = None
+    for cost in rounds:
+        times = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            _hash('benchmark password', cost)
+            times.append(time.perf_counter() - start)
+
+        median = statistics.median(times)
+        timings.append((cost, median))
+        if median > budget_seconds:
+            break
+        best = cost
+
+    return timings, best
@@ -0,0 +1,316 @@
+"""Liking and unliking messages, and messages' like counts.
+
+`set_liked` makes a like exist or not with a single statement that is safe
+to repeat: an INSERT ... SELECT that skips an existing like (ON CONFLICT DO
+NOTHING on PostgreSQL, INSERT OR IGNORE on SQLite) or a DELETE. The liker's
+`likes_count` moves by the number of rows the statement changed, so a
+double click or a retried request can neither fail on `_like_uc` nor count
+a like twice.
+
+`messages.like_count` is written behind. A hot message would otherwise
+have every like in the site queue on its row lock, so once the transaction
+that changed a like commits, the change is added to this worker's
+LikeCountAggregator. A background thread writes the pending changes with a
+few batched UPDATEs (one per distinct delta) every LIKE_COUNT_FLUSH_SECONDS,
+or as soon as LIKE_COUNT_FLUSH_SIZE messages have changes pending, and
+stamps the authors' `updated_at` so their profiles' ETags change. Pages
+show the stored count plus this worker's pending change.
+
+Changes still pending when a worker is killed are lost, and a reconciliation
+run racing other workers' flushes can be off by their changes in flight:
+`flask reconcile-like-counts`, run periodically (e.g. from cron), recomputes
+the counts that drifted, a batch of messages at a time. The age of the
+oldest pending change is exported as the flush lag.
+"""
+
+import atexit
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from metrics import Counter, Gauge, Histogram
+from models import db, Likes, Message, User
+import counters
+
+SESSION_KEY = 'like_count_deltas'
+
+# ids per UPDATE ... WHERE id IN (...)
+UPDATE_BATCH = 1000
+
+LIKE_COUNT_PENDING = Gauge(
+    'warbler_like_count_pending',
+    'Messages with like count changes not yet written.')
+
+LIKE_COUNT_FLUSH_LAG = Gauge(
+    'warbler_like_count_flush_lag_seconds',
+    'Age of the oldest like count change not yet written.')
+
+LIKE_COUNT_FLUSH_DELAY = Histogram(
+    'warbler_like_count_flush_delay_seconds',
+    'Age of the oldest change written, per flush.',
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+LIKE_COUNT_FLUSHED = Counter(
+    'warbler_like_count_flushed',
+    'Message like counts written by the aggregator.')
+
+LIKE_COUNT_FLUSH_ERRORS = Counter(
+    'warbler_like_count_flush_errors',
+    'Like count flushes that failed and were retried later.')
+
+
+##############################################################################
+# Likes
+
+def insert_like(user_id, message_id):
+    """INSERT of `user_id`'s like of `message_id`, if the message exists
+    and the like doesn't."""
+
+    columns = ['user_id', 'message_id']
+    liked = (select([literal(user_id, db.Integer), Message.id])
+             .where(Message.id == message_id))
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return (pg_insert(Likes.__table__)
+                .from_select(columns, liked)
+                .on_conflict_do_nothing(index_elements=columns))
+
+    return (Likes.__table__
+            .insert()
+            .from_select(columns, liked)
+            .prefix_with('OR IGNORE', dialect='sqlite'))
+
+
+def set_liked(user_id, message_id, liked):
+    """Make `user_id` like `message_id` or not; return the number of likes
+    added (1), removed (-1) or 0 if it already was that way. The caller
+    commits."""
+
+    if liked:
+        changed = db.session.execute(insert_like(user_id,
+                                                 message_id)).rowcount
+    else:
+        changed = -(Likes
+                    .query
+                    .filter(Likes.user_id == user_id,
+                            Likes.message_id == message_id)
+                    .delete(synchronize_session=False))
+
+    counters.adjust(user_id, likes_count=changed)
+    if changed:
+        deltas = db.session.info.setdefault(SESSION_KEY, {})
+        deltas[message_id] = deltas.get(message_id, 0) + changed
+    return changed
+
+
+def message_exists(message_id):
+    return db.session.query(
+        Message.query.filter(Message.id == message_id).exists()).scalar()
+
+
+##############################################################################
+# Like counts
+
+class LikeCountBuffer:
+    """Thread-safe map of message id -> like count change not yet
+    written."""
+
+    def __init__(self):
+        self._deltas = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def add(self, deltas, since=None):
+        """Add `deltas` (message id -> change), pending since `since`
+        (default: now)."""
+
+        since = time.monotonic() if since is None else since
+        with self._lock:
+            for message_id, delta in deltas.items():
+                total = self._deltas.get(message_id, 0) + delta
+                if total:
+                    self._deltas[message_id] = total
+                else:
+                    self._deltas.pop(message_id, None)
+            if self._deltas and (self._oldest is None
+                                 or since < self._oldest):
+                self._oldest = since
+            LIKE_COUNT_PENDING.set(len(self._deltas))
+
+    def pending(self, message_id):
+        return self._deltas.get(message_id, 0)
+
+    def lag(self):
+        """Seconds since the oldest pending change."""
+
+        oldest = self._oldest
+        return 0 if oldest is None else time.monotonic() - oldest
+
+    def take(self):
+        """Remove and return (every pending change, when the oldest was
+        made)."""
+
+        with self._lock:
+            deltas, oldest = self._deltas, self._oldest
+            self._deltas, self._oldest = {}, None
+            LIKE_COUNT_PENDING.set(0)
+        return deltas, oldest
+
+
+def write_like_counts(conn, deltas):
+    """Apply `deltas` (message id -> change) to messages' like counts, and
+    stamp their authors."""
+
+    by_delta = defaultdict(list)
+    for message_id, delta in deltas.items():
+        by_delta[delta].append(message_id)
+
+    messages = Message.__table__
+    for delta, message_ids in sorted(by_delta.items()):
+        for start in range(0, len(message_ids), UPDATE_BATCH):
+            conn.execute(messages
+                         .update()
+                         .where(messages.c.id.in_(
+                             message_ids[start:start + UPDATE_BATCH]))
+                         .values(like_count=messages.c.like_count + delta))
+
+    authors = (select([messages.c.user_id])
+               .where(messages.c.id.in_(list(deltas)))
+               .distinct())
+    conn.execute(User.__table__
+                 .update()
+                 .where(User.__table__.c.id.in_(authors))
+                 .values(updated_at=datetime.utcnow()))
+
+
+class LikeCountAggregator:
+    """Buffers committed like count changes and writes them behind, from a
+    background thread started on first use (so each forked worker gets its
+    own)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.buffer = LikeCountBuffer()
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def add(self, deltas):
+        self.buffer.add(deltas)
+        self._start()
+        if len(self.buffer) >= self.app.config['LIKE_COUNT_FLUSH_SIZE']:
+            self._wake.set()
+
+    def pending(self, message_id):
+        return self.buffer.pending(message_id)
+
+    def flush(self):
+        """Write every pending change now; return how many messages'
+        counts were written."""
+
+        with self._flush_lock:
+            deltas, oldest = self.buffer.take()
+            if not deltas:
+                return 0
+
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        write_like_counts(conn, deltas)
+            except SQLAlchemyError:
+                # keep them for the next flush
+                self.buffer.add(deltas, oldest)
+                LIKE_COUNT_FLUSH_ERRORS.inc()
+                return 0
+
+            LIKE_COUNT_FLUSH_DELAY.observe(time.monotonic() - oldest)
+            LIKE_COUNT_FLUSHED.inc(len(deltas))
+            LIKE_COUNT_FLUSH_LAG.set(self.buffer.lag())
+            return len(deltas)
+
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='like-counts',
+                                                daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        interval = self.app.config['LIKE_COUNT_FLUSH_SECONDS']
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            LIKE_COUNT_FLUSH_LAG.set(self.buffer.lag())
+            self.flush()
+
+
+def aggregator():
+    return current_app.extensions['like_counts']
+
+
+def like_count(message):
+    """`message`'s like count, including this worker's pending changes."""
+
+    return message.like_count + aggregator().pending(message.id)
+
+
+def current_like_count(message_id):
+    """Like count of `message_id`, as `like_count` shows it."""
+
+    stored = (db.session
+              .query(Message.like_count)
+              .filter(Message.id == message_id)
+              .scalar())
+    return (stored or 0) + aggregator().pending(message_id)
+
+
+def reconcile(batch_size, echo=print):
+    """Recompute drifted like counts, `batch_size` message ids per
+    transaction; return how many were fixed."""
+
+    fixed = 0
+    last_id = db.session.query(func.max(Message.id)).scalar() or 0
+    for start in range(1, last_id + 1, batch_size):
+        end = start + batch_size - 1
+        changed = counters.repair_like_counts(start, end)
+        db.session.commit()
+        if changed:
+            echo(f'messages {start}-{end}: fixed {changed} like counts')
+        fixed += changed
+    return fixed
+
+
+##############################################################################
+# Setup
+
+def _committed(session):
+    deltas = session.info.pop(SESSION_KEY, None)
+    if deltas:
+        aggregator().add(deltas)
+
+
+def _rolled_back(session):
+    session.info.pop(SESSION_KEY, None)
+
+
+def init_app(app):
+    """Write `app`'s like count changes behind, once they commit, and
+    expose `like_count` to templates."""
+
+    app.extensions['like_counts'] = LikeCountAggregator(app)
+    app.jinja_env.globals['like_count'] = like_count
+    event.listen(Session, 'after_commit', _committed)
+    event.listen(Session, 'after_rollback', _rolled_back)
@@ -0,0 +1,299 @@
+"""Bulk-load the generator CSVs into PostgreSQL with COPY.
+
+Each CSV is streamed through `COPY ... FROM STDIN` in chunks of
+`chunk_rows` rows. Every chunk commits together with its progress row in
+`load_progress`, so an interrupted load picks up after the last committed
+chunk with `--resume`.
+
+A full load recreates the schema, then drops the loaded tables' secondary
+indexes, unique constraints and foreign keys before copying and rebuilds
+them once the data is in, which is far cheaper than maintaining them row by
+row. Their definitions are read from the catalog and kept in
+`load_deferred_ddl` until they are rebuilt, so a resumed load restores them
+too.
+
+An incremental load leaves existing rows and indexes alone: each chunk is
+copied into a temporary staging table and inserted with ON CONFLICT DO
+NOTHING, so re-loading rows that already exist is harmless.
+
+Afterwards the serial sequences are moved past the loaded ids and the
+derived data (counters, timelines, search index) is rebuilt.
+"""
+
+import csv
+import io
+import os
+import time
+from collections import deque
+from itertools import islice
+
+import click
+
+from models import db
+import counters
+import migrations
+import search
+import timeline
+
+# Tables in dependency order, and the generator file each is loaded from.
+LOAD_ORDER = (
+    ('users', 'users.csv'),
+    ('messages', 'messages.csv'),
+    ('follows', 'follows.csv'),
+    ('likes', 'likes.csv'),
+)
+
+SERIAL_TABLES = ('users', 'messages')
+
+DEFAULT_CHUNK_ROWS = 100000
+
+PROGRESS_DDL = """
+CREATE TABLE IF NOT EXISTS load_progress (
+    table_name text PRIMARY KEY,
+    mode text NOT NULL,
+    rows_loaded bigint NOT NULL DEFAULT 0,
+    finished boolean NOT NULL DEFAULT false
+)"""
+
+DEFERRED_DDL = """
+CREATE TABLE IF NOT EXISTS load_deferred_ddl (
+    position serial PRIMARY KEY,
+    name text NOT NULL,
+    drop_sql text NOT NULL,
+    create_sql text NOT NULL
+)"""
+
+# Foreign keys first, so unique constraints and indexes can be dropped.
+DEFERRABLE_CONSTRAINTS = """
+SELECT c.conname,
+       format('ALTER TABLE %%I DROP CONSTRAINT %%I', t.relname, c.conname),
+       format('ALTER TABLE %%I ADD CONSTRAINT %%I %%s', t.relname, c.conname,
+              pg_get_constraintdef(c.oid))
+FROM pg_constraint c
+JOIN pg_class t ON t.oid = c.conrelid
+WHERE t.relname = ANY(%s)
+  AND pg_table_is_visible(t.oid)
+  AND c.contype IN ('f', 'u')
+ORDER BY c.contype = 'u', c.conname"""
+
+# Indexes that don't back a primary key or unique constraint.
+DEFERRABLE_INDEXES = """
+SELECT i.relname,
+       format('DROP INDEX %%I', i.relname),
+       pg_get_indexdef(i.oid)
+FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_class t ON t.oid = x.indrelid
+WHERE t.relname = ANY(%s)
+  AND pg_table_is_visible(t.oid)
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                  WHERE c.conindid = x.indexrelid
+                    AND c.contype IN ('p', 'u', 'x'))
+ORDER BY i.relname"""
+
+
+def load_files(directory):
+    """(table, path) for each generator CSV present in `directory`."""
+
+    return [(table, os.path.join(directory, filename))
+            for table, filename in LOAD_ORDER
+            if os.path.exists(os.path.join(directory, filename))]
+
+
+def read_chunks(path, chunk_rows, skip=0):
+    """Yield (columns, CSV buffer, row count) for `path`, `chunk_rows` rows
+    at a time, after skipping the first `skip` data rows."""
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        deque(islice(reader, skip), maxlen=0)
+
+        while True:
+            rows = list(islice(reader, chunk_rows))
+            if not rows:
+                return
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            yield columns, buffer, len(rows)
+
+
+def column_list(table, columns):
+    """Quoted column list for `table`, refusing headers the table lacks."""
+
+    known = db.metadata.tables[table].c
+    unknown = [name for name in columns if name not in known]
+    if unknown:
+        raise click.ClickException(
+            f"{table}: unknown columns in CSV header: {', '.join(unknown)}")
+    return ', '.join(f'"{name}"' for name in columns)
+
+
+def copy_chunk(cursor, table, columns, buffer, incremental):
+    """COPY one chunk into `table`; return how many rows were added."""
+
+    cols = column_list(table, columns)
+
+    if not incremental:
+        cursor.copy_expert(
+            f'COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv)', buffer)
+        return cursor.rowcount
+
+    staging = f'load_staging_{table}'
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging} '
+                   f'(LIKE {table} INCLUDING DEFAULTS) '
+                   f'ON COMMIT DELETE ROWS')
+    cursor.copy_expert(
+        f'COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)', buffer)
+    cursor.execute(f'INSERT INTO {table} ({cols}) '
+                   f'SELECT {cols} FROM {staging} '
+                   f'ON CONFLICT DO NOTHING')
+    return cursor.rowcount
+
+
+def defer_constraints(cursor, tables):
+    """Record and drop the secondary indexes and non-primary constraints on
+    `tables`."""
+
+    cursor.execute(DEFERRABLE_CONSTRAINTS, (list(tables),))
+    deferred = cursor.fetchall()
+    cursor.execute(DEFERRABLE_INDEXES, (list(tables),))
+    deferred += cursor.fetchall()
+
+    for name, drop_sql, create_sql in deferred:
+        cursor.execute('INSERT INTO load_deferred_ddl '
+                       '(name, drop_sql, create_sql) VALUES (%s, %s, %s)',
+                       (name, drop_sql, create_sql))
+        cursor.execute(drop_sql)
+
+
+def restore_constraints(conn, echo):
+    """Rebuild everything `defer_constraints` dropped, in reverse order,
+    committing after each one."""
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT position, name, create_sql FROM load_deferred_ddl '
+                   'ORDER BY position DESC')
+    for position, name, create_sql in cursor.fetchall():
+        start = time.perf_counter()
+        cursor.execute(create_sql)
+        cursor.execute('DELETE FROM load_deferred_ddl WHERE position = %s',
+                       (position,))
+        conn.commit()
+        echo(f'  rebuilt {name} in {time.perf_counter() - start:.1f}s')
+
+
+def reset_sequences(cursor):
+    """Move serial sequences past the highest loaded id."""
+
+    for table in SERIAL_TABLES:
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+
+
+def start_load(conn, files, incremental):
+    """Set up a new load: schema, deferred constraints and progress rows."""
+
+    if not incremental:
+        db.drop_all()
+        db.create_all()
+        migrations.stamp()
+    else:
+        db.create_all()
+
+    cursor = conn.cursor()
+    cursor.execute(PROGRESS_DDL)
+    cursor.execute(DEFERRED_DDL)
+    cursor.execute('TRUNCATE load_progress, load_deferred_ddl')
+
+    if not incremental:
+        defer_constraints(cursor, [table for table, path in LOAD_ORDER])
+
+    mode = 'incremental' if incremental else 'full'
+    for table, path in files:
+        cursor.execute('INSERT INTO load_progress (table_name, mode) '
+                       'VALUES (%s, %s)', (table, mode))
+    conn.commit()
+
+
+def load_table(conn, table, path, chunk_rows, incremental, echo):
+    """Stream one CSV into `table`, resuming after its committed rows."""
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT rows_loaded, finished FROM load_progress '
+                   'WHERE table_name = %s', (table,))
+    rows_loaded, finished = cursor.fetchone()
+    if finished:
+        echo(f'{table}: already loaded ({rows_loaded:,} rows)')
+        return
+
+    if rows_loaded:
+        echo(f'{table}: resuming after {rows_loaded:,} rows')
+
+    start = time.perf_counter()
+    rows_read = 0
+    bytes_read = 0
+    for columns, buffer, count in read_chunks(path, chunk_rows, rows_loaded):
+        bytes_read += len(buffer.getvalue())
+        added = copy_chunk(cursor, table, columns, buffer, incremental)
+        cursor.execute('UPDATE load_progress '
+                       'SET rows_loaded = rows_loaded + %s '
+                       'WHERE table_name = %s', (count, table))
+        conn.commit()
+
+        rows_read += count
+        elapsed = time.perf_counter() - start
+        echo(f'{table}: {rows_loaded + rows_read:,} rows '
+             f'(+{added:,} new, {rows_read / elapsed:,.0f} rows/s, '
+             f'{bytes_read / elapsed / 1e6:.1f} MB/s)')
+
+    cursor.execute('UPDATE load_progress SET finished = true '
+                   'WHERE table_name = %s', (table,))
+    conn.commit()
+
+
+def load(directory, chunk_rows=DEFAULT_CHUNK_ROWS, incremental=False,
+         resume=False, echo=click.echo):
+    """Load the generator CSVs in `directory` into the database."""
+
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('The COPY loader needs PostgreSQL.')
+
+    files = load_files(directory)
+    conn = db.engine.raw_connection()
+    try:
+        if resume:
+            cursor = conn.cursor()
+            cursor.execute(PROGRESS_DDL)
+            cursor.execute('SELECT mode FROM load_progress LIMIT 1')
+            row = cursor.fetchone()
+            if row is None:
+                raise click.ClickException('There is no load to resume.')
+            incremental = row[0] == 'incremental'
+            conn.commit()
+        else:
+            start_load(conn, files, incremental)
+
+        for table, path in files:
+            load_table(conn, table, path, chunk_rows, incremental, echo)
+
+        echo('Rebuilding deferred indexes and constraints')
+        restore_constraints(conn, echo)
+
+        cursor = conn.cursor()
+        reset_sequences(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+
+    echo('Rebuilding counters, timelines and the search index')
+    counters.repair_counters()
+    timeline.rebuild_timelines()
+    search.rebuild_message_index()
+    db.session.commit()
+
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    echo('Done')
@@ -0,0 +1,305 @@
+"""Uploaded avatar and header images.
+
+An uploaded image is stored once under MEDIA_FOLDER, named by the SHA-256
+of its bytes, and resized into the fixed sizes MEDIA_SIZES lists for its
+kind ('avatar' or 'header'). The upload request only reads the image's
+header to check it, saves the original and queues the resizing: that runs
+in a small, bounded per-process thread pool (Pillow releases the GIL while
+it decodes and resamples), like password hashing does.
+
+Thumbnails are served from /media/<digest>/<kind>-<size>.jpg. A path only
+ever has one content, so they are cached for a year (see CACHE_CONTROL).
+Until its thumbnail is written, a path serves the original, uncached.
+
+User.image_url and header_image_url hold the URL of the largest size of an
+upload, or an external URL as before. Templates pick the size they show
+with `thumbnail(url, size)`, which leaves other URLs as they are.
+"""
+
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, current_app, g, send_from_directory, url_for
+
+from metrics import Counter, Gauge, Histogram
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+ORIGINAL = 'original'
+FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+THUMBNAIL_NAME = re.compile(r'^([a-z]+)-([a-z]+)\.jpg$')
+MEDIA_PATH = re.compile(r'^/media/([0-9a-f]{64})/([a-z]+)-[a-z]+\.jpg$')
+
+MEDIA_PENDING = Gauge(
+    'warbler_media_pending',
+    'Uploads queued or being resized in the media pool.')
+
+MEDIA_RESIZE_SECONDS = Histogram(
+    'warbler_media_resize_seconds',
+    'Time spent resizing one upload into its thumbnails.',
+    ['kind'])
+
+MEDIA_REJECTED = Counter(
+    'warbler_media_rejected',
+    'Resizes refused because the media pool was full.')
+
+MEDIA_FAILED = Counter(
+    'warbler_media_failed',
+    'Uploads that passed the header check but could not be decoded.')
+
+
+class InvalidImage(ValueError):
+    """Raised for an upload that isn't an image we accept."""
+
+
+class MediaBusy(Exception):
+    """Raised when the media pool already has too much work queued."""
+
+
+class ResizePool:
+    """Bounded thread pool that resizes uploads in the background."""
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def submit(self, job_id, fn, *args):
+        """Run `fn(*args)` on a pool worker without waiting for it, unless
+        `job_id` is already queued. Returns the job's future."""
+
+        with self._lock:
+            if job_id in self._pending:
+                return self._pending[job_id]
+            if len(self._pending) >= self.max_pending:
+                MEDIA_REJECTED.inc()
+                raise MediaBusy()
+
+            future = self._executor.submit(fn, *args)
+            self._pending[job_id] = future
+            MEDIA_PENDING.inc()
+
+        future.add_done_callback(lambda future: self._done(job_id))
+        return future
+
+    def _done(self, job_id):
+        with self._lock:
+            self._pending.pop(job_id, None)
+        MEDIA_PENDING.dec()
+
+    def join(self):
+        """Wait for every job queued so far."""
+
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """This process's media pool, started on first use so forked workers
+    each get their own threads."""
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ResizePool(current_app.config['MEDIA_WORKERS'],
+                               current_app.config['MEDIA_MAX_PENDING'])
+        return _pool
+
+
+##############################################################################
+# Storing and resizing
+
+def directory(folder, digest):
+    return os.path.join(folder, digest[:2], digest)
+
+
+def write_atomic(path, write):
+    """Call `write(file)` on a temporary file, then move it to `path`, so
+    readers never see a partial file."""
+
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def check(data, max_pixels):
+    """Raise InvalidImage unless `data` is an image in FORMATS of at most
+    `max_pixels`. Only the header is read."""
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            kind, (width, height) = image.format, image.size
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise InvalidImage("That file isn't an image we can read.")
+
+    if kind not in FORMATS:
+        raise InvalidImage('Images must be JPEG, PNG, GIF or WebP.')
+    if width * height > max_pixels:
+        raise InvalidImage('That image is too large.')
+
+
+def flatten(image):
+    """`image` in RGB, with any transparency over white."""
+
+    if image.mode in ('RGBA', 'LA', 'P') and (
+            image.mode != 'P' or 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def resize(folder, digest, kind, sizes, quality):
+    """Write the missing `sizes` of upload `digest` as `kind` thumbnails."""
+
+    path = directory(folder, digest)
+    missing = {size: dimensions for size, dimensions in sizes.items()
+               if not os.path.exists(os.path.join(path, f'{kind}-{size}.jpg'))}
+    if not missing:
+        return
+
+    with MEDIA_RESIZE_SECONDS.time(kind=kind):
+        try:
+            with Image.open(os.path.join(path, ORIGINAL)) as image:
+                # let JPEG decode at the smallest scale that's big enough
+                image.draft('RGB', (max(w for w, h in missing.values()),
+                                    max(h for w, h in missing.values())))
+                if hasattr(ImageOps, 'exif_transpose'):
+                    image = ImageOps.exif_transpose(image)
+                image = flatten(image)
+        except (OSError, SyntaxError, ValueError,
+                Image.DecompressionBombError):
+            MEDIA_FAILED.inc()
+            shutil.rmtree(path, ignore_errors=True)
+            return
+
+        for size, dimensions in missing.items():
+            thumbnail = ImageOps.fit(image, dimensions, Image.LANCZOS)
+            write_atomic(os.path.join(path, f'{kind}-{size}.jpg'),
+                         lambda f: thumbnail.save(f, 'JPEG', quality=quality,
+                                                  optimize=True,
+                                                  progressive=True))
+
+
+def largest(kind):
+    """Name of the biggest size of `kind` images."""
+
+    sizes = current_app.config['MEDIA_SIZES'][kind]
+    return max(sizes, key=lambda size: sizes[size][0] * sizes[size][1])
+
+
+def schedule(digest, kind):
+    """Queue resizing upload `digest` into its `kind` thumbnails."""
+
+    config = current_app.config
+    return pool().submit(f'{digest}/{kind}', resize, config['MEDIA_FOLDER'],
+                         digest, kind, config['MEDIA_SIZES'][kind],
+                         config['MEDIA_JPEG_QUALITY'])
+
+
+def save_upload(upload, kind):
+    """Store `upload` (a FileStorage) as a `kind` image, queue its
+    thumbnails and return the URL of the largest one.
+
+    Raises InvalidImage for files that aren't acceptable images.
+    """
+
+    if Image is None:
+        raise InvalidImage('Image uploads are not available.')
+
+    config = current_app.config
+    limit = config['MEDIA_MAX_BYTES']
+    data = upload.stream.read(limit + 1)
+    if len(data) > limit:
+        raise InvalidImage(f'Images must be at most {limit // 2 ** 20} MB.')
+    check(data, config['MEDIA_MAX_PIXELS'])
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = directory(config['MEDIA_FOLDER'], digest)
+    original = os.path.join(path, ORIGINAL)
+    if not os.path.exists(original):
+        os.makedirs(path, exist_ok=True)
+        write_atomic(original, lambda f: f.write(data))
+
+    schedule(digest, kind)
+    return url_for('media', digest=digest,
+                   filename=f'{kind}-{largest(kind)}.jpg')
+
+
+##############################################################################
+# Serving
+
+def thumbnail(url, size):
+    """`url` at thumbnail `size`, if it's an upload; other URLs as they
+    are."""
+
+    match = MEDIA_PATH.match(url or '')
+    if not match:
+        return url
+
+    digest, kind = match.groups()
+    if size not in current_app.config['MEDIA_SIZES'].get(kind, {}):
+        return url
+    return url_for('media', digest=digest, filename=f'{kind}-{size}.jpg')
+
+
+def send_media(digest, filename):
+    """Send a thumbnail, or its original while it is being resized."""
+
+    config = current_app.config
+    match = THUMBNAIL_NAME.match(filename)
+    if not DIGEST.match(digest) or not match:
+        abort(404)
+    kind, size = match.groups()
+    if size not in config['MEDIA_SIZES'].get(kind, {}):
+        abort(404)
+
+    path = directory(config['MEDIA_FOLDER'], digest)
+    if os.path.exists(os.path.join(path, filename)):
+        return send_from_directory(path, filename)
+
+    original = os.path.join(path, ORIGINAL)
+    if Image is None or not os.path.exists(original):
+        abort(404)
+
+    try:
+        schedule(digest, kind)
+    except MediaBusy:
+        pass
+    with Image.open(original) as image:
+        mimetype = Image.MIME.get(image.format)
+
+    # this URL will serve the thumbnail once it's written
+    g.cache_control = 'no-cache'
+    return send_from_directory(path, ORIGINAL, mimetype=mimetype)
+
+
+def init_app(app):
+    """Serve `app`'s uploads and expose `thumbnail` to templates."""
+
+    app.add_url_rule('/media/<digest>/<filename>', 'media', send_media)
+    app.jinja_env.globals['thumbnail'] = thumbnail
@@ -0,0 +1,336 @@
+"""Prometheus-style metrics for Warbler.
+
+Metrics live in process memory and are exposed in the Prometheus text
+format at /metrics, to scrapers sending METRICS_TOKEN as a bearer token;
+without a token configured, /metrics is not served. Request timing is driven from the app's existing
+before/after request hooks via `start_request()` and `finish_request()`;
+SQL and connection-pool timing come from SQLAlchemy engine events and
+template timing from Flask's template signals.
+"""
+
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, has_app_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+                   5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Metric:
+    """Base for a named metric with optional labels."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(f'{name}="{_escape(value)}"'
+                                 for name, value in pairs)
+
+    def samples(self):
+        """Yield (suffix, label string, value) for every exposed sample."""
+
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {value!r}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing total."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '_total', self._format_labels(key), value
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '', self._format_labels(key), value
+
+
+class Histogram(Metric):
+    """Distribution of observations over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # the extra slot past the last bucket holds observations above it
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[slot] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock time spent inside the block."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ((), 0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield ('_bucket', self._format_labels(key, [('le', bound)]),
+                       cumulative)
+            yield '_sum', self._format_labels(key), total
+            yield '_count', self._format_labels(key), cumulative
+
+
+class Registry:
+    """Every metric exposed at /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+##############################################################################
+# Warbler's metrics
+
+REQUEST_SECONDS = Histogram(
+    'warbler_request_duration_seconds',
+    'Time spent handling a request.',
+    ['endpoint', 'method', 'status'])
+
+REQUEST_SQL_STATEMENTS = Histogram(
+    'warbler_request_sql_statements',
+    'SQL statements executed per request.',
+    ['endpoint'], buckets=COUNT_BUCKETS)
+
+REQUEST_DB_SECONDS = Histogram(
+    'warbler_request_db_seconds',
+    'Total time spent in SQL statements per request.',
+    ['endpoint'])
+
+SQL_STATEMENTS = Counter(
+    'warbler_sql_statements',
+    'SQL statements executed.')
+
+TEMPLATE_SECONDS = Histogram(
+    'warbler_template_render_seconds',
+    'Time spent rendering a template.',
+    ['template'])
+
+BCRYPT_SECONDS = Histogram(
+    'warbler_bcrypt_seconds',
+    'Time spent hashing or checking a password.',
+    ['operation'])
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    'warbler_db_pool_checkout_seconds',
+    'Time spent waiting for a connection from the pool.')
+
+POOL_CHECKED_OUT = Gauge(
+    'warbler_db_pool_checked_out',
+    'Connections currently checked out of the pool.')
+
+
+##############################################################################
+# Request hooks
+
+def start_request():
+    """Start timing the current request."""
+
+    g.metrics_start = time.perf_counter()
+    g.sql_statements = 0
+    g.db_seconds = 0.0
+
+
+def finish_request(response):
+    """Record timing for the current request."""
+
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+
+    endpoint = request.endpoint or 'none'
+    REQUEST_SECONDS.observe(time.perf_counter() - start,
+                            endpoint=endpoint,
+                            method=request.method,
+                            status=response.status_code)
+    REQUEST_SQL_STATEMENTS.observe(g.sql_statements, endpoint=endpoint)
+    REQUEST_DB_SECONDS.observe(g.db_seconds, endpoint=endpoint)
+
+
+##############################################################################
+# SQLAlchemy and template instrumentation
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    SQL_STATEMENTS.inc()
+
+    if has_app_context() and 'metrics_start' in g:
+        g.sql_statements += 1
+        g.db_seconds += elapsed
+
+
+def _handle_error(exception_context):
+    # the statement failed, so _after_cursor_execute won't pop its start;
+    # failures to connect have no statement (or connection)
+    if exception_context.execution_context is None:
+        return
+    starts = exception_context.connection.info.get('metrics_query_start')
+    if starts:
+        starts.pop()
+
+
+def _timed_pool_connect(connect):
+    def timed_connect():
+        with POOL_CHECKOUT_SECONDS.time():
+            return connect()
+    return timed_connect
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKED_OUT.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    POOL_CHECKED_OUT.dec()
+
+
+def instrument_engine(engine):
+    """Time SQL statements and pool checkouts on `engine`."""
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    event.listen(engine.pool, 'checkout', _on_checkout)
+    event.listen(engine.pool, 'checkin', _on_checkin)
+
+    # the pool has no "checkout started" event, so wrap the call that waits
+    engine.pool.connect = _timed_pool_connect(engine.pool.connect)
+
+
+def _before_render_template(app, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+
+def _template_rendered(app, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - starts.pop(),
+                                 template=template.name)
+
+
+def metrics_view():
+    """Expose every metric in the Prometheus text format."""
+
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''),
+                               f'Bearer {token}'):
+        abort(401)
+
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app, db):
+    """Instrument `app` and its database, and add the /metrics route."""
+
+    with app.app_context():
+        instrument_engine(db.get_engine())
+
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,263 @@
+"""Schema migrations for existing Warbler databases.
+
+`db.create_all()` builds a fresh schema from models.py (tests, seeding) but
+never changes tables that already exist. The migrations here bring an older
+database up to what models.py declares, in order, and record each one in
+`schema_migrations`. Every step checks for what it adds, so migrating a
+freshly created schema only records the migrations.
+
+On PostgreSQL, indexes are built with CREATE INDEX CONCURRENTLY, which does
+not block writes to the table. It can't run inside a transaction, so
+migrations marked `online` run with autocommit, and an invalid index left
+behind by an interrupted build is dropped and built again.
+
+    flask migrate           # apply pending migrations
+    flask migrate --status  # list applied and pending migrations
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from models import db, MESSAGES_FTS_DDL
+import counters
+import timeline
+
+Migration = namedtuple('Migration', ['id', 'description', 'apply', 'online'])
+
+MIGRATIONS = []
+
+SCHEMA_MIGRATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    id VARCHAR(100) PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL
+)"""
+
+
+def migration(id, online=False):
+    """Register the decorated function as migration `id`."""
+
+    def register(apply):
+        MIGRATIONS.append(Migration(id, apply.__doc__.strip(), apply, online))
+        return apply
+    return register
+
+
+class Context:
+    """Helpers for one migration, run on `conn`."""
+
+    def __init__(self, conn, online):
+        self.conn = conn
+        self.online = online
+        self.dialect = conn.dialect.name
+
+    def execute(self, sql, **params):
+        return self.conn.execute(db.text(sql), **params)
+
+    def has_column(self, table, column):
+        return any(info['name'] == column
+                   for info in inspect(self.conn).get_columns(table))
+
+    def add_column(self, table, column, definition):
+        """ALTER TABLE ADD COLUMN, unless the column exists."""
+
+        if not self.has_column(table, column):
+            self.execute(f'ALTER TABLE {table} ADD COLUMN {column} '
+                         f'{definition}')
+
+    def create_index(self, name, table, definition, using=None,
+                     dialect=None):
+        """Create index `name` on `table` (`definition`) unless it exists.
+
+        Built concurrently on PostgreSQL in online migrations. `dialect`
+        limits the index to one database.
+        """
+
+        if dialect is not None and dialect != self.dialect:
+            return
+
+        if self.dialect != 'postgresql':
+            self.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+                         f'({definition})')
+            return
+
+        invalid = self.execute(
+            "SELECT 1 FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE i.relname = :name AND NOT x.indisvalid",
+            name=name).first()
+        concurrently = 'CONCURRENTLY ' if self.online else ''
+        if invalid:
+            self.execute(f'DROP INDEX {concurrently}{name}')
+
+        using = f'USING {using} ' if using else ''
+        self.execute(f'CREATE INDEX {concurrently}IF NOT EXISTS {name} '
+                     f'ON {table} {using}({definition})')
+
+
+##############################################################################
+# Migrations, oldest first
+
+@migration('0001_create_missing_tables')
+def create_missing_tables(ctx):
+    """Create tables added since the original schema (timeline_entries)."""
+
+    db.metadata.create_all(bind=ctx.conn)
+
+
+@migration('0002_user_counters')
+def add_user_counters(ctx):
+    """Add users' profile_version and denormalized counter columns."""
+
+    for column in ('profile_version', 'messages_count', 'followers_count',
+                   'following_count', 'likes_count'):
+        ctx.add_column('users', column, 'INTEGER NOT NULL DEFAULT 0')
+
+
+@migration('0003_backfill_counters_and_timelines')
+def backfill_counters_and_timelines(ctx):
+    """Compute every user's counters and home timeline."""
+
+    # repair_counters() stamps updated_at, which 0006 adds, and repairs
+    # like_count, which 0007 adds
+    add_cache_validators(ctx)
+    add_message_like_counts(ctx)
+    counters.repair_counters()
+    timeline.rebuild_timelines()
+
+
+@migration('0004_search_indexes', online=True)
+def add_search_indexes(ctx):
+    """Add the user and message search indexes."""
+
+    if ctx.dialect == 'postgresql':
+        ctx.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    ctx.create_index('ix_users_username_trgm', 'users',
+                     'lower(username) gin_trgm_ops', using='gin',
+                     dialect='postgresql')
+    ctx.create_index('ix_users_profile_trgm', 'users',
+                     "lower(coalesce(bio, '') || ' ' || "
+                     "coalesce(location, '')) gin_trgm_ops",
+                     using='gin', dialect='postgresql')
+    ctx.create_index('ix_users_username_prefix', 'users',
+                     'lower(username) text_pattern_ops',
+                     dialect='postgresql')
+    ctx.create_index('ix_users_username_prefix', 'users', 'lower(username)',
+                     dialect='sqlite')
+    ctx.create_index('ix_messages_text_fts', 'messages',
+                     "to_tsvector('english', text)", using='gin',
+                     dialect='postgresql')
+
+
+@migration('0005_hot_path_indexes', online=True)
+def add_hot_path_indexes(ctx):
+    """Index messages by author, follows by follower and likes by message."""
+
+    ctx.create_index('ix_messages_user_timestamp', 'messages',
+                     'user_id, timestamp, id')
+    ctx.create_index('ix_follows_following', 'follows',
+                     'user_following_id, user_being_followed_id')
+    ctx.create_index('ix_likes_message', 'likes', 'message_id')
+
+
+@migration('0006_cache_validators')
+def add_cache_validators(ctx):
+    """Add users' like and follow versions and updated_at."""
+
+    for column in ('likes_version', 'follows_version'):
+        ctx.add_column('users', column, 'INTEGER NOT NULL DEFAULT 0')
+
+    if not ctx.has_column('users', 'updated_at'):
+        ctx.add_column('users', 'updated_at', 'TIMESTAMP')
+        ctx.execute('UPDATE users SET updated_at = :now',
+                    now=datetime.utcnow())
+
+
+@migration('0007_message_like_counts')
+def add_message_like_counts(ctx):
+    """Add and backfill messages' like_count."""
+
+    if not ctx.has_column('messages', 'like_count'):
+        ctx.add_column('messages', 'like_count', 'INTEGER NOT NULL DEFAULT 0')
+        ctx.execute('UPDATE messages SET like_count = '
+                    '(SELECT count(*) FROM likes '
+                    'WHERE likes.message_id = messages.id)')
+
+
+@migration('0008_sqlite_message_search')
+def add_sqlite_message_search(ctx):
+    """Add and fill SQLite's full-text message index."""
+
+    if ctx.dialect != 'sqlite':
+        return
+
+    for statement in MESSAGES_FTS_DDL:
+        ctx.execute(statement)
+    ctx.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+##############################################################################
+# Running migrations
+
+def applied_ids(conn):
+    conn.execute(SCHEMA_MIGRATIONS_DDL)
+    return {row[0] for row in conn.execute('SELECT id FROM schema_migrations')}
+
+
+def record(conn, id):
+    conn.execute(db.text('INSERT INTO schema_migrations (id, applied_at) '
+                         'VALUES (:id, :applied_at)'),
+                 id=id, applied_at=datetime.utcnow())
+
+
+def status():
+    """[(migration, applied?)] in order."""
+
+    with db.engine.begin() as conn:
+        applied = applied_ids(conn)
+    return [(migration, migration.id in applied) for migration in MIGRATIONS]
+
+
+def apply(migration):
+    """Apply one migration and record it."""
+
+    if migration.online and db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            migration.apply(Context(conn, online=True))
+            record(conn, migration.id)
+        return
+
+    # on the session's connection, so data migrations can use the models
+    try:
+        conn = db.session.connection()
+        migration.apply(Context(conn, online=False))
+        record(conn, migration.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def migrate(echo=print):
+    """Apply every pending migration in order; return their ids."""
+
+    applied = []
+    for migration, done in status():
+        if done:
+            continue
+        echo(f'Applying {migration.id}: {migration.description}')
+        apply(migration)
+        applied.append(migration.id)
+    return applied
+
+
+def stamp():
+    """Record every migration as applied, for a schema just built by
+    `db.create_all()`."""
+
+    with db.engine.begin() as conn:
+        applied = applied_ids(conn)
+        for migration in MIGRATIONS:
+            if migration.id not in applied:
+                record(conn, migration.id)
@@ -2,11 +2,12 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import hashing
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -14,6 +15,15 @@ class Follows(db.Model):
 
     __tablename__ = 'follows'
 
+    # the primary key serves "who follows X"; this serves "whom does X
+    # follow" without touching the table
+    __table_args__ = (
+        db.Index(
+            'ix_follows_following',
+            'user_following_id', 'user_being_followed_id'
+        ),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -36,6 +46,10 @@ class Likes(db.Model):
         db.UniqueConstraint(
             'user_id', 'message_id', name="_like_uc"
         ),
+        db.Index(
+            'ix_likes_message',
+            'message_id'
+        ),
     )
 
     id = db.Column(
@@ -99,6 +113,70 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Bumped whenever the username or images change, so anything cached
+    # from the old profile can be told apart.
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Denormalized counts, kept in step by counters.adjust() in the same
+    # transaction as the change they count.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped with likes_count and following_count, but never decremented,
+    # so a page's like and follow buttons can be validated against them
+    # (see conditional.py).
+
+    likes_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    follows_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # When the profile or any of the counters above last changed.
+    updated_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -127,14 +205,15 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        # imported here, since followgraph imports this module
+        import followgraph
+        return followgraph.is_following(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        import followgraph
+        return followgraph.is_following(self.id, other_user.id)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -143,7 +222,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hashing.hash_password(password)
 
         # not very flexible for handeling additional information
         user = User(
@@ -160,13 +239,18 @@ class User(db.Model):
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
+
+        A password hashed at an outdated cost is rehashed; the caller
+        commits.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hashing.check_password(user.password, password)
             if is_auth:
+                if hashing.needs_rehash(user.password):
+                    hashing.rehash(user, password)
                 return user
 
         return False
@@ -177,6 +261,14 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # a user's messages, newest first, in (timestamp, id) cursor order
+    __table_args__ = (
+        db.Index(
+            'ix_messages_user_timestamp',
+            'user_id', 'timestamp', 'id'
+        ),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -190,7 +282,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,12 +291,138 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # written behind by likes.LikeCountAggregator
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
     def __repr__(self):
         return f"<Message #{self.id} created at {self.timestamp} by User #{self.user_id} with message: {self.text}"
 
 
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline (fan-out-on-write)."""
+
+    __tablename__ = 'timeline_entries'
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_owner_timestamp',
+            'owner_id', 'timestamp', 'message_id'
+        ),
+        db.Index(
+            'ix_timeline_owner_author',
+            'owner_id', 'author_id'
+        ),
+    )
+
+    owner_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # copied from the message so the timeline can be read off one index
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+##############################################################################
+# Search indexes that can't be declared on the models
+
+event.listen(
+    User.__table__, 'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    .execute_if(dialect='postgresql'))
+
+event.listen(
+    User.__table__, 'after_create',
+    DDL("CREATE INDEX ix_users_username_trgm ON users "
+        "USING gin (lower(username) gin_trgm_ops)")
+    .execute_if(dialect='postgresql'))
+
+event.listen(
+    User.__table__, 'after_create',
+    DDL("CREATE INDEX ix_users_profile_trgm ON users USING gin "
+        "(lower(coalesce(bio, '') || ' ' || coalesce(location, '')) "
+        "gin_trgm_ops)")
+    .execute_if(dialect='postgresql'))
+
+event.listen(
+    User.__table__, 'after_create',
+    DDL("CREATE INDEX ix_users_username_prefix ON users "
+        "(lower(username) text_pattern_ops)")
+    .execute_if(dialect='postgresql'))
+
+event.listen(
+    User.__table__, 'after_create',
+    DDL("CREATE INDEX ix_users_username_prefix ON users (lower(username))")
+    .execute_if(dialect='sqlite'))
+
+
+event.listen(
+    Message.__table__, 'after_create',
+    DDL("CREATE INDEX ix_messages_text_fts ON messages "
+        "USING gin (to_tsvector('english', text))")
+    .execute_if(dialect='postgresql'))
+
+# SQLite's message search index: an external-content FTS5 table, kept in
+# step with every write to messages (including bulk loads and foreign key
+# cascades) by triggers. Migration 0008 adds them to existing databases.
+MESSAGES_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING "
+    "fts5(text, content='messages', content_rowid='id')",
+
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages "
+    "BEGIN "
+    "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages "
+    "BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update "
+    "AFTER UPDATE OF text ON messages "
+    "BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); "
+    "END",
+]
+
+for statement in MESSAGES_FTS_DDL:
+    event.listen(
+        Message.__table__, 'after_create',
+        DDL(statement).execute_if(dialect='sqlite'))
+
+event.listen(
+    Message.__table__, 'before_drop',
+    DDL("DROP TABLE IF EXISTS messages_fts")
+    .execute_if(dialect='sqlite'))
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -0,0 +1,174 @@
+"""Keyset (cursor) pagination for Warbler's list views.
+
+Pages are ordered by a unique sort key such as (timestamp, id). The cursor
+for the next page is the key of the last row shown, so fetching any page is
+an index range scan from that key instead of an OFFSET.
+
+A StreamedPage fetches its rows lazily instead, while the template iterates
+it, for views rendered with streaming.render_template.
+"""
+
+from datetime import datetime
+from itertools import islice
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import tuple_
+
+CURSOR_SEPARATOR = ','
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Page:
+    """One page of rows, plus the cursor for the page after it."""
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @classmethod
+    def from_rows(cls, rows, page_size, row_key):
+        """Build a page from up to `page_size + 1` rows.
+
+        The extra row only tells us there is another page; `row_key` maps
+        the last row shown to the sort key the next page starts after.
+        """
+
+        items = rows[:page_size]
+        if len(rows) > page_size:
+            return cls(items, encode_cursor(row_key(items[-1])))
+        return cls(items)
+
+    def next_url(self):
+        """URL for the next page of the current view, or None."""
+
+        if not self.next_cursor:
+            return None
+
+        args = request.args.to_dict()
+        args['cursor'] = self.next_cursor
+        args.update(request.view_args)
+        return url_for(request.endpoint, **args)
+
+
+class StreamedPage:
+    """A page of up to `page_size` rows of `query`, fetched in batches of
+    `batch_size` as the template iterates it.
+
+    Each batch is passed to `on_batch` before its rows are yielded, so
+    per-row state (what the viewer likes and follows) can be resolved a
+    batch at a time. Only the current batch is held in memory. The next
+    cursor is known once the rows have been iterated, which the pager,
+    rendered after them, relies on.
+    """
+
+    def __init__(self, query, page_size, batch_size, row_key, on_batch=None):
+        self.query = query
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.row_key = row_key
+        self.on_batch = on_batch
+        self.next_cursor = None
+
+    def __iter__(self):
+        query = self.query.yield_per(self.batch_size)
+        if self.page_size is not None:
+            query = query.limit(self.page_size + 1)
+
+        rows = iter(query)
+        shown = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            more = (self.page_size is not None
+                    and shown + len(batch) > self.page_size)
+            if more:
+                batch = batch[:self.page_size - shown]
+
+            if batch:
+                if self.on_batch:
+                    self.on_batch(batch)
+                yield from batch
+                shown += len(batch)
+                last = batch[-1]
+
+            if more:
+                self.next_cursor = encode_cursor(self.row_key(last))
+            if more or len(batch) < self.batch_size:
+                return
+
+    next_url = Page.next_url
+
+
+def page_size():
+    """Number of rows shown per page."""
+
+    return current_app.config['PAGE_SIZE']
+
+
+def current_cursor():
+    """Cursor requested by the current page view, if any."""
+
+    return request.args.get('cursor') or None
+
+
+def encode_cursor(values):
+    """Serialize a sort key into a URL-friendly cursor."""
+
+    return CURSOR_SEPARATOR.join(
+        value.strftime(CURSOR_DATETIME_FORMAT)
+        if isinstance(value, datetime) else str(value)
+        for value in values
+    )
+
+
+def decode_cursor(cursor, keys):
+    """Parse a cursor back into values matching the sort `keys` columns.
+
+    Raises ValueError for malformed cursors.
+    """
+
+    parts = cursor.split(CURSOR_SEPARATOR)
+    if len(parts) != len(keys):
+        raise ValueError(f"Expected {len(keys)} values in cursor {cursor!r}")
+
+    values = []
+    for part, key in zip(parts, keys):
+        kind = key.type.python_type
+        if kind is datetime:
+            values.append(datetime.strptime(part, CURSOR_DATETIME_FORMAT))
+        else:
+            values.append(kind(part))
+    return values
+
+
+def keyset(query, keys, cursor=None, descending=True):
+    """Order `query` by `keys` and start it after `cursor`."""
+
+    if cursor:
+        try:
+            values = decode_cursor(cursor, keys)
+        except ValueError:
+            abort(400)
+
+        if len(keys) == 1:
+            bound, start = keys[0], values[0]
+        else:
+            bound, start = tuple_(*keys), tuple_(*values)
+
+        query = query.filter(bound < start if descending else bound > start)
+
+    return query.order_by(*[key.desc() if descending else key.asc()
+                            for key in keys])
+
+
+def paginate(query, keys, row_key, cursor=None, descending=True):
+    """Fetch the page of `query` that starts after `cursor`."""
+
+    size = page_size()
+    rows = keyset(query, keys, cursor, descending).limit(size + 1).all()
+    return Page.from_rows(rows, size, row_key)
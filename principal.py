@@ -0,0 +1,140 @@
+"""The logged-in user, loaded only when a request needs it.
+
+`g.user` is a CurrentUser for logged-in requests. Its id comes from the
+signed session, and the fields base.html shows on every page (id,
+username, image_url) come from a short-lived, bounded per-process identity
+cache.
+Reading any other attribute loads the full User row once for the request.
+Anonymous requests never touch the database.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import abort, current_app
+
+from models import db, User
+
+Identity = namedtuple('Identity', ['id', 'username', 'image_url'])
+
+
+class IdentityCache:
+    """Thread-safe LRU map of user id -> Identity with per-entry expiry."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, identity, ttl, max_entries):
+        """Cache `identity` for `ttl` seconds, dropping the least recently
+        used identities beyond `max_entries`."""
+
+        with self._lock:
+            self._entries[identity.id] = (time.monotonic() + ttl, identity)
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+identities = IdentityCache()
+
+
+def cache_identity(identity):
+    config = current_app.config
+    identities.put(identity, config['CURRENT_USER_TTL'],
+                   config['CURRENT_USER_CACHE_SIZE'])
+
+
+def remember(user):
+    """Cache `user`'s identity, e.g. right after login or a profile update."""
+
+    cache_identity(Identity(user.id, user.username, user.image_url))
+
+
+def forget(user_id):
+    """Drop a cached identity after the user is changed or deleted."""
+
+    identities.forget(user_id)
+
+
+def lookup_identity(user_id):
+    """Identity for `user_id` from the cache or a narrow query; None if the
+    user no longer exists."""
+
+    identity = identities.get(user_id)
+    if identity is None:
+        row = (db.session
+               .query(User.id, User.username, User.image_url)
+               .filter(User.id == user_id)
+               .first())
+        if row is None:
+            return None
+        identity = Identity(*row)
+        cache_identity(identity)
+    return identity
+
+
+class CurrentUser:
+    """Lazy stand-in for the logged-in User."""
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self._identity = None
+        self._user = None
+
+    def _resolve_identity(self):
+        if self._identity is None:
+            self._identity = lookup_identity(self.id)
+        return self._identity
+
+    def __bool__(self):
+        # false for a session that outlived its user
+        return self._resolve_identity() is not None
+
+    @property
+    def username(self):
+        return self._resolve_identity().username
+
+    @property
+    def image_url(self):
+        return self._resolve_identity().image_url
+
+    def load(self):
+        """The full User row, queried on first use."""
+
+        if self._user is None:
+            self._user = User.query.get(self.id)
+            if self._user is None:
+                forget(self.id)
+                abort(401)
+            remember(self._user)
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}>"
@@ -0,0 +1,215 @@
+"""Read-replica routing.
+
+GET and HEAD requests read from a replica listed in
+SQLALCHEMY_REPLICA_URIS; everything else, and every write, goes to the
+primary. Within a request only SELECTs are routed: flushes, bulk UPDATEs
+and DELETEs and raw SQL all use the primary, and once a request has written
+its remaining reads do too.
+
+Read-your-writes: a request that wrote stamps the user's (signed) session
+with a deadline, and that user's requests read from the primary until it
+passes (REPLICA_PIN_SECONDS), so the page they are redirected to shows
+their own change.
+
+Each process checks a replica's replication lag at most every
+REPLICA_CHECK_SECONDS and skips replicas further behind than
+REPLICA_MAX_LAG_SECONDS. A replica that fails its check, or fails a query,
+is left out for REPLICA_RETRY_SECONDS; a GET that hit the failure is
+retried once on the primary.
+"""
+
+import random
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.expression import CompoundSelect, Select, UpdateBase
+
+import metrics
+
+PIN_KEY = 'primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END"""
+
+DB_ROUTE = metrics.Counter(
+    'warbler_db_route_requests',
+    'Requests by the database they read from.',
+    ['target'])
+
+REPLICA_LAG_SECONDS = metrics.Gauge(
+    'warbler_db_replica_lag_seconds',
+    'Replication lag last measured on each replica.',
+    ['replica'])
+
+REPLICA_FAILURES = metrics.Counter(
+    'warbler_db_replica_failures',
+    'Times a replica was taken out of rotation.',
+    ['replica'])
+
+
+class ReplicaSet:
+    """This process's replica engines and what it knows of their health."""
+
+    def __init__(self, uris, config):
+        self.engines = {f'replica_{i}': create_engine(uri, pool_pre_ping=True)
+                        for i, uri in enumerate(uris)}
+        self.max_lag = config['REPLICA_MAX_LAG_SECONDS']
+        self.check_seconds = config['REPLICA_CHECK_SECONDS']
+        self.retry_seconds = config['REPLICA_RETRY_SECONDS']
+        self._lock = threading.Lock()
+        self._down_until = {}
+        self._lag = {}
+
+    def measure_lag(self, name):
+        """Seconds `name` is behind the primary; raises if unreachable."""
+
+        engine = self.engines[name]
+        if engine.dialect.name != 'postgresql':
+            return 0.0
+        with engine.connect() as conn:
+            return float(conn.execute(REPLICA_LAG_QUERY).scalar() or 0)
+
+    def lag(self, name):
+        """Recently measured lag of `name`, or None if it is down."""
+
+        now = time.monotonic()
+        with self._lock:
+            if self._down_until.get(name, 0) > now:
+                return None
+            checked = self._lag.get(name)
+            if checked is not None and checked[0] > now - self.check_seconds:
+                return checked[1]
+
+        try:
+            lag = self.measure_lag(name)
+        except Exception:
+            self.mark_down(name)
+            return None
+
+        REPLICA_LAG_SECONDS.set(lag, replica=name)
+        with self._lock:
+            self._lag[name] = (now, lag)
+        return lag
+
+    def mark_down(self, name):
+        REPLICA_FAILURES.inc(replica=name)
+        with self._lock:
+            self._down_until[name] = time.monotonic() + self.retry_seconds
+            self._lag.pop(name, None)
+
+    def choose(self):
+        """A random healthy, caught-up replica, or None for the primary."""
+
+        names = list(self.engines)
+        random.shuffle(names)
+        for name in names:
+            lag = self.lag(name)
+            if lag is not None and lag <= self.max_lag:
+                return name
+        return None
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the current request's SELECTs to its replica."""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.replica_for(clause)
+        if replica is not None:
+            return replica
+        return super().get_bind(mapper, clause)
+
+    def replica_for(self, clause):
+        if not has_request_context():
+            return None
+
+        if self._flushing or isinstance(clause, UpdateBase):
+            g.db_wrote = True
+            return None
+
+        if (g.get('db_wrote')
+                or not isinstance(clause, (Select, CompoundSelect))):
+            return None
+
+        name = g.get('db_replica')
+        if name is None:
+            return None
+        return self.app.extensions['replicas'].engines[name]
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with a RoutingSession."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def pinned():
+    """Did this user write recently enough that they must read the
+    primary?"""
+
+    return session.get(PIN_KEY, 0) > time.time()
+
+
+def choose_database():
+    """Pick the database the current request reads from."""
+
+    replicas = current_app.extensions['replicas']
+    g.db_replica = None
+    if replicas.engines and request.method in READ_METHODS and not pinned():
+        g.db_replica = replicas.choose()
+
+    DB_ROUTE.inc(target=g.db_replica or 'primary')
+
+
+def pin_after_write(response):
+    """Send a user who just wrote to the primary for a while."""
+
+    if g.get('db_wrote') and current_app.extensions['replicas'].engines:
+        session[PIN_KEY] = time.time() + current_app.config[
+            'REPLICA_PIN_SECONDS']
+    return response
+
+
+def replica_failed(error):
+    """Take a failing replica out of rotation and retry the view on the
+    primary."""
+
+    name = g.pop('db_replica', None)
+    if name is None:
+        raise error
+
+    current_app.extensions['replicas'].mark_down(name)
+    current_app.extensions['sqlalchemy'].db.session.rollback()
+    return current_app.dispatch_request()
+
+
+def configure(app):
+    """(Re)build the app's replicas from its config."""
+
+    old = app.extensions.get('replicas')
+    if old is not None:
+        for engine in old.engines.values():
+            engine.dispose()
+
+    replicas = ReplicaSet(app.config['SQLALCHEMY_REPLICA_URIS'], app.config)
+    for engine in replicas.engines.values():
+        metrics.instrument_engine(engine)
+    app.extensions['replicas'] = replicas
+
+
+def init_app(app):
+    """Route `app`'s reads to its replicas."""
+
+    configure(app)
+    app.before_request(choose_database)
+    app.after_request(pin_after_write)
+    app.register_error_handler(OperationalError, replica_failed)
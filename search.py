@@ -0,0 +1,193 @@
+"""Indexed search for Warbler.
+
+On PostgreSQL, user search matches lower(username) and the user's bio and
+location through pg_trgm GIN indexes, so substring and fuzzy matches are
+index scans; terms shorter than a trigram only match username prefixes.
+Results are ranked exact match, then prefix match, then trigram
+similarity. Other databases fall back to a prefix range scan over an index
+on lower(username).
+
+Autocomplete only ever does a prefix scan, and reads only the columns it
+returns.
+
+Message search is full text: a GIN index on to_tsvector(text) on
+PostgreSQL, or the `messages_fts` FTS5 table on SQLite. Both are kept
+current by the database on every insert and delete (the FTS5 table through
+triggers on `messages`). Matches are scored by relevance plus a recency
+bonus computed from the message's own timestamp, so the score never
+changes and results can be paginated with (score, id) cursors.
+"""
+
+from flask import current_app
+from sqlalchemy import Float, and_, case, func, literal, literal_column, or_
+from sqlalchemy import select, type_coerce
+from sqlalchemy.sql import column, table
+
+from models import db, Message, User
+
+TEXT_SEARCH_CONFIG = 'english'
+
+messages_fts = table('messages_fts', column('rowid'))
+
+# Trigram indexes can't help with terms shorter than one trigram.
+TRIGRAM_MIN_LENGTH = 3
+
+
+def dialect_name():
+    """Name of the database dialect the session is bound to."""
+
+    return db.session.get_bind().dialect.name
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in user input (escape character: '\\')."""
+
+    return (text.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def normalize(text):
+    return (text or '').strip().lower()
+
+
+def username_prefix(prefix):
+    """Filter clause matching usernames that start with `prefix`.
+
+    `prefix` must already be normalized.
+    """
+
+    username = func.lower(User.username)
+
+    if dialect_name() == 'postgresql':
+        # served by the text_pattern_ops index
+        return username.like(escape_like(prefix) + '%', escape='\\')
+
+    # a plain range scan over the lower(username) index
+    return and_(username >= prefix, username < prefix + '\U0010ffff')
+
+
+def profile_text():
+    """Bio and location as one lowercased string, as indexed."""
+
+    return func.lower(func.coalesce(User.bio, '') + ' '
+                      + func.coalesce(User.location, ''))
+
+
+def search_users(text, limit=None):
+    """Users matching `text`, most relevant first."""
+
+    term = normalize(text)
+    limit = limit or current_app.config['USER_SEARCH_LIMIT']
+    if not term:
+        return []
+
+    username = func.lower(User.username)
+    exact = case([(username == term, 1)], else_=0)
+    prefix = case([(username_prefix(term), 1)], else_=0)
+
+    if dialect_name() != 'postgresql':
+        return (User
+                .query
+                .filter(username_prefix(term))
+                .order_by(exact.desc(), username, User.id)
+                .limit(limit)
+                .all())
+
+    if len(term) < TRIGRAM_MIN_LENGTH:
+        matches = [username_prefix(term)]
+    else:
+        pattern = '%' + escape_like(term) + '%'
+        matches = [username.like(pattern, escape='\\'),
+                   username.op('%')(term),
+                   profile_text().like(pattern, escape='\\')]
+
+    similarity = func.similarity(username, literal(term))
+
+    return (User
+            .query
+            .filter(or_(*matches))
+            .order_by(exact.desc(), prefix.desc(), similarity.desc(),
+                      User.id)
+            .limit(limit)
+            .all())
+
+
+def autocomplete_users(prefix, limit=None):
+    """(id, username, image_url) of users whose username starts with
+    `prefix`, in username order."""
+
+    term = normalize(prefix)
+    limit = limit or current_app.config['USER_AUTOCOMPLETE_LIMIT']
+    if not term:
+        return []
+
+    return (db.session
+            .query(User.id, User.username, User.image_url)
+            .filter(username_prefix(term))
+            .order_by(func.lower(User.username))
+            .limit(limit)
+            .all())
+
+
+def fts_query(text):
+    """Quote every word of `text` as an FTS5 string, so user input is never
+    parsed as query syntax."""
+
+    words = text.split()
+    return ' '.join('"%s"' % word.replace('"', '""') for word in words)
+
+
+def recency_bonus(timestamp_seconds):
+    """Score added for recency; one MESSAGE_SEARCH_RECENCY_DAYS is worth 1."""
+
+    days = current_app.config['MESSAGE_SEARCH_RECENCY_DAYS']
+    return timestamp_seconds / (days * 86400.0)
+
+
+def message_matches(text):
+    """Subquery of (id, score) for every message matching `text`."""
+
+    if dialect_name() == 'postgresql':
+        vector = func.to_tsvector(TEXT_SEARCH_CONFIG, Message.text)
+        query = func.plainto_tsquery(TEXT_SEARCH_CONFIG, text)
+        relevance = func.ts_rank_cd(vector, query)
+        seconds = func.extract('epoch', Message.timestamp)
+        matches = (select([Message.id])
+                   .where(vector.op('@@')(query)))
+    else:
+        relevance = -func.bm25(literal_column('messages_fts'))
+        seconds = (func.julianday(Message.timestamp) - 2440587.5) * 86400
+        matches = (select([Message.id])
+                   .select_from(messages_fts.join(
+                       Message.__table__,
+                       Message.id == messages_fts.c.rowid))
+                   .where(literal_column('messages_fts')
+                          .op('MATCH')(fts_query(text))))
+
+    score = type_coerce(relevance + recency_bonus(seconds), Float)
+    return matches.column(score.label('score')).alias('matches')
+
+
+def search_messages(text):
+    """Query of (Message, score) rows matching `text`.
+
+    Paginate it on the returned subquery's (score, id) columns.
+    """
+
+    matches = message_matches(text)
+    query = (db.session
+             .query(Message, matches.c.score)
+             .join(matches, matches.c.id == Message.id))
+    return query, (matches.c.score, matches.c.id)
+
+
+def rebuild_message_index():
+    """Rebuild the SQLite full-text index from the messages table.
+
+    PostgreSQL's expression index never drifts from the table.
+    """
+
+    if dialect_name() == 'sqlite':
+        db.session.execute(
+            "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
@@ -0,0 +1,48 @@
+// Like and unlike messages in place instead of reloading the page.
+
+(function () {
+  if (!window.fetch) {
+    return;
+  }
+
+  document.addEventListener('submit', function (event) {
+    var form = event.target;
+    if (!form.classList.contains('like-form')) {
+      return;
+    }
+    event.preventDefault();
+
+    var field = form.elements.liked;
+    var button = form.querySelector('.like-button');
+    if (button.disabled) {
+      return;
+    }
+    button.disabled = true;
+
+    fetch(form.action, {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ liked: field.value === 'true' })
+    })
+      .then(function (resp) {
+        if (!resp.ok) {
+          throw new Error(resp.status);
+        }
+        return resp.json();
+      })
+      .then(function (data) {
+        field.value = data.liked ? 'false' : 'true';
+        button.setAttribute('aria-pressed', data.liked ? 'true' : 'false');
+        button.querySelector('.like-count').textContent = data.likes || '';
+        var star = button.querySelector('.fa-star');
+        star.classList.toggle('fas', data.liked);
+        star.classList.toggle('far', !data.liked);
+        button.disabled = false;
+      })
+      .catch(function () {
+        // let the server handle it the old-fashioned way
+        form.submit();
+      });
+  });
+})();
@@ -0,0 +1,46 @@
+// Suggest usernames in the navbar search box as the user types.
+
+(function () {
+  var DELAY_MS = 150;
+
+  document.addEventListener('DOMContentLoaded', function () {
+    var input = document.getElementById('search');
+    if (!input || !window.fetch) {
+      return;
+    }
+
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var latest = '';
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(suggest, DELAY_MS);
+    });
+
+    function suggest() {
+      var query = input.value.trim();
+      latest = query;
+      if (!query) {
+        list.innerHTML = '';
+        return;
+      }
+
+      var url = input.dataset.autocomplete + '?q=' + encodeURIComponent(query);
+      fetch(url, { credentials: 'same-origin' })
+        .then(function (resp) { return resp.json(); })
+        .then(function (data) {
+          // drop answers to queries the user has already typed past
+          if (query !== latest) {
+            return;
+          }
+          list.innerHTML = '';
+          data.users.forEach(function (user) {
+            var option = document.createElement('option');
+            option.value = user.username;
+            list.appendChild(option);
+          });
+        });
+    }
+  });
+})();
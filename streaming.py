@@ -0,0 +1,113 @@
+"""Streamed rendering for long list pages.
+
+The user directory, likes and follower/following lists normally fetch
+their whole page, resolve what the viewer follows and likes, and render
+the HTML in memory before the first byte is sent. Endpoints listed in
+STREAMED_ENDPOINTS are streamed instead:
+
+- `{{ flush() }}` in base.html, after the navigation, marks where the
+  page's head is sent to the browser, before any list query has run, so
+  it can start fetching stylesheets and scripts;
+- the list is a pagination.StreamedPage, read from a server-side cursor
+  (`yield_per`) STREAM_BATCH_SIZE rows at a time, with the viewer's state
+  resolved per batch, and pages hold STREAM_PAGE_SIZE rows (None for the
+  whole list on one page);
+- the rest of the HTML is sent in chunks of about STREAM_CHUNK_SIZE
+  characters, which CompressionMiddleware compresses as they come.
+
+Memory stays bounded by the batch and chunk sizes, however long the list.
+A streamed response has already been sent by the time the list is read,
+so an error partway through truncates the page instead of showing the
+error page, and the request duration metric stops at the first byte.
+"""
+
+from flask import (Markup, Response, before_render_template, current_app, g,
+                   render_template as render_buffered, request,
+                   stream_with_context, template_rendered)
+
+import pagination
+
+FLUSH = '<!-- flush -->'
+
+
+def enabled():
+    """Does the current view stream its page?"""
+
+    return request.endpoint in current_app.config['STREAMED_ENDPOINTS']
+
+
+def paginate(query, keys, row_key, cursor=None, descending=True,
+             on_batch=None):
+    """The page of `query` that starts after `cursor`: fetched lazily if
+    the current view streams, otherwise as pagination.paginate does.
+
+    `on_batch` is called with each batch of rows before they are shown (a
+    non-streamed page is a single batch).
+    """
+
+    if not enabled():
+        page = pagination.paginate(query, keys, row_key, cursor, descending)
+        if on_batch:
+            on_batch(page.items)
+        return page
+
+    config = current_app.config
+    return pagination.StreamedPage(
+        pagination.keyset(query, keys, cursor, descending),
+        config['STREAM_PAGE_SIZE'], config['STREAM_BATCH_SIZE'], row_key,
+        on_batch)
+
+
+def render_template(name, **context):
+    """Render template `name`, streamed if the current view streams."""
+
+    if not enabled():
+        return render_buffered(name, **context)
+
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(name)
+    app.update_template_context(context)
+    g.streaming = True
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        yield from _chunks(template.generate(context),
+                           app.config['STREAM_CHUNK_SIZE'])
+        template_rendered.send(app, template=template, context=context)
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+def _chunks(events, size):
+    """Join the template's output `events` into chunks of about `size`
+    characters, ending one early at each flush marker."""
+
+    buffered = []
+    length = 0
+    for event in events:
+        *flushed, event = event.split(FLUSH)
+        for part in flushed:
+            buffered.append(part)
+            yield ''.join(buffered)
+            buffered, length = [], 0
+
+        buffered.append(event)
+        length += len(event)
+        if length >= size:
+            yield ''.join(buffered)
+            buffered, length = [], 0
+
+    if buffered:
+        yield ''.join(buffered)
+
+
+def flush():
+    """Template global: send everything rendered so far, when streaming."""
+
+    return Markup(FLUSH) if g.get('streaming') else ''
+
+
+def init_app(app):
+    """Let `app`'s templates mark where a streamed page is flushed."""
+
+    app.jinja_env.globals['flush'] = flush
@@ -0,0 +1,135 @@
+"""Static asset build and serving tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_assets.py
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import assets
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+STYLESHEET = """
+body { background: url("/static/images/bg.png"); }
+.logo { background: url(../images/bg.png?v=1); }
+.remote { background: url('https://example.com/x.png'); }
+.missing { background: url(../images/missing.png); }
+"""
+
+
+class AssetBuildTestCase(TestCase):
+    """Test fingerprinting, compression and asset URLs."""
+
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        for path, content in [('images/bg.png', b'\x89PNG fake image'),
+                              ('stylesheets/site.css', STYLESHEET.encode()),
+                              ('.DS_Store', b'junk')]:
+            os.makedirs(os.path.join(self.static, os.path.dirname(path)),
+                        exist_ok=True)
+            with open(os.path.join(self.static, path), 'wb') as f:
+                f.write(content)
+
+        self.manifest = assets.build(self.static, echo=lambda line: None)
+        self.dist = os.path.join(self.static, assets.DIST)
+
+        self.saved = app.extensions['assets']
+        app.extensions['assets'] = assets.Manifest(self.dist)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.extensions['assets'] = self.saved
+        shutil.rmtree(self.static)
+
+    def read(self, path):
+        with open(os.path.join(self.dist, path), 'rb') as f:
+            return f.read()
+
+    def test_fingerprints(self):
+        '''Is every file copied under a name carrying its digest?'''
+        self.assertEqual(set(self.manifest),
+                         {'images/bg.png', 'stylesheets/site.css'})
+        self.assertRegex(self.manifest['images/bg.png'],
+                         r'^images/bg\.[0-9a-f]{12}\.png$')
+        self.assertEqual(self.read(self.manifest['images/bg.png']),
+                         b'\x89PNG fake image')
+
+        rebuilt = assets.build(self.static, echo=lambda line: None)
+        self.assertEqual(rebuilt, self.manifest)
+
+    def test_stylesheet_urls(self):
+        '''Are url()s in stylesheets pointed at fingerprinted files?'''
+        css = self.read(self.manifest['stylesheets/site.css']).decode()
+        image = f"/static/dist/{self.manifest['images/bg.png']}"
+
+        self.assertIn(f'url("{image}")', css)
+        self.assertIn(f'url({image}?v=1)', css)
+        self.assertIn("url('https://example.com/x.png')", css)
+        self.assertIn('url(../images/missing.png)', css)
+
+    def test_precompressed(self):
+        '''Are compressible files gzipped, and other files left alone?'''
+        css = self.manifest['stylesheets/site.css']
+        self.assertEqual(gzip.decompress(self.read(css + '.gz')),
+                         self.read(css))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.dist, self.manifest['images/bg.png'] + '.gz')))
+
+    def test_asset_url(self):
+        '''Does asset_url prefer built, then local, then CDN files?'''
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('stylesheets/site.css'),
+                             '/static/dist/'
+                             + self.manifest['stylesheets/site.css'])
+            self.assertEqual(assets.asset_url('stylesheets/style.css'),
+                             '/static/stylesheets/style.css')
+            path = 'vendor/jquery/jquery.min.js'
+            if not os.path.exists(os.path.join(app.static_folder, path)):
+                self.assertEqual(assets.asset_url(path),
+                                 assets.VENDOR[path])
+
+    def test_serves_immutable(self):
+        '''Are built files served for a year, compressed on request?'''
+        built = self.manifest['stylesheets/site.css']
+        url = '/static/dist/' + built
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertTrue(resp.content_type.startswith('text/css'))
+        self.assertEqual(gzip.decompress(resp.data), self.read(built))
+        resp.close()
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, self.read(built))
+        resp.close()
+
+        self.assertEqual(self.client.get('/static/dist/nope.css').status_code,
+                         404)
@@ -0,0 +1,120 @@
+"""Benchmark harness tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_bench.py
+
+import os
+import random
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import bench
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+def route_stats(p95_ms, sql, errors=0):
+    return dict(requests=10, errors=errors, rps=100.0, p50_ms=p95_ms / 2,
+                p95_ms=p95_ms, p99_ms=p95_ms, sql=sql)
+
+
+class BackgroundDriver(bench.TestClientDriver):
+    """Test client driver that runs SQL in another thread during each
+    request, like the like-count flusher or a follow graph rebuild."""
+
+    def send(self, method, path, data):
+        def background():
+            with app.app_context():
+                db.session.execute('SELECT 1')
+                db.session.remove()
+
+        thread = threading.Thread(target=background)
+        thread.start()
+        thread.join()
+        return super().send(method, path, data)
+
+
+class BenchTestCase(TestCase):
+    """Test the benchmark's statistics, comparison and a tiny run."""
+
+    def tearDown(self):
+        db.session.remove()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def test_percentile(self):
+        '''Are percentiles nearest-rank?'''
+        values = list(range(1, 101))
+        self.assertEqual(bench.percentile(values, .50), 50)
+        self.assertEqual(bench.percentile(values, .95), 95)
+        self.assertEqual(bench.percentile(values, .99), 99)
+        self.assertEqual(bench.percentile([7], .99), 7)
+
+    def test_compare(self):
+        '''Are latency and SQL regressions reported, and noise ignored?'''
+        dataset = dict(users=10)
+        baseline = dict(dataset=dataset, routes=dict(
+            homepage=route_stats(10.0, 3.0),
+            users_show=route_stats(10.0, 3.0)))
+
+        current = dict(dataset=dataset, routes=dict(
+            homepage=route_stats(12.0, 3.0),
+            users_show=route_stats(10.0, 3.1),
+            list_users=route_stats(50.0, 9.0)))
+        self.assertEqual(bench.compare(current, baseline, .25), [])
+
+        current['routes']['homepage'] = route_stats(13.0, 3.0)
+        current['routes']['users_show'] = route_stats(10.0, 4.0, errors=1)
+        problems = bench.compare(current, baseline, .25)
+        self.assertEqual(len(problems), 3)
+        self.assertTrue(problems[0].startswith('homepage: p95'))
+
+        current['dataset'] = dict(users=20)
+        self.assertEqual(len(bench.compare(current, baseline, .25)), 1)
+
+    @patch.object(bench, 'WORKLOAD', [(bench.homepage_anon, 1)])
+    def test_request_statements(self):
+        '''Are only a request's own SQL statements counted, not those of
+        other threads?'''
+        samples = bench.run_workload(BackgroundDriver(), None, 3,
+                                     random.Random(0))
+        self.assertEqual([sql for _, sql, _ in samples['homepage_anon']],
+                         [0, 0, 0])
+
+    def test_small_run(self):
+        '''Does a tiny benchmark run every route without errors?'''
+        options = bench.parse_args(['--users', '20', '--messages', '100',
+                                    '--follows', '3', '--likes', '3',
+                                    '--viewers', '5', '--requests', '200',
+                                    '--warmup', '0'])
+        summary = bench.benchmark(options)
+
+        self.assertEqual(summary['requests'], 200)
+        self.assertEqual(set(summary['routes']),
+                         {scenario.__name__
+                          for scenario, weight in bench.WORKLOAD})
+        for route, stats in summary['routes'].items():
+            self.assertEqual(stats['errors'], 0, route)
+        self.assertEqual(summary['routes']['homepage_anon']['sql'], 0)
+        self.assertEqual(bench.compare(summary, summary, 0), [])
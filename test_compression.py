@@ -0,0 +1,192 @@
+"""Response compression middleware tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_compression.py
+
+import gzip
+import os
+import zlib
+from unittest import TestCase
+
+from werkzeug.test import Client, create_environ
+from werkzeug.wrappers import Response
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import compression
+from compression import CompressionMiddleware
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+CONFIG = dict(COMPRESSION_GZIP_LEVEL=6, COMPRESSION_BROTLI_QUALITY=5,
+              COMPRESSION_MIN_SIZE={'text/html': 100, 'text/css': 100})
+
+PAGE = b'<li class="card">warble</li>\n' * 50
+
+
+def wsgi_app(body, content_type='text/html; charset=utf-8', headers=()):
+    """WSGI app answering every request with `body` (bytes, or a list of
+    chunks to stream without a Content-Length)."""
+
+    def app(environ, start_response):
+        header_list = [('Content-Type', content_type)] + list(headers)
+        if isinstance(body, bytes):
+            header_list.append(('Content-Length', str(len(body))))
+        start_response('200 OK', header_list)
+        return [body] if isinstance(body, bytes) else iter(body)
+    return app
+
+
+def get(body, accept='gzip', **kwargs):
+    """Response of the compressed `wsgi_app(body, ...)` to a GET."""
+
+    client = Client(CompressionMiddleware(wsgi_app(body, **kwargs), CONFIG),
+                    Response)
+    return client.get('/', headers={'Accept-Encoding': accept})
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Test which responses are compressed, and how."""
+
+    def test_compresses_large_html(self):
+        '''Is a large page gzipped, with a correct Content-Length?'''
+        resp = get(PAGE, headers=[('Vary', 'Cookie')])
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Vary'], 'Cookie, Accept-Encoding')
+        self.assertEqual(int(resp.headers['Content-Length']), len(resp.data))
+        self.assertLess(len(resp.data), len(PAGE) / 5)
+        self.assertEqual(gzip.decompress(resp.data), PAGE)
+
+    def test_skips(self):
+        '''Are small, unlisted, encoded and unwanted responses left be?'''
+        for resp in [get(b'<p>tiny</p>'),
+                     get(PAGE, content_type='image/png'),
+                     get(PAGE, headers=[('Content-Encoding', 'br')]),
+                     get(PAGE, headers=[('Cache-Control', 'no-transform')]),
+                     get(PAGE, accept='identity'),
+                     get(PAGE, accept='gzip;q=0')]:
+            self.assertNotEqual(resp.headers.get('Content-Encoding'), 'gzip')
+            self.assertNotEqual(resp.data[:2], b'\x1f\x8b')
+
+    def test_weakens_etag(self):
+        '''Does a compressed response's strong ETag become weak?'''
+        resp = get(PAGE, headers=[('ETag', '"abc"')])
+        self.assertEqual(resp.headers['ETag'], 'W/"abc"')
+
+        resp = get(PAGE, headers=[('ETag', 'W/"abc"')])
+        self.assertEqual(resp.headers['ETag'], 'W/"abc"')
+
+    def test_streams(self):
+        '''Is a streamed body compressed chunk by chunk, as it comes?'''
+        produced = []
+
+        def chunks():
+            for i in range(5):
+                produced.append(i)
+                yield PAGE
+
+        middleware = CompressionMiddleware(wsgi_app(chunks()), CONFIG)
+        started = []
+        body = middleware(create_environ(headers={'Accept-Encoding': 'gzip'}),
+                          lambda status, headers, exc_info=None:
+                          started.append(dict(headers)))
+
+        decompressor = zlib.decompressobj(31)
+        parts = iter(body)
+        first = next(parts)
+        self.assertEqual(started[0]['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', started[0])
+        self.assertEqual(decompressor.decompress(first), PAGE)
+        self.assertEqual(produced, [0])
+
+        rest = b''.join(parts)
+        body.close()
+        self.assertEqual(decompressor.decompress(rest), PAGE * 4)
+        self.assertTrue(decompressor.eof)
+
+    def test_write_callable(self):
+        '''Is what an app passes to write() sent first, and compressed?'''
+        def app(environ, start_response):
+            write = start_response('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8'),
+                ('Content-Length', str(len(PAGE) * 2))])
+            write(PAGE)
+            return [PAGE]
+
+        client = Client(CompressionMiddleware(app, CONFIG), Response)
+        resp = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.data), PAGE * 2)
+
+        resp = client.get('/')
+        self.assertEqual(resp.data, PAGE * 2)
+
+    def test_short_stream(self):
+        '''Is a streamed body that stays small sent uncompressed?'''
+        resp = get([b'<p>', b'tiny', b'</p>'])
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, b'<p>tiny</p>')
+
+    def test_metrics(self):
+        '''Are ratio, bytes and CPU time recorded?'''
+        ratios = compression.COMPRESSION_RATIO.count(encoding='gzip')
+        cpu = compression.COMPRESSION_CPU_SECONDS.count(encoding='gzip')
+        bytes_in = compression.COMPRESSION_BYTES.value(encoding='gzip',
+                                                       direction='in')
+
+        resp = get(PAGE)
+        out = compression.COMPRESSION_BYTES.value(encoding='gzip',
+                                                  direction='out')
+        self.assertEqual(compression.COMPRESSION_RATIO.count(encoding='gzip'),
+                         ratios + 1)
+        self.assertEqual(
+            compression.COMPRESSION_CPU_SECONDS.count(encoding='gzip'),
+            cpu + 1)
+        self.assertEqual(compression.COMPRESSION_BYTES.value(
+            encoding='gzip', direction='in'), bytes_in + len(PAGE))
+        self.assertGreaterEqual(out, len(resp.data))
+
+
+class AppCompressionTestCase(TestCase):
+    """Test compression of the app's own pages."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'user{i}', email=f'user{i}@test.com',
+                 password='HASHED_PASSWORD', bio='Repetitive bio')
+            for i in range(30)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        User.query.delete()
+        db.session.commit()
+
+    def test_user_directory(self):
+        '''Is the user directory gzipped for clients that accept it?'''
+        client = app.test_client()
+        plain = client.get('/users')
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        resp = client.get('/users', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data) / 4)
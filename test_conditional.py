@@ -0,0 +1,212 @@
+"""Conditional request and Cache-Control tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_conditional.py
+
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from flask import template_rendered
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import principal
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+@contextmanager
+def rendered_templates():
+    """Collect the names of the templates rendered inside the block."""
+
+    names = []
+
+    def record(sender, template, context, **extra):
+        names.append(template.name)
+
+    template_rendered.connect(record, app)
+    try:
+        yield names
+    finally:
+        template_rendered.disconnect(record, app)
+
+
+class ConditionalTestCase(TestCase):
+    """Test ETags, Last-Modified and 304s on profiles and messages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        principal.identities.clear()
+
+        self.client = app.test_client()
+
+        author = User.signup("author", "author@test.com", "password", None)
+        reader = User.signup("reader", "reader@test.com", "password", None)
+        db.session.commit()
+        self.author_id = author.id
+        self.reader_id = reader.id
+
+        msg = Message(text="Cache me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        self.settle()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def settle(self):
+        """Move every user's last change a minute into the past."""
+
+        User.query.update({User.updated_at: datetime.utcnow()
+                           - timedelta(minutes=1)})
+        db.session.commit()
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+    def revalidate(self, path, resp):
+        """Request `path` again with `resp`'s ETag."""
+
+        etag = resp.headers['ETag']
+        return self.client.get(path, headers={'If-None-Match': etag})
+
+    def test_profile_not_modified(self):
+        '''Is an unchanged profile a 304, without rendering?'''
+        path = f'/users/{self.author_id}'
+        resp = self.client.get(path)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers['ETag'].startswith('W/"'))
+        self.assertIn('Last-Modified', resp.headers)
+        self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+
+        with rendered_templates() as names:
+            again = self.revalidate(path, resp)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+        self.assertEqual(names, [])
+        self.assertEqual(again.headers['ETag'], resp.headers['ETag'])
+
+        since = self.client.get(path, headers={
+            'If-Modified-Since': resp.headers['Last-Modified']})
+        self.assertEqual(since.status_code, 304)
+
+    def test_profile_changes(self):
+        '''Do new messages and profile edits change the ETag?'''
+        path = f'/users/{self.author_id}'
+        resp = self.client.get(path)
+
+        with app.test_client() as author:
+            with author.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+            author.post('/messages/new', data={'text': 'Newer'})
+        self.settle()
+
+        changed = self.revalidate(path, resp)
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn('Newer', changed.get_data(as_text=True))
+
+        User.query.filter_by(id=self.author_id).update({
+            User.bio: 'Edited',
+            User.profile_version: User.profile_version + 1})
+        db.session.commit()
+        self.assertEqual(self.revalidate(path, changed).status_code, 200)
+
+    def test_viewer_likes_and_follows(self):
+        '''Do the viewer's likes and follows change the ETag?'''
+        self.login()
+        path = f'/users/{self.author_id}'
+        resp = self.client.get(path)
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache, private')
+        self.assertEqual(self.revalidate(path, resp).status_code, 304)
+
+        self.client.post(f'/messages/{self.msg_id}/like',
+                         data={'liked': 'true'}, headers={'Referer': path})
+        liked = self.revalidate(path, resp)
+        self.assertEqual(liked.status_code, 200)
+        self.assertIn('fas fa-star', liked.get_data(as_text=True))
+
+        self.client.post(f'/users/follow/{self.author_id}')
+        followed = self.revalidate(path, liked)
+        self.assertEqual(followed.status_code, 200)
+        self.assertIn('Unfollow', followed.get_data(as_text=True))
+
+    def test_anonymous_and_viewer_differ(self):
+        '''Is a logged-out ETag never valid for a logged-in viewer?'''
+        path = f'/messages/{self.msg_id}'
+        resp = self.client.get(path)
+        self.assertEqual(self.revalidate(path, resp).status_code, 304)
+
+        self.login()
+        self.assertEqual(self.revalidate(path, resp).status_code, 200)
+
+    def test_recent_change_has_no_last_modified(self):
+        '''Is Last-Modified withheld within the second of a change?'''
+        User.query.update({User.updated_at: datetime.utcnow()})
+        db.session.commit()
+
+        resp = self.client.get(f'/users/{self.author_id}')
+        self.assertIn('ETag', resp.headers)
+        self.assertNotIn('Last-Modified', resp.headers)
+
+    def test_missing_pages(self):
+        '''Do missing users and messages still 404?'''
+        self.assertEqual(self.client.get('/users/999999').status_code, 404)
+        self.assertEqual(self.client.get('/messages/999999').status_code,
+                         404)
+
+    def test_default_cache_control(self):
+        '''Do other pages stay uncached?'''
+        resp = self.client.get('/')
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'no-cache, no-store, must-revalidate')
+        self.assertEqual(resp.headers['Pragma'], 'no-cache')
+        self.assertNotIn('ETag', resp.headers)
+
+    def test_static_runs_no_sql(self):
+        '''Is a logged-in static file private without loading the user?'''
+        self.login()
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = self.client.get('/static/favicon.ico')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('private', resp.headers['Cache-Control'])
+        self.assertEqual(statements, [])
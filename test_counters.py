@@ -0,0 +1,132 @@
+"""Denormalized user counter tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_counters.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountersTestCase(TestCase):
+    """Test that user counters follow the rows they count."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        u1 = User(username="user1", email="user1@test.com",
+                  password="HASHED_PASSWORD")
+        u2 = User(username="user2", email="user2@test.com",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def test_routes_maintain_counters(self):
+        '''Do the write routes keep the counters in step?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+            c.post('/messages/new', data={"text": "Hello"})
+            msg_id = Message.query.one().id
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            c.post(f'/users/follow/{self.u2_id}')
+            c.post(f'/messages/{msg_id}/like', data={'liked': 'true'})
+
+            self.assertEqual(self.counts(self.u1_id), (0, 1, 0, 1))
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 1, 0))
+
+            c.post(f'/messages/{msg_id}/like', data={'liked': 'false'})
+            c.post(f'/users/stop-following/{self.u2_id}')
+
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+    def test_message_delete_drops_likes(self):
+        '''Does deleting a liked message update the likers' counters?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+            c.post('/messages/new', data={"text": "Hello"})
+            msg_id = Message.query.one().id
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            c.post(f'/messages/{msg_id}/like', data={'liked': 'true'})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+            c.post(f'/messages/{msg_id}/delete')
+
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+
+    def test_delete_missing_message(self):
+        '''Is deleting a missing message a 404 that leaves counters be?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            resp = c.post('/messages/999999/delete')
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+    def test_repair_counters(self):
+        '''Does a repair recompute counters from the tables?'''
+        message = Message(text="Hello", user_id=self.u2_id)
+        db.session.add(message)
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u1_id, message_id=message.id))
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+        counters.repair_counters()
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u1_id), (0, 1, 0, 1))
+        self.assertEqual(self.counts(self.u2_id), (1, 0, 1, 0))
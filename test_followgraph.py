@@ -0,0 +1,190 @@
+"""Follow graph index tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_followgraph.py
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import followgraph
+from followgraph import FollowGraph, np
+import principal
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class StopThread(BaseException):
+    """Ends a refresh loop under test."""
+
+
+class FollowGraphTestCase(TestCase):
+    """Test follow lookups, from the index and from SQL."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        principal.identities.clear()
+
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'user{i}', email=f'user{i}@test.com',
+                 password='HASHED_PASSWORD') for i in range(4)])
+        db.session.commit()
+        self.ids = a, b, c, d = [
+            id for id, in db.session.query(User.id).order_by(User.id)]
+
+        # a <-> b, a -> c, d -> a
+        db.session.bulk_insert_mappings(Follows, [
+            dict(user_following_id=follower, user_being_followed_id=followed)
+            for follower, followed in [(a, b), (b, a), (a, c), (d, a)]])
+        db.session.commit()
+
+        self.saved = {key: app.config[key] for key in
+                      ('FOLLOW_GRAPH_ENABLED', 'FOLLOW_GRAPH_FOLDER')}
+        app.config['FOLLOW_GRAPH_FOLDER'] = tempfile.mkdtemp()
+        app.config['FOLLOW_GRAPH_ENABLED'] = False
+
+    def tearDown(self):
+        shutil.rmtree(app.config['FOLLOW_GRAPH_FOLDER'])
+        app.config.update(self.saved)
+        indexes = app.extensions.get('follow_graph')
+        if indexes:
+            indexes.graph = indexes.path = None
+        db.session.rollback()
+
+    def check_lookups(self):
+        a, b, c, d = self.ids
+        self.assertEqual(followgraph.following_among(a, {b, c, d, 999999}),
+                         {b, c})
+        self.assertTrue(followgraph.is_following(d, a))
+        self.assertFalse(followgraph.is_following(a, d))
+
+        user_a, user_d = User.query.get(a), User.query.get(d)
+        self.assertTrue(user_d.is_following(user_a))
+        self.assertTrue(user_a.is_followed_by(user_d))
+        self.assertFalse(user_a.is_following(user_d))
+
+    def test_sql_fallback(self):
+        '''Without an index, are lookups answered with SQL?'''
+        before = followgraph.FOLLOW_GRAPH_LOOKUPS.value(source='sql')
+        with app.test_request_context():
+            self.check_lookups()
+        self.assertGreater(followgraph.FOLLOW_GRAPH_LOOKUPS.value(
+            source='sql'), before)
+
+    @skipUnless(np, 'NumPy is not installed')
+    def test_graph(self):
+        '''Does a graph built from the table answer lookups?'''
+        with app.app_context(), db.engine.connect() as conn:
+            graph = FollowGraph.build(conn)
+        a, b, c, d = self.ids
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(graph.following(a).tolist(), [b, c])
+        self.assertEqual(graph.followers(a).tolist(), [b, d])
+        self.assertTrue(graph.is_following(a, c))
+        self.assertFalse(graph.is_following(c, a))
+        self.assertFalse(graph.is_following(999999, a))
+
+    @skipUnless(np, 'NumPy is not installed')
+    def test_changes(self):
+        '''Are changes applied over the snapshot, and replayed onto a newer
+        one only if they are newer still?'''
+        graph = FollowGraph.from_edges([1, 1], [2, 3], built_at=100)
+        graph.apply(1, 2, False, at=101)
+        graph.apply(3, 1, True, at=102)
+        graph.apply(1, 3, True, at=102)
+        self.assertEqual(graph.following(1).tolist(), [3])
+        self.assertEqual(graph.followers(1).tolist(), [3])
+        self.assertFalse(graph.is_following(1, 2))
+
+        newer = FollowGraph.from_edges([1, 1], [2, 3], built_at=102)
+        newer.replay(graph)
+        self.assertTrue(newer.is_following(1, 2))
+        self.assertTrue(newer.is_following(3, 1))
+
+    @skipUnless(np, 'NumPy is not installed')
+    def test_snapshots(self):
+        '''Are snapshots memory-mapped back, with only the newest kept?'''
+        folder = app.config['FOLLOW_GRAPH_FOLDER']
+        for built_at in (100, 200, 300):
+            FollowGraph.from_edges([1, 2], [2, 1], built_at).save(folder)
+
+        path = followgraph.latest_snapshot(folder)
+        graph = FollowGraph.load(path)
+        self.assertEqual(graph.built_at, 300)
+        self.assertIsInstance(graph.out_indices, np.memmap)
+        self.assertTrue(graph.is_following(2, 1))
+        self.assertEqual(len([entry for entry in os.listdir(folder)
+                              if not entry.startswith('.')]), 3)
+
+    @skipUnless(np, 'NumPy is not installed')
+    @patch.object(followgraph.FollowGraphIndex, '_start')
+    def test_index(self, start):
+        '''Are lookups answered from a fresh index, and from SQL for a user
+        who changed their follows since it was built?'''
+        app.config['FOLLOW_GRAPH_ENABLED'] = True
+        indexes = app.extensions['follow_graph']
+        with app.app_context():
+            indexes.refresh()
+        self.assertEqual(indexes.path, followgraph.latest_snapshot(
+            app.config['FOLLOW_GRAPH_FOLDER']))
+
+        before = followgraph.FOLLOW_GRAPH_LOOKUPS.value(source='index')
+        with app.test_request_context():
+            self.check_lookups()
+        self.assertGreater(followgraph.FOLLOW_GRAPH_LOOKUPS.value(
+            source='index'), before)
+
+        a, b, c, d = self.ids
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = c
+        client.post(f'/users/follow/{d}')
+        self.assertTrue(indexes.graph.is_following(c, d))
+        with client.session_transaction() as sess:
+            self.assertGreaterEqual(sess[followgraph.CHANGED_KEY],
+                                    indexes.graph.built_at)
+
+        with app.test_request_context():
+            self.assertIsNotNone(followgraph.index())
+            indexes.graph.built_at = time.time() - 3600
+            self.assertIsNone(followgraph.index())
+
+    @skipUnless(np, 'NumPy is not installed')
+    @patch.object(followgraph.time, 'sleep', side_effect=[None, StopThread])
+    @patch.object(followgraph.FollowGraphIndex, 'refresh',
+                  side_effect=RuntimeError('boom'))
+    def test_refresh_errors_logged(self, refresh, sleep):
+        '''Does the refresh thread log unexpected errors and carry on?'''
+        indexes = app.extensions['follow_graph']
+        with self.assertLogs(app.logger, 'ERROR'):
+            with self.assertRaises(StopThread):
+                indexes._run()
+        self.assertEqual(refresh.call_count, 2)
@@ -0,0 +1,221 @@
+"""Follow, unfollow and follow import tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_follows.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import follows
+import principal
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class FollowsTestCase(TestCase):
+    """Test set-based follows and bulk follow imports."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        principal.identities.clear()
+
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'user{i}', email=f'user{i}@test.com',
+                 password='HASHED_PASSWORD') for i in range(6)])
+        db.session.commit()
+        self.ids = [id for id, in
+                    db.session.query(User.id).order_by(User.id)]
+        self.me_id = self.ids[0]
+
+        db.session.add(Message(text="Hello", user_id=self.ids[1]))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.me_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self, user_id):
+        return db.session.query(User.following_count,
+                                User.followers_count).filter(
+            User.id == user_id).one()
+
+    def test_follow_and_unfollow_repeat(self):
+        '''Do repeated follows and unfollows change things only once?'''
+        for _ in range(2):
+            resp = self.client.post(f'/users/follow/{self.ids[1]}')
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.counts(self.me_id), (1, 0))
+            self.assertEqual(self.counts(self.ids[1]), (0, 1))
+            self.assertEqual(TimelineEntry.query.filter_by(
+                owner_id=self.me_id).count(), 1)
+
+        for _ in range(2):
+            resp = self.client.post(f'/users/stop-following/{self.ids[1]}')
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.counts(self.me_id), (0, 0))
+            self.assertEqual(self.counts(self.ids[1]), (0, 0))
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_follow_self(self):
+        '''Are users kept from following themselves?'''
+        resp = self.client.post(f'/users/follow/{self.me_id}')
+        self.assertEqual(resp.status_code, 302)
+        with app.app_context():
+            with self.assertRaises(ValueError):
+                follows.set_following(self.me_id, self.me_id, True)
+
+        resp = self.client.post('/users/following/import', json={
+            'following': [self.me_id, self.ids[1]]})
+        self.assertEqual(resp.get_json(), {'added': 1})
+        self.assertEqual(self.counts(self.me_id), (1, 0))
+        self.assertEqual(Follows.query.filter_by(
+            user_following_id=self.me_id,
+            user_being_followed_id=self.me_id).count(), 0)
+
+    def test_missing_user(self):
+        '''Is following or unfollowing a missing user a 404?'''
+        for path in ['/users/follow/999999', '/users/stop-following/999999']:
+            self.assertEqual(self.client.post(path).status_code, 404)
+        self.assertEqual(self.counts(self.me_id), (0, 0))
+
+    def test_import_endpoint(self):
+        '''Are new follows added, and existing ones and unknown ids
+        skipped?'''
+        self.client.post(f'/users/follow/{self.ids[1]}')
+
+        resp = self.client.post('/users/following/import', json={
+            'following': self.ids[1:4] + [self.ids[2], 999999]})
+        self.assertEqual(resp.get_json(), {'added': 2})
+        self.assertEqual(self.counts(self.me_id), (3, 0))
+        for user_id in self.ids[1:4]:
+            self.assertEqual(self.counts(user_id), (0, 1))
+
+        resp = self.client.post('/users/following/import',
+                                json={'following': self.ids[1:4]})
+        self.assertEqual(resp.get_json(), {'added': 0})
+        self.assertEqual(self.counts(self.me_id), (3, 0))
+
+    def import_statements(self, n):
+        """Statements run to import follows of `n` new users with three
+        messages each."""
+
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'new{n}-{i}', email=f'new{n}-{i}@test.com',
+                 password='HASHED_PASSWORD') for i in range(n)])
+        db.session.commit()
+        new_ids = [id for id, in db.session.query(User.id).filter(
+            User.username.like(f'new{n}-%'))]
+        db.session.bulk_insert_mappings(Message, [
+            dict(text=f'warble {i}', user_id=id)
+            for id in new_ids for i in range(3)])
+        db.session.commit()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            # so neither count includes loading the user
+            principal.remember(User.query.get(self.me_id))
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = self.client.post('/users/following/import',
+                                        json={'following': new_ids})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(resp.get_json(), {'added': n})
+        return len(statements)
+
+    def test_import_statements(self):
+        '''Does an import run as many statements for 30 follows as for 3,
+        and backfill each followed user's latest messages?'''
+        saved = app.config['TIMELINE_BACKFILL_LIMIT']
+        app.config['TIMELINE_BACKFILL_LIMIT'] = 2
+        try:
+            self.assertEqual(self.import_statements(3),
+                             self.import_statements(30))
+        finally:
+            app.config['TIMELINE_BACKFILL_LIMIT'] = saved
+
+        self.assertEqual(TimelineEntry.query.filter_by(
+            owner_id=self.me_id).count(), 33 * 2)
+
+    def test_import_errors(self):
+        '''Are bad bodies, huge lists and anonymous users refused?'''
+        for body in [{}, {'following': 'all'}, {'following': ['1']}]:
+            resp = self.client.post('/users/following/import', json=body)
+            self.assertEqual(resp.status_code, 400)
+
+        limit = app.config['FOLLOW_IMPORT_MAX']
+        resp = self.client.post('/users/following/import',
+                                json={'following': [1] * (limit + 1)})
+        self.assertEqual(resp.status_code, 413)
+
+        resp = app.test_client().post('/users/following/import',
+                                      json={'following': self.ids})
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(Follows.query.count(), 0)
+
+    def test_import_batches(self):
+        '''Are imports written in batches, with counters for each user?'''
+        edges = [(follower, followed) for follower in self.ids
+                 for followed in self.ids if follower != followed]
+        saved = follows.IMPORT_BATCH
+        follows.IMPORT_BATCH = 7
+        try:
+            with app.app_context():
+                self.assertEqual(follows.import_follows(edges), len(edges))
+                db.session.commit()
+        finally:
+            follows.IMPORT_BATCH = saved
+
+        self.assertEqual(Follows.query.count(), len(edges))
+        for user_id in self.ids:
+            self.assertEqual(self.counts(user_id), (5, 5))
+
+    def test_import_command(self):
+        '''Does `flask import-follows` read the generator's CSV format?'''
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('user_being_followed_id,user_following_id\n')
+            for followed in self.ids[1:]:
+                f.write(f'{followed},{self.me_id}\n')
+            f.flush()
+
+            result = app.test_cli_runner().invoke(
+                args=['import-follows', f.name, '--chunk-rows', '2'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Added 5 follows.', result.output)
+        self.assertEqual(self.counts(self.me_id), (5, 0))
@@ -0,0 +1,130 @@
+"""Message card fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fragments.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from fragments import FragmentCache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test the LRU cache itself."""
+
+    def test_lru_eviction(self):
+        '''Are the least recently used cards evicted first?'''
+        cache = FragmentCache(max_entries=2)
+        cache.set(1, 0, 'one')
+        cache.set(2, 0, 'two')
+        self.assertEqual(cache.get(1, 0), 'one')
+
+        cache.set(3, 0, 'three')
+        self.assertIsNone(cache.get(2, 0))
+        self.assertEqual(cache.get(1, 0), 'one')
+        self.assertEqual(cache.get(3, 0), 'three')
+        self.assertEqual(cache.stats(), dict(hits=3, misses=1, entries=2,
+                                             max_entries=2))
+
+    def test_version_mismatch(self):
+        '''Is a card for an older profile version a miss?'''
+        cache = FragmentCache(max_entries=2)
+        cache.set(1, 0, 'old')
+        self.assertIsNone(cache.get(1, 1))
+
+        cache.evict(1)
+        self.assertEqual(len(cache), 0)
+
+
+class MessageCardTestCase(TestCase):
+    """Test cached cards on rendered pages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+        self.cache = app.extensions['fragment_cache']
+        self.cache.clear()
+
+        author = User.signup(username="author", email="author@test.com",
+                             password="password", image_url=None)
+        reader = User.signup(username="reader", email="reader@test.com",
+                             password="password", image_url=None)
+        db.session.commit()
+        self.author_id = author.id
+        self.reader_id = reader.id
+
+        message = Message(text="cached warble", user_id=author.id)
+        db.session.add(message)
+        db.session.commit()
+        self.message_id = message.id
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_card_cached_with_viewer_overlay(self):
+        '''Is one cached card shared by viewers with different stars?'''
+        with self.client as c:
+            self.login(c, self.reader_id)
+            html = c.get(f'/users/{self.author_id}').get_data(as_text=True)
+            self.assertIn("cached warble", html)
+            self.assertIn(f'/messages/{self.message_id}/like', html)
+
+            self.login(c, self.author_id)
+            html = c.get(f'/users/{self.author_id}').get_data(as_text=True)
+            self.assertIn("cached warble", html)
+            self.assertNotIn(f'/messages/{self.message_id}/like', html)
+
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_profile_update_invalidates(self):
+        '''Does a profile update re-render the author's cards?'''
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.get(f'/users/{self.author_id}')
+
+            c.post('/users/profile', data={"username": "renamed",
+                                           "email": "author@test.com",
+                                           "password": "password"})
+
+            html = c.get(f'/users/{self.author_id}').get_data(as_text=True)
+            self.assertIn("@renamed", html)
+            self.assertNotIn("@author<", html)
+
+    def test_delete_evicts(self):
+        '''Does deleting a message drop its card?'''
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.get(f'/users/{self.author_id}')
+            self.assertEqual(len(self.cache), 1)
+
+            c.post(f'/messages/{self.message_id}/delete')
+            self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,107 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_hashing.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import hashing
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HashingTestCase(TestCase):
+    """Test hashing costs, rehashing and the bounded pool."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+        with app.app_context():
+            User.signup("hasher", "hasher@test.com", "password", None)
+            db.session.commit()
+
+    def tearDown(self):
+        app.config['BCRYPT_LOG_ROUNDS'] = self.rounds
+        db.session.rollback()
+
+    def stored_hash(self):
+        return User.query.filter_by(username="hasher").one().password
+
+    def test_configured_cost(self):
+        '''Are new hashes made at BCRYPT_LOG_ROUNDS?'''
+        self.assertEqual(hashing.hash_cost(self.stored_hash()), 4)
+
+    def test_rehash_on_login(self):
+        '''Does logging in upgrade a hash made at an old cost?'''
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+
+        with self.client as c:
+            resp = c.post('/login', data={"username": "hasher",
+                                          "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+        hashed = self.stored_hash()
+        self.assertEqual(hashing.hash_cost(hashed), 5)
+        self.assertTrue(hashing.check_password(hashed, "password"))
+
+    def test_wrong_password_not_rehashed(self):
+        '''Is a failed login left alone?'''
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.assertFalse(User.authenticate("hasher", "wrong"))
+        self.assertEqual(hashing.hash_cost(self.stored_hash()), 4)
+
+    def test_busy_pool(self):
+        '''Does a full pool refuse work, and the app answer 503?'''
+        full = hashing.HashingPool(workers=1, max_pending=0)
+        with self.assertRaises(hashing.HashingBusy):
+            full.run('hash', hashing._hash, 'password', 4)
+
+        pool = hashing._pool
+        hashing._pool = full
+        try:
+            resp = self.client.post('/login', data={"username": "hasher",
+                                                    "password": "password"})
+        finally:
+            hashing._pool = pool
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
+
+    def test_benchmark(self):
+        '''Does the benchmark pick the highest cost within budget?'''
+        timings, best = hashing.benchmark(60, rounds=range(4, 6), samples=1)
+        self.assertEqual([cost for cost, seconds in timings], [4, 5])
+        self.assertEqual(best, 5)
+
+        timings, best = hashing.benchmark(0, rounds=range(4, 6), samples=1)
+        self.assertEqual(len(timings), 1)
+        self.assertIsNone(best)
@@ -0,0 +1,211 @@
+"""Like endpoint tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_likes.py
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import likes
+import principal
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class LikeEndpointTestCase(TestCase):
+    """Test liking and unliking messages with POST requests."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        principal.identities.clear()
+        # drop changes left pending by other tests' (since deleted) messages
+        app.extensions['like_counts'].buffer.take()
+
+        author = User.signup("author", "author@test.com", "password", None)
+        reader = User.signup("reader", "reader@test.com", "password", None)
+        db.session.commit()
+        self.reader_id = reader.id
+        self.author_id = author.id
+
+        msg = Message(text="Like me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+        self.path = f'/messages/{msg.id}/like'
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def likes_count(self):
+        return db.session.query(User.likes_count).filter(
+            User.id == self.reader_id).scalar()
+
+    def test_like_and_unlike(self):
+        '''Do repeated likes and unlikes succeed without double counting?'''
+        for _ in range(2):
+            resp = self.client.post(self.path, json={'liked': True})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json(), {'liked': True, 'likes': 1})
+            self.assertEqual(self.likes_count(), 1)
+
+        for _ in range(2):
+            resp = self.client.post(self.path, json={'liked': False})
+            self.assertEqual(resp.get_json(), {'liked': False, 'likes': 0})
+            self.assertEqual(self.likes_count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_form_post(self):
+        '''Is a plain form post sent back to the page it came from?'''
+        resp = self.client.post(self.path, data={'liked': 'true'},
+                                headers={'Referer': '/users/1'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertTrue(resp.location.endswith('/users/1'))
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_legacy_routes_read_only(self):
+        '''Do the old GET like and unlike links only show the message?'''
+        for action in ('add_like', 'delete_like'):
+            resp = self.client.get(f'/users/{action}/{self.msg_id}')
+            self.assertEqual(resp.status_code, 301)
+            self.assertTrue(resp.location.endswith(f'/messages/{self.msg_id}'))
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(self.likes_count(), 0)
+
+    def test_errors(self):
+        '''Are missing messages, bad bodies and anonymous users refused?'''
+        resp = self.client.post('/messages/999999/like', json={'liked': True})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.post('/messages/999999/like',
+                                json={'liked': False})
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.post(self.path, json={'liked': 'yes'})
+        self.assertEqual(resp.status_code, 400)
+
+        resp = app.test_client().post(self.path, json={'liked': True})
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(Likes.query.count(), 0)
+
+
+class LikeCountTestCase(LikeEndpointTestCase):
+    """Test writing messages' like counts behind."""
+
+    # the endpoint tests are inherited only for their setUp
+    test_like_and_unlike = test_form_post = None
+    test_legacy_routes_repeat = test_errors = None
+
+    def setUp(self):
+        super().setUp()
+        self.aggregator = app.extensions['like_counts']
+
+    def stored_count(self):
+        return db.session.query(Message.like_count).filter(
+            Message.id == self.msg_id).scalar()
+
+    def test_written_behind(self):
+        '''Is a like counted at once, but written on the next flush?'''
+        self.client.post(self.path, json={'liked': True})
+        self.assertEqual(self.aggregator.pending(self.msg_id), 1)
+        self.assertGreater(self.aggregator.buffer.lag(), 0)
+
+        self.aggregator.flush()
+        self.assertEqual(self.aggregator.pending(self.msg_id), 0)
+        self.assertEqual(self.stored_count(), 1)
+        self.assertEqual(likes.LIKE_COUNT_FLUSH_LAG.value(), 0)
+
+        resp = self.client.post(self.path, json={'liked': False})
+        self.assertEqual(resp.get_json()['likes'], 0)
+        self.aggregator.flush()
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_shown_on_pages(self):
+        '''Do pages show the stored count plus pending changes?'''
+        self.client.post(self.path, json={'liked': True})
+        html = app.test_client().get(f'/users/{self.author_id}').get_data(
+            as_text=True)
+        self.assertIn('<i class="far fa-star"></i> 1', html)
+
+    def test_rollback_drops_changes(self):
+        '''Are changes from a rolled back transaction never counted?'''
+        with app.test_request_context():
+            likes.set_liked(self.reader_id, self.msg_id, True)
+            db.session.rollback()
+        self.assertEqual(self.aggregator.pending(self.msg_id), 0)
+
+    def test_failed_flush_retried(self):
+        '''Are changes kept for the next flush when writing fails?'''
+        self.client.post(self.path, json={'liked': True})
+
+        def fail(conn, deltas):
+            raise SQLAlchemyError('database went away')
+
+        with patch.object(likes, 'write_like_counts', fail):
+            self.assertEqual(self.aggregator.flush(), 0)
+        self.assertEqual(self.aggregator.pending(self.msg_id), 1)
+
+        self.assertEqual(self.aggregator.flush(), 1)
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_batched_updates(self):
+        '''Is one UPDATE written per distinct change, plus the authors'?'''
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        self.aggregator.buffer.add({self.msg_id: 2, 999998: 2, 999999: -1})
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.aggregator.flush()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        updates = [s for s in statements if s.startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(self.stored_count(), 2)
+
+    def test_reconcile(self):
+        '''Does reconciliation fix counts lost with a worker?'''
+        self.client.post(self.path, json={'liked': True})
+        self.aggregator.buffer.take()
+        self.assertEqual(self.stored_count(), 0)
+
+        with app.app_context():
+            self.assertEqual(likes.reconcile(1000, echo=lambda line: None),
+                             1)
+            self.assertEqual(likes.reconcile(1000, echo=lambda line: None),
+                             0)
+        self.assertEqual(self.stored_count(), 1)
@@ -0,0 +1,160 @@
+"""Bulk CSV loader tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_loader.py
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+
+import click
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import loader
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+ON_POSTGRES = db.engine.dialect.name == 'postgresql'
+
+USERS_CSV = """email,username,image_url,password,bio,header_image_url,location
+a@test.com,alice,/a.png,HASHED,"likes
+newlines",/h.png,Here
+b@test.com,bob,/b.png,HASHED,,/h.png,There
+c@test.com,carol,/c.png,HASHED,,/h.png,
+"""
+
+MESSAGES_CSV = """text,timestamp,user_id
+one,2020-01-01 00:00:00,1
+two,2020-01-02 00:00:00,2
+three,2020-01-03 00:00:00,2
+four,2020-01-04 00:00:00,3
+five,2020-01-05 00:00:00,1
+"""
+
+FOLLOWS_CSV = """user_being_followed_id,user_following_id
+2,1
+3,1
+1,2
+"""
+
+
+class Interrupted(Exception):
+    pass
+
+
+class LoaderTestCase(TestCase):
+    """Test chunked CSV loading."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, text in (('users.csv', USERS_CSV),
+                           ('messages.csv', MESSAGES_CSV),
+                           ('follows.csv', FOLLOWS_CSV)):
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.rollback()
+
+    def test_read_chunks(self):
+        '''Are CSVs split into whole records, resuming after `skip`?'''
+        path = os.path.join(self.directory, 'messages.csv')
+        chunks = list(loader.read_chunks(path, 2))
+        self.assertEqual([count for columns, buffer, count in chunks],
+                         [2, 2, 1])
+        self.assertEqual(chunks[0][0], ['text', 'timestamp', 'user_id'])
+
+        chunks = list(loader.read_chunks(path, 2, skip=3))
+        self.assertEqual([count for columns, buffer, count in chunks], [2])
+        self.assertTrue(chunks[0][1].getvalue().startswith('four,'))
+
+        path = os.path.join(self.directory, 'users.csv')
+        columns, buffer, count = next(loader.read_chunks(path, 1))
+        self.assertEqual(count, 1)
+        self.assertIn('"likes\nnewlines"', buffer.getvalue())
+
+    def test_unknown_columns(self):
+        '''Is a CSV header naming a missing column refused?'''
+        with self.assertRaises(click.ClickException):
+            loader.column_list('users', ['username', 'nope'])
+        self.assertEqual(loader.column_list('follows',
+                                            ['user_following_id']),
+                         '"user_following_id"')
+
+    def test_load_files(self):
+        '''Are missing CSVs (here likes.csv) skipped?'''
+        self.assertEqual([table for table, path
+                          in loader.load_files(self.directory)],
+                         ['users', 'messages', 'follows'])
+
+    @skipUnless(ON_POSTGRES, "COPY needs PostgreSQL")
+    def test_full_load_and_resume(self):
+        '''Does an interrupted load resume and rebuild what it deferred?'''
+        def interrupt(line):
+            if line.startswith('messages: 2 rows'):
+                raise Interrupted()
+
+        with app.app_context():
+            with self.assertRaises(Interrupted):
+                loader.load(self.directory, chunk_rows=2, echo=interrupt)
+            self.assertEqual(Message.query.count(), 2)
+
+            loader.load(self.directory, chunk_rows=2, resume=True,
+                        echo=lambda line: None)
+
+            self.assertEqual(User.query.count(), 3)
+            self.assertEqual(Message.query.count(), 5)
+            self.assertEqual(Follows.query.count(), 3)
+            self.assertEqual(
+                db.session.execute(
+                    'SELECT count(*) FROM load_deferred_ddl').scalar(), 0)
+
+            alice = User.query.filter_by(username='alice').one()
+            self.assertEqual(alice.messages_count, 2)
+            self.assertEqual(alice.following_count, 2)
+
+            # the sequence continues past the loaded ids
+            user = User(username='dave', email='d@test.com',
+                        password='HASHED')
+            db.session.add(user)
+            db.session.commit()
+            self.assertEqual(user.id, 4)
+
+    @skipUnless(ON_POSTGRES, "COPY needs PostgreSQL")
+    def test_incremental_load(self):
+        '''Does an incremental load skip rows that already exist?'''
+        with app.app_context():
+            loader.load(self.directory, echo=lambda line: None)
+            loader.load(self.directory, incremental=True,
+                        echo=lambda line: None)
+
+            self.assertEqual(User.query.count(), 3)
+            self.assertEqual(Follows.query.count(), 3)
+
+    def test_requires_postgres(self):
+        '''Is the loader refused on other databases?'''
+        if ON_POSTGRES:
+            return
+        with app.app_context():
+            with self.assertRaises(click.ClickException):
+                loader.load(self.directory)
@@ -0,0 +1,186 @@
+"""Image upload and thumbnail tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_media.py
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, skipIf, skipUnless
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import media
+from media import Image
+import principal
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+DIGEST = 'ab' * 32
+
+
+def png(size=(600, 300), color='red'):
+    """Bytes of a PNG image."""
+
+    data = io.BytesIO()
+    Image.new('RGB', size, color).save(data, 'PNG')
+    return data.getvalue()
+
+
+class MediaTestCase(TestCase):
+    """Test storing, resizing and serving uploaded images."""
+
+    def setUp(self):
+        # their messages, follows and likes go too, by cascade
+        User.query.delete()
+        db.session.commit()
+        principal.identities.clear()
+
+        self.saved = app.config['MEDIA_FOLDER']
+        app.config['MEDIA_FOLDER'] = tempfile.mkdtemp()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(app.config['MEDIA_FOLDER'])
+        app.config['MEDIA_FOLDER'] = self.saved
+        db.session.rollback()
+
+    def signup(self, image):
+        return self.client.post('/signup', data={
+            'username': 'uploader', 'email': 'uploader@test.com',
+            'password': 'password',
+            'image': (io.BytesIO(image), 'me.png')})
+
+    def test_thumbnail(self):
+        '''Are upload URLs resized, and other URLs left alone?'''
+        with app.test_request_context():
+            upload = f'/media/{DIGEST}/avatar-lg.jpg'
+            self.assertEqual(media.thumbnail(upload, 'sm'),
+                             f'/media/{DIGEST}/avatar-sm.jpg')
+            self.assertEqual(media.thumbnail(upload, 'huge'), upload)
+            for url in ['https://example.com/me.jpg',
+                        '/static/images/default-pic.png', None]:
+                self.assertEqual(media.thumbnail(url, 'sm'), url)
+
+    def test_missing(self):
+        '''Are unknown uploads, sizes and names 404s?'''
+        for path in [f'/media/{DIGEST}/avatar-sm.jpg',
+                     f'/media/{DIGEST}/avatar-huge.jpg',
+                     f'/media/{DIGEST}/original',
+                     '/media/nope/avatar-sm.jpg']:
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_pool(self):
+        '''Does the pool run each job once, without waiting, and refuse
+        work past its backlog?'''
+        pool = media.ResizePool(1, 2)
+        release = threading.Event()
+        runs = []
+
+        def job(name):
+            release.wait(5)
+            runs.append(name)
+
+        first = pool.submit('a', job, 'a')
+        self.assertIs(pool.submit('a', job, 'a'), first)
+        pool.submit('b', job, 'b')
+        with self.assertRaises(media.MediaBusy):
+            pool.submit('c', job, 'c')
+
+        release.set()
+        pool.join()
+        self.assertEqual(runs, ['a', 'b'])
+        pool.submit('c', job, 'c').result()
+
+    @skipIf(Image is not None, 'Pillow is installed')
+    def test_uploads_unavailable(self):
+        '''Without Pillow, is an upload refused with a form error?'''
+        resp = self.signup(b'\x89PNG not really')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Image uploads are not available.',
+                      resp.get_data(as_text=True))
+        self.assertEqual(User.query.count(), 0)
+
+    @skipUnless(Image, 'Pillow is not installed')
+    def test_upload(self):
+        '''Is an upload resized into its sizes, served for a year?'''
+        resp = self.signup(png())
+        self.assertEqual(resp.status_code, 302)
+        media.pool().join()
+
+        url = User.query.one().image_url
+        self.assertRegex(url, r'^/media/[0-9a-f]{64}/avatar-lg\.jpg$')
+        for size, dimensions in app.config['MEDIA_SIZES']['avatar'].items():
+            with app.test_request_context():
+                resp = self.client.get(media.thumbnail(url, size))
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.content_type, 'image/jpeg')
+            self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+            self.assertEqual(Image.open(io.BytesIO(resp.data)).size,
+                             dimensions)
+            resp.close()
+
+    @skipUnless(Image, 'Pillow is not installed')
+    def test_content_addressed(self):
+        '''Do identical uploads share one stored copy?'''
+        with app.test_request_context():
+            first = media.save_upload(
+                type('Upload', (), {'stream': io.BytesIO(png())}), 'avatar')
+            again = media.save_upload(
+                type('Upload', (), {'stream': io.BytesIO(png())}), 'avatar')
+            other = media.save_upload(
+                type('Upload', (), {'stream': io.BytesIO(png(color='blue'))}),
+                'avatar')
+        media.pool().join()
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+
+    @skipUnless(Image, 'Pillow is not installed')
+    def test_original_until_resized(self):
+        '''Is the original served, uncached, until its thumbnail exists?'''
+        data = png()
+        with app.test_request_context():
+            url = media.save_upload(
+                type('Upload', (), {'stream': io.BytesIO(data)}), 'avatar')
+        media.pool().join()
+        digest = url.split('/')[2]
+        path = media.directory(app.config['MEDIA_FOLDER'], digest)
+        os.remove(os.path.join(path, 'avatar-sm.jpg'))
+
+        resp = self.client.get(f'/media/{digest}/avatar-sm.jpg')
+        self.assertEqual(resp.data, data)
+        self.assertEqual(resp.content_type, 'image/png')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+        resp.close()
+
+        media.pool().join()
+        self.assertTrue(os.path.exists(os.path.join(path, 'avatar-sm.jpg')))
+
+    @skipUnless(Image, 'Pillow is not installed')
+    def test_rejects_non_images(self):
+        '''Is a file that isn't an image refused?'''
+        resp = self.signup(b'GIF89a but not really')
+        self.assertIn("isn&#39;t an image we can read",
+                      resp.get_data(as_text=True))
+        self.assertEqual(User.query.count(), 0)
@@ -0,0 +1,124 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_metrics.py
+
+import os
+from unittest import TestCase
+
+from sqlalchemy.exc import DBAPIError
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import metrics
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    """Test metric types and the /metrics endpoint."""
+
+    def setUp(self):
+        """Create test client."""
+
+        User.query.delete()
+        db.session.commit()
+        self.client = app.test_client()
+        app.config['METRICS_TOKEN'] = 'scraper'
+
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = None
+
+    def test_histogram(self):
+        '''Are histogram buckets cumulative with a +Inf overflow?'''
+        registry = metrics.REGISTRY
+        histogram = metrics.Histogram('test_histogram', 'Test.', ['kind'],
+                                      buckets=(1, 10))
+        registry.metrics.remove(histogram)
+
+        for value in (0.5, 5, 50):
+            histogram.observe(value, kind='a')
+
+        text = histogram.render()
+        self.assertIn('test_histogram_bucket{kind="a",le="1"} 1', text)
+        self.assertIn('test_histogram_bucket{kind="a",le="10"} 2', text)
+        self.assertIn('test_histogram_bucket{kind="a",le="+Inf"} 3', text)
+        self.assertIn('test_histogram_sum{kind="a"} 55.5', text)
+        self.assertIn('test_histogram_count{kind="a"} 3', text)
+        self.assertEqual(histogram.count(kind='a'), 3)
+
+    def test_request_metrics(self):
+        '''Are request, SQL and template timings recorded?'''
+        before = metrics.REQUEST_SQL_STATEMENTS.count(endpoint='list_users')
+        renders = metrics.TEMPLATE_SECONDS.count(template='users/index.html')
+
+        with self.client as c:
+            resp = c.get('/users')
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.get('/metrics',
+                          headers={'Authorization': 'Bearer scraper'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith('text/plain'))
+
+        text = resp.get_data(as_text=True)
+        self.assertIn('warbler_request_duration_seconds_count'
+                      '{endpoint="list_users",method="GET",status="200"}', text)
+        self.assertIn('warbler_sql_statements_total', text)
+        self.assertEqual(
+            metrics.REQUEST_SQL_STATEMENTS.count(endpoint='list_users'),
+            before + 1)
+        self.assertEqual(
+            metrics.TEMPLATE_SECONDS.count(template='users/index.html'),
+            renders + 1)
+
+    def test_bcrypt_metrics(self):
+        '''Is password hashing timed?'''
+        before = metrics.BCRYPT_SECONDS.count(operation='hash')
+        User.signup(username="metrics", email="metrics@test.com",
+                    password="password", image_url=None)
+        db.session.rollback()
+        self.assertEqual(metrics.BCRYPT_SECONDS.count(operation='hash'),
+                         before + 1)
+
+    def test_metrics_token(self):
+        '''Is /metrics refused without the token, and hidden without one
+        configured?'''
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        resp = self.client.get('/metrics',
+                               headers={'Authorization': 'Bearer guess'})
+        self.assertEqual(resp.status_code, 401)
+
+        app.config['METRICS_TOKEN'] = None
+        resp = self.client.get('/metrics',
+                               headers={'Authorization': 'Bearer None'})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_failed_statement(self):
+        '''Does a failing statement leave no start time behind?'''
+        with app.app_context(), db.engine.connect() as conn:
+            with self.assertRaises(DBAPIError):
+                conn.execute('SELECT * FROM no_such_table')
+            self.assertEqual(conn.info['metrics_query_start'], [])
+
+            before = metrics.SQL_STATEMENTS.value()
+            conn.execute('SELECT 1')
+            self.assertEqual(metrics.SQL_STATEMENTS.value(), before + 1)
+            self.assertEqual(conn.info['metrics_query_start'], [])
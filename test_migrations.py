@@ -0,0 +1,127 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrations.py
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import migrations
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+# the tables as the app first shipped them
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY, email TEXT NOT NULL UNIQUE,
+        username TEXT NOT NULL UNIQUE, image_url TEXT,
+        header_image_url TEXT, bio TEXT, location TEXT,
+        password TEXT NOT NULL)""",
+    """CREATE TABLE follows (
+        user_being_followed_id INTEGER REFERENCES users (id)
+            ON DELETE CASCADE,
+        user_following_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        PRIMARY KEY (user_being_followed_id, user_following_id))""",
+    """CREATE TABLE messages (
+        id INTEGER PRIMARY KEY, text VARCHAR(140) NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE)""",
+    """CREATE TABLE likes (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        message_id INTEGER REFERENCES messages (id) ON DELETE CASCADE,
+        CONSTRAINT _like_uc UNIQUE (user_id, message_id))""",
+]
+
+
+def index_names(table):
+    return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+
+class MigrationTestCase(TestCase):
+    """Test applying and recording migrations."""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.session.remove()
+        db.engine.execute('DROP TABLE IF EXISTS schema_migrations')
+
+    def tearDown(self):
+        # searching cached cards for message ids that later tests may reuse
+        app.extensions['fragment_cache'].clear()
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.context.pop()
+
+    def test_migrate_fresh_schema(self):
+        '''Does a created schema migrate cleanly, once?'''
+        applied = migrations.migrate(echo=lambda line: None)
+        self.assertEqual(applied, [m.id for m in migrations.MIGRATIONS])
+        self.assertTrue(all(done for m, done in migrations.status()))
+
+        self.assertEqual(migrations.migrate(echo=lambda line: None), [])
+
+    def test_adds_missing_indexes(self):
+        '''Does a pending migration build the indexes it declares?'''
+        db.engine.execute('DROP INDEX ix_likes_message')
+        db.engine.execute('DROP INDEX ix_messages_user_timestamp')
+        self.assertNotIn('ix_likes_message', index_names('likes'))
+
+        migrations.stamp()
+        db.engine.execute("DELETE FROM schema_migrations "
+                          "WHERE id = '0005_hot_path_indexes'")
+
+        self.assertEqual(migrations.migrate(echo=lambda line: None),
+                         ['0005_hot_path_indexes'])
+        self.assertIn('ix_likes_message', index_names('likes'))
+        self.assertIn('ix_messages_user_timestamp', index_names('messages'))
+        self.assertIn('ix_follows_following', index_names('follows'))
+
+    def test_migrate_baseline_schema(self):
+        '''Can a database with the original schema be migrated, and its
+        old and new messages searched?'''
+        db.drop_all()
+        for statement in BASELINE_SCHEMA:
+            db.engine.execute(statement)
+        db.engine.execute("INSERT INTO users (id, email, username, password) "
+                          "VALUES (1, 'old@test.com', 'old', 'HASHED')")
+        db.engine.execute("INSERT INTO messages (text, timestamp, user_id) "
+                          "VALUES ('an old warble', '2020-01-01 00:00:00', 1)")
+
+        migrations.migrate(echo=lambda line: None)
+        db.session.add(Message(text="a new warble", user_id=1))
+        db.session.commit()
+
+        html = app.test_client().get('/messages/search?q=warble').get_data(
+            as_text=True)
+        self.assertIn('an old warble', html)
+        self.assertIn('a new warble', html)
+
+    def test_stamp(self):
+        '''Does stamping record every migration without running any?'''
+        migrations.stamp()
+        self.assertEqual(migrations.migrate(echo=lambda line: None), [])
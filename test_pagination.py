@@ -0,0 +1,127 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_pagination.py
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from pagination import encode_cursor, decode_cursor
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor pagination of list views."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+        app.config['PAGE_SIZE'] = 2
+
+        users = [User(username=f"user{i}",
+                      email=f"user{i}@test.com",
+                      password="HASHED_PASSWORD") for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.user_ids = [user.id for user in users]
+        self.user_id = users[0].id
+
+        for i in range(5):
+            db.session.add(Message(text=f"message {i}",
+                                   timestamp=datetime(2020, 1, 1 + i),
+                                   user_id=self.user_id))
+        db.session.commit()
+
+    def tearDown(self):
+        app.config['PAGE_SIZE'] = 100
+
+    def test_cursor_round_trip(self):
+        '''Do cursors decode back into the values they were built from?'''
+        key = (datetime(2020, 1, 2, 3, 4, 5), 42)
+        cursor = encode_cursor(key)
+        self.assertEqual(decode_cursor(cursor, (Message.timestamp, Message.id)),
+                         list(key))
+
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, (Message.id,))
+
+    def test_profile_pages(self):
+        '''Can we walk a profile's messages with "older" links?'''
+        with self.client as c:
+            resp = c.get(f'/users/{self.user_id}')
+            html = resp.get_data(as_text=True)
+            self.assertIn("message 4", html)
+            self.assertIn("message 3", html)
+            self.assertNotIn("message 2", html)
+            self.assertIn("cursor=", html)
+
+            seen = []
+            url = f'/users/{self.user_id}'
+            while url:
+                resp = c.get(url)
+                page = resp.get_data(as_text=True)
+                shown = [i for i in range(5) if f"message {i}<" in page]
+                seen += sorted(shown,
+                               key=lambda i: page.index(f"message {i}<"))
+                url = None
+                if 'class="pager"' in page:
+                    start = page.index('href="', page.index('class="pager"'))
+                    url = page[start + 6:page.index('"', start + 6)]
+                    url = url.replace('&amp;', '&')
+
+            self.assertEqual(seen, [4, 3, 2, 1, 0])
+
+    def test_bad_cursor(self):
+        '''Are malformed cursors rejected?'''
+        with self.client as c:
+            resp = c.get(f'/users/{self.user_id}?cursor=garbage')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_user_list_pages(self):
+        '''Is the user directory paginated newest first?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get('/users')
+            html = resp.get_data(as_text=True)
+            self.assertIn("@user4", html)
+            self.assertIn("@user3", html)
+            self.assertNotIn("@user2", html)
+
+            resp = c.get(f'/users?cursor={self.user_ids[3]}')
+            html = resp.get_data(as_text=True)
+            self.assertIn("@user2", html)
+            self.assertIn("@user1", html)
+            self.assertNotIn("@user3", html)
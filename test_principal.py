@@ -0,0 +1,126 @@
+"""Lazy current-user tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_principal.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import principal
+from test_query_counts import count_queries
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CurrentUserTestCase(TestCase):
+    """Test that g.user only queries when it has to."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        principal.identities.clear()
+
+        self.client = app.test_client()
+
+        user = User.signup("principal", "principal@test.com", "password",
+                           None)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_anonymous_requests_skip_db(self):
+        '''Do anonymous and static requests run no SQL?'''
+        with self.client as c:
+            with count_queries() as counter:
+                c.get('/')
+                c.get('/static/stylesheets/style.css')
+                c.get('/login')
+            self.assertEqual(counter.count, 0)
+
+    def test_identity_served_from_cache(self):
+        '''Does a cached identity render base.html without queries?'''
+        with self.client as c:
+            self.login(c)
+            c.get('/messages/new')
+
+            with count_queries() as counter:
+                html = c.get('/messages/new').get_data(as_text=True)
+            self.assertEqual(counter.count, 0)
+            self.assertIn(f'href="/users/{self.user_id}"', html)
+
+    def test_update_refreshes_identity(self):
+        '''Does a profile update replace the cached identity?'''
+        with self.client as c:
+            self.login(c)
+            c.get('/messages/new')
+            c.post('/users/profile', data={"username": "renamed",
+                                           "email": "principal@test.com",
+                                           "image_url": "/renamed.png",
+                                           "password": "password"})
+
+            html = c.get('/messages/new').get_data(as_text=True)
+            self.assertIn('/renamed.png', html)
+            self.assertEqual(
+                principal.identities.get(self.user_id).username, 'renamed')
+
+    def test_deleted_user_logged_out(self):
+        '''Is a session for a deleted user treated as anonymous?'''
+        with self.client as c:
+            self.login(c)
+            c.get('/messages/new')
+            c.post('/users/delete')
+            self.assertIsNone(principal.identities.get(self.user_id))
+
+            # another device still holding the deleted user's session
+            self.login(c)
+            resp = c.get('/messages/new')
+            self.assertEqual(resp.status_code, 302)
+
+    def test_identity_cache_evicts(self):
+        '''Are the least recently used identities dropped past the size
+        limit, and expired ones when they are looked up?'''
+        cache = principal.IdentityCache()
+        for id in (1, 2, 3):
+            cache.put(principal.Identity(id, f'user{id}', None), 60, 2)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2).username, 'user2')
+
+        cache.put(principal.Identity(4, 'user4', None), 60, 2)
+        self.assertIsNone(cache.get(3))
+        self.assertEqual(cache.get(2).username, 'user2')
+        self.assertEqual(len(cache), 2)
+
+        cache.put(principal.Identity(5, 'user5', None), -1, 10)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get(5))
+        self.assertEqual(len(cache), 2)
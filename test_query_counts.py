@@ -0,0 +1,147 @@
+"""Query-count tests for list views.
+
+Each list route should issue the same number of SQL statements whether it
+renders two rows or twenty; a count that grows with the rows is an N+1.
+"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_counts.py
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import principal
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class count_queries:
+    """Context manager counting the SQL statements run inside it."""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+
+
+class QueryCountTestCase(TestCase):
+    """Test that list views run a constant number of queries."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        principal.identities.clear()
+
+        self.client = app.test_client()
+
+        me = User(username="me", email="me@test.com",
+                  password="HASHED_PASSWORD")
+        db.session.add(me)
+        db.session.commit()
+        self.me_id = me.id
+        self.authors = 0
+
+    def add_authors(self, n):
+        """Add `n` users who follow, are followed and liked by 'me'."""
+
+        for _ in range(n):
+            self.authors += 1
+            author = User(username=f"author{self.authors}",
+                          email=f"author{self.authors}@test.com",
+                          password="HASHED_PASSWORD")
+            db.session.add(author)
+            db.session.flush()
+
+            message = Message(text="Hello", user_id=author.id)
+            db.session.add(message)
+            db.session.add(Follows(user_being_followed_id=author.id,
+                                   user_following_id=self.me_id))
+            db.session.add(Follows(user_being_followed_id=self.me_id,
+                                   user_following_id=author.id))
+            db.session.flush()
+            db.session.add(Likes(user_id=self.me_id, message_id=message.id))
+
+            for i in range(2):
+                db.session.add(Message(text=f"mine {i}", user_id=self.me_id))
+
+        db.session.commit()
+
+        with app.app_context():
+            counters.repair_counters()
+            timeline.rebuild_timelines()
+            db.session.commit()
+
+    def route_counts(self):
+        """Statements run by each list route for the current data."""
+
+        urls = ['/',
+                f'/users/{self.me_id}',
+                '/users',
+                f'/users/{self.me_id}/following',
+                f'/users/{self.me_id}/followers',
+                f'/users/{self.me_id}/likes']
+
+        # count every route with the logged-in user's identity cached, not
+        # just the ones after the first
+        with app.app_context():
+            principal.remember(User.query.get(self.me_id))
+
+        counts = {}
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.me_id
+
+            for url in urls:
+                with count_queries() as queries:
+                    resp = c.get(url)
+                self.assertEqual(resp.status_code, 200)
+                counts[url] = queries.count
+        return counts
+
+    def test_constant_query_counts(self):
+        '''Do list routes run the same queries for 2 rows as for 10?'''
+        self.add_authors(2)
+        few = self.route_counts()
+
+        self.add_authors(8)
+        many = self.route_counts()
+
+        self.assertEqual(few, many)
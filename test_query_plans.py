@@ -0,0 +1,198 @@
+"""Query plan tests for the hot paths.
+
+Each test runs a request or a helper from the app, and the plan of every
+query it sends to the table must read it through an index rather than
+scanning it. On PostgreSQL
+sequential scans are disabled for the session, so a missing index shows up
+as a "Seq Scan" in the plan even on a small test table.
+"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_plans.py
+
+import os
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import search
+import timeline
+import viewer
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+ON_POSTGRES = db.engine.dialect.name == 'postgresql'
+
+
+class QueryPlanTestCase(TestCase):
+    """Test that hot-path queries use index scans."""
+
+    @classmethod
+    def setUpClass(cls):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'user{i}', email=f'user{i}@test.com',
+                 password='HASHED_PASSWORD')
+            for i in range(1, 201)])
+        start = datetime(2020, 1, 1)
+        db.session.bulk_insert_mappings(Message, [
+            dict(text=f'warble {i}', timestamp=start + timedelta(minutes=i),
+                 user_id=i % 200 + 1)
+            for i in range(2000)])
+        db.session.bulk_insert_mappings(Follows, [
+            dict(user_being_followed_id=(follower + step * 7) % 200 + 1,
+                 user_following_id=follower + 1)
+            for follower in range(200) for step in range(1, 6)])
+        db.session.bulk_insert_mappings(Likes, [
+            dict(user_id=user + 1, message_id=(user * 13 + step) % 2000 + 1)
+            for user in range(200) for step in range(10)])
+        # the app context's teardown removes the session
+        db.session.commit()
+        with app.app_context():
+            counters.repair_counters()
+            timeline.rebuild_timelines()
+        db.session.commit()
+        db.session.execute('ANALYZE')
+        db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        # the pages rendered here cached cards for message ids that later
+        # tests may reuse
+        app.extensions['fragment_cache'].clear()
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def statements(self, run, table):
+        """(SQL, parameters) of each SELECT or UPDATE reading `table` that
+        `run()` sends to the database."""
+
+        captured = []
+        pattern = re.compile(rf'\b(FROM|JOIN) {table}\b')
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().startswith(('SELECT', 'UPDATE')) and (
+                    pattern.search(statement)):
+                captured.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            run()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertTrue(captured, f'no query read {table}')
+        return captured
+
+    def plan(self, statement, parameters):
+        cursor = db.session.connection().connection.cursor()
+        if ON_POSTGRES:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assertIndexScan(self, run, table, index=None):
+        """Assert that every query `run()` makes of `table` reads it
+        through an index (`index`, if given, in at least one of them)."""
+
+        plans = [self.plan(*statement)
+                 for statement in self.statements(run, table)]
+        for plan in plans:
+            if ON_POSTGRES:
+                scanned = f'Seq Scan on {table}' in plan
+            else:
+                scanned = re.search(rf'SCAN (TABLE )?{table}\b(?! USING)',
+                                    plan)
+            self.assertFalse(scanned, f'full scan of {table}:\n{plan}')
+
+        if index is not None:
+            self.assertTrue(any(index in plan for plan in plans),
+                            f'{index} not used:\n' + '\n'.join(plans))
+
+    def get(self, path, user_id=5):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return lambda: self.assertEqual(client.get(path).status_code, 200)
+
+    def test_profile_messages(self):
+        '''Are a user's messages read off (user_id, timestamp, id)?'''
+        self.assertIndexScan(self.get('/users/5'), 'messages',
+                             'ix_messages_user_timestamp')
+
+    def test_following(self):
+        '''Is "whom does X follow" served by the follower index?'''
+        run = self.get('/users/5/following')
+        self.assertIndexScan(run, 'follows', 'ix_follows_following')
+        self.assertIndexScan(run, 'users')
+
+    def test_followers(self):
+        '''Is "who follows X" served by the primary key?'''
+        run = self.get('/users/5/followers')
+        self.assertIndexScan(run, 'follows')
+        self.assertIndexScan(run, 'users')
+
+    def test_message_likes(self):
+        '''Are a message's likes found through the message index?'''
+        self.assertIndexScan(
+            lambda: counters.repair_like_counts(5, 5), 'likes',
+            'ix_likes_message')
+
+    def test_viewer_likes(self):
+        '''Does the viewer-state lookup use the (user, message) key?'''
+        self.assertIndexScan(
+            lambda: viewer.liked_message_ids(5, [1, 2, 3]), 'likes')
+
+    def test_home_timeline(self):
+        '''Is the home timeline read off the owner index?'''
+        with app.app_context():
+            self.assertIndexScan(
+                lambda: timeline.home_timeline(5, 100), 'timeline_entries',
+                'ix_timeline_owner_timestamp')
+
+    def test_user_search(self):
+        '''Are username searches and autocomplete index scans?'''
+        with app.test_request_context():
+            self.assertIndexScan(lambda: search.search_users('user1'),
+                                 'users', 'ix_users_username')
+            self.assertIndexScan(lambda: search.autocomplete_users('user1'),
+                                 'users', 'ix_users_username_prefix')
+
+    def test_message_search(self):
+        '''Is message search served by the full-text index?'''
+        with app.test_request_context():
+            query, keys = search.search_messages('warble')
+            self.assertIndexScan(lambda: query.limit(100).all(), 'messages',
+                                 'ix_messages_text_fts' if ON_POSTGRES
+                                 else 'messages_fts')
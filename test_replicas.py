@@ -0,0 +1,158 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_replicas.py
+
+import copy
+import os
+from unittest import TestCase, mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import principal
+import replicas
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def replica_url(**changes):
+    """The test database's URL with `changes` applied, e.g. another
+    database name."""
+
+    url = copy.copy(make_url(app.config['SQLALCHEMY_DATABASE_URI']))
+    for name, value in changes.items():
+        setattr(url, name, value)
+    return str(url)
+
+
+def stand_in_replica():
+    """URL of a second test database playing the replica."""
+
+    database = make_url(app.config['SQLALCHEMY_DATABASE_URI']).database
+    base, ext = os.path.splitext(database)
+    return replica_url(database=f'{base}-replica{ext}')
+
+
+def unreachable_replica():
+    """URL of a replica that can't be connected to."""
+
+    if db.engine.dialect.name == 'sqlite':
+        return replica_url(database='/nonexistent/warbler-replica.db')
+    return replica_url(host='127.0.0.1', port=1)
+
+
+class ReplicaTestCase(TestCase):
+    """Test which database requests read from."""
+
+    def setUp(self):
+        """Fill the primary and the replica with differing bios."""
+
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+        principal.identities.clear()
+
+        self.replica = create_engine(stand_in_replica())
+        db.metadata.drop_all(bind=self.replica)
+        db.metadata.create_all(bind=self.replica)
+
+        user = dict(id=1001, username='replicated',
+                    email='replicated@test.com', password='HASHED_PASSWORD')
+        db.engine.execute(User.__table__.insert(), bio='primary', **user)
+        self.replica.execute(User.__table__.insert(), bio='replica', **user)
+
+        self.use_replicas(self.replica.url)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.use_replicas()
+        db.metadata.drop_all(bind=self.replica)
+        self.replica.dispose()
+
+    def use_replicas(self, *uris):
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [str(uri) for uri in uris]
+        replicas.configure(app)
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1001
+
+    def bio(self):
+        resp = self.client.get('/users/1001')
+        self.assertEqual(resp.status_code, 200)
+        html = resp.get_data(as_text=True)
+        for bio in ('primary', 'replica'):
+            if f'<p>{bio}</p>' in html:
+                return bio
+
+    def test_reads_from_replica(self):
+        '''Does an anonymous GET read from the replica?'''
+        self.assertEqual(self.bio(), 'replica')
+
+        self.use_replicas()
+        self.assertEqual(self.bio(), 'primary')
+
+    def test_read_your_writes(self):
+        '''Does a user who just posted read their own write?'''
+        self.login()
+        self.assertEqual(self.bio(), 'replica')
+
+        resp = self.client.post('/messages/new', data={'text': 'Pinned'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Message.query.filter_by(user_id=1001).count(), 1)
+
+        self.assertEqual(self.bio(), 'primary')
+
+        with self.client.session_transaction() as sess:
+            sess[replicas.PIN_KEY] = 0
+        self.assertEqual(self.bio(), 'replica')
+
+    def test_lagging_replica(self):
+        '''Are replicas too far behind skipped?'''
+        replica_set = app.extensions['replicas']
+        lag = app.config['REPLICA_MAX_LAG_SECONDS'] + 1
+
+        with mock.patch.object(replica_set, 'measure_lag', return_value=lag):
+            self.assertEqual(self.bio(), 'primary')
+        self.assertEqual(replicas.REPLICA_LAG_SECONDS.value(
+            replica='replica_0'), lag)
+
+    def test_failed_replica(self):
+        '''Does a failing replica fall back to the primary and stay out of
+        rotation?'''
+        self.use_replicas(unreachable_replica())
+        failures = replicas.REPLICA_FAILURES.value(replica='replica_0')
+
+        self.assertEqual(self.bio(), 'primary')
+        self.assertEqual(
+            replicas.REPLICA_FAILURES.value(replica='replica_0'),
+            failures + 1)
+        self.assertIsNone(app.extensions['replicas'].choose())
+
+        self.assertEqual(self.bio(), 'primary')
+        self.assertEqual(
+            replicas.REPLICA_FAILURES.value(replica='replica_0'),
+            failures + 1)
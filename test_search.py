@@ -0,0 +1,163 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_search.py
+
+import os
+from unittest import TestCase, skipUnless
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from search import search_users, autocomplete_users, escape_like
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+ON_POSTGRES = db.engine.dialect.name == 'postgresql'
+
+
+class UserSearchTestCase(TestCase):
+    """Test user search and autocomplete."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        for username, location in [("warbler", "Denver"),
+                                   ("WarblerFan", "Boston"),
+                                   ("birdwatcher", "Warbler Creek"),
+                                   ("crow", "Denver")]:
+            db.session.add(User(username=username,
+                                email=f"{username}@test.com",
+                                password="HASHED_PASSWORD",
+                                location=location))
+        db.session.commit()
+
+    def usernames(self, users):
+        return [user.username for user in users]
+
+    def test_escape_like(self):
+        '''Are LIKE wildcards escaped?'''
+        self.assertEqual(escape_like('50%_off\\'), '50\\%\\_off\\\\')
+
+    def test_prefix_search(self):
+        '''Do exact matches rank above other prefix matches?'''
+        with app.app_context():
+            users = search_users("Warbler")
+        self.assertEqual(self.usernames(users)[:2], ["warbler", "WarblerFan"])
+
+    @skipUnless(ON_POSTGRES, "trigram search needs PostgreSQL")
+    def test_substring_and_profile_search(self):
+        '''Do substring and location matches rank below prefix matches?'''
+        with app.app_context():
+            users = search_users("arbler")
+            self.assertEqual(set(self.usernames(users)),
+                             {"warbler", "WarblerFan", "birdwatcher"})
+
+            users = search_users("warbler")
+            self.assertEqual(self.usernames(users),
+                             ["warbler", "WarblerFan", "birdwatcher"])
+
+    def test_autocomplete(self):
+        '''Does autocomplete return matching usernames as JSON?'''
+        with self.client as c:
+            resp = c.get('/api/users/autocomplete?q=WAR')
+            self.assertEqual(resp.status_code, 200)
+            usernames = [user['username'] for user in resp.get_json()['users']]
+            self.assertEqual(usernames, ["warbler", "WarblerFan"])
+
+            resp = c.get('/api/users/autocomplete?q=')
+            self.assertEqual(resp.get_json()['users'], [])
+
+    def test_autocomplete_limit(self):
+        '''Does autocomplete respect its limit?'''
+        with app.app_context():
+            self.assertEqual(len(autocomplete_users("w", limit=1)), 1)
+
+    def test_search_page(self):
+        '''Does the user directory use search for 'q'?'''
+        with self.client as c:
+            resp = c.get('/users?q=crow')
+            html = resp.get_data(as_text=True)
+            self.assertIn("@crow", html)
+            self.assertNotIn("@warbler", html)
+
+
+class MessageSearchTestCase(TestCase):
+    """Test full-text message search."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(username="author", email="author@test.com",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def post(self, c, text):
+        c.post('/messages/new', data={"text": text})
+        return Message.query.filter_by(text=text).one().id
+
+    def test_search_messages(self):
+        """Are matching messages found, newest first, and paginated?"""
+        app.config['PAGE_SIZE'] = 2
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+
+                for i in range(3):
+                    self.post(c, f"spotted a warbler {i}")
+                self.post(c, "nothing to see")
+
+                resp = c.get('/messages/search?q=warbler')
+                html = resp.get_data(as_text=True)
+                self.assertEqual(resp.status_code, 200)
+                self.assertNotIn("nothing to see", html)
+                self.assertIn("cursor=", html)
+                self.assertEqual(html.count('class="list-group-item"'), 2)
+
+                resp = c.get('/messages/search?q=%22unbalanced')
+                self.assertEqual(resp.status_code, 200)
+        finally:
+            app.config['PAGE_SIZE'] = 100
+
+    def test_deleted_messages_leave_index(self):
+        """Are deleted messages removed from search results?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            msg_id = self.post(c, "ephemeral warble")
+            c.post(f'/messages/{msg_id}/delete')
+
+            resp = c.get('/messages/search?q=ephemeral')
+            html = resp.get_data(as_text=True)
+            self.assertIn("Sorry, no warbles found", html)
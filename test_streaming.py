@@ -0,0 +1,151 @@
+"""Streamed list page tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_streaming.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from pagination import StreamedPage, keyset
+import principal
+import streaming
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+STREAMED = {'list_users', 'show_likes', 'show_following', 'users_followers'}
+
+
+class StreamingTestCase(TestCase):
+    """Test that streamed pages match buffered ones, and stream."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        principal.identities.clear()
+
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f'user{i}', email=f'user{i}@test.com',
+                 password='HASHED_PASSWORD') for i in range(12)])
+        db.session.commit()
+        self.ids = [id for id, in
+                    db.session.query(User.id).order_by(User.id)]
+        self.viewer_id = self.ids[0]
+
+        # the viewer follows every other user, and likes each one's message
+        db.session.bulk_insert_mappings(Follows, [
+            dict(user_following_id=self.viewer_id, user_being_followed_id=id)
+            for id in self.ids[1::2]])
+        db.session.bulk_insert_mappings(Message, [
+            dict(text=f'warble {id}', user_id=id) for id in self.ids])
+        db.session.commit()
+        msg_ids = [id for id, in
+                   db.session.query(Message.id).order_by(Message.id)]
+        db.session.bulk_insert_mappings(Likes, [
+            dict(user_id=self.viewer_id, message_id=id)
+            for id in msg_ids[::2]])
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+        self.saved = {key: app.config[key] for key in
+                      ('STREAMED_ENDPOINTS', 'PAGE_SIZE', 'STREAM_PAGE_SIZE',
+                       'STREAM_BATCH_SIZE', 'STREAM_CHUNK_SIZE')}
+        app.config.update(PAGE_SIZE=5, STREAM_PAGE_SIZE=5,
+                          STREAM_BATCH_SIZE=2, STREAM_CHUNK_SIZE=512)
+
+    def tearDown(self):
+        app.config.update(self.saved)
+        db.session.rollback()
+
+    def get(self, path, stream):
+        app.config['STREAMED_ENDPOINTS'] = STREAMED if stream else set()
+        return self.client.get(path)
+
+    def test_same_pages(self):
+        '''Is each streamed page the same HTML as the buffered one?'''
+        for path in ['/users', f'/users/{self.ids[1]}/followers',
+                     f'/users/{self.viewer_id}/following',
+                     f'/users/{self.viewer_id}/likes']:
+            while path:
+                buffered = self.get(path, stream=False)
+                streamed = self.get(path, stream=True)
+                html = streamed.get_data(as_text=True)
+                self.assertEqual(html, buffered.get_data(as_text=True))
+                self.assertNotIn(streaming.FLUSH, html)
+
+                path = None
+                if 'Older</a>' in html:
+                    path = html.split('class="pager">')[1].split('"')[1]
+                    path = path.replace('&amp;', '&')
+
+    def test_viewer_state_per_batch(self):
+        '''Are follows resolved for every batch of a streamed page?'''
+        app.config['STREAM_PAGE_SIZE'] = None
+        html = self.get('/users', stream=True).get_data(as_text=True)
+        self.assertEqual(html.count('btn-primary btn-sm">Unfollow'),
+                         len(self.ids[1::2]))
+        self.assertNotIn('class="pager"', html)
+
+    def test_head_first(self):
+        '''Is the head sent before the list is queried?'''
+        app.config['STREAMED_ENDPOINTS'] = STREAMED
+        app.config['STREAM_CHUNK_SIZE'] = 10 ** 6
+        resp = self.client.get('/users', buffered=False)
+        chunks = iter(resp.response)
+        head = next(chunks).decode()
+        self.assertIn('</nav>', head)
+        self.assertNotIn('user-card', head)
+        self.assertIn('user-card', b''.join(chunks).decode())
+        resp.close()
+
+    def test_streamed_page_batches(self):
+        '''Are rows fetched and resolved a batch at a time?'''
+        batches = []
+        with app.test_request_context('/users'):
+            query = keyset(User.query, (User.id,), descending=False)
+            page = StreamedPage(query, 5, 2, lambda user: (user.id,),
+                                on_batch=batches.append)
+            rows = iter(page)
+            next(rows)
+            self.assertEqual(len(batches), 1)
+
+            rest = list(rows)
+        self.assertEqual([user.id for user in [batches[0][0]] + rest],
+                         self.ids[:5])
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(page.next_cursor, str(self.ids[4]))
+
+    def test_empty(self):
+        '''Does an empty streamed directory still say so?'''
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+        html = self.get('/users', stream=True).get_data(as_text=True)
+        self.assertIn('Sorry, no users found', html)
@@ -0,0 +1,205 @@
+"""Home timeline inbox tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timeline.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out-on-write timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        TimelineEntry.query.delete()
+
+        self.client = app.test_client()
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 10000
+        app.config['TIMELINE_BACKFILL_LIMIT'] = 100
+
+        reader = User.signup(username="reader",
+                             email="reader@test.com",
+                             password="testuser",
+                             image_url=None)
+
+        author = User.signup(username="author",
+                             email="author@test.com",
+                             password="testuser",
+                             image_url=None)
+        db.session.commit()
+
+        self.reader_id = reader.id
+        self.author_id = author.id
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_texts(self, user_id):
+        with app.app_context():
+            page = timeline.home_timeline(user_id, 100)
+            return [msg.text for msg in page]
+
+    def test_fan_out_on_write(self):
+        '''Do new messages land in followers' timelines?'''
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f'/users/follow/{self.author_id}')
+
+            self.login(c, self.author_id)
+            c.post('/messages/new', data={"text": "fanned out"})
+
+        entries = TimelineEntry.query.filter_by(owner_id=self.reader_id).all()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(self.timeline_texts(self.reader_id), ["fanned out"])
+        self.assertEqual(self.timeline_texts(self.author_id), ["fanned out"])
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        '''Does following copy recent messages and unfollowing remove them?'''
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post('/messages/new', data={"text": "before follow"})
+
+            self.login(c, self.reader_id)
+            c.post(f'/users/follow/{self.author_id}')
+            self.assertEqual(self.timeline_texts(self.reader_id),
+                             ["before follow"])
+
+            c.post(f'/users/stop-following/{self.author_id}')
+            self.assertEqual(self.timeline_texts(self.reader_id), [])
+
+    def test_fan_out_on_read(self):
+        '''Are authors over the threshold merged in on read?'''
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 0
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f'/users/follow/{self.author_id}')
+            c.post('/messages/new', data={"text": "own message"})
+
+            self.login(c, self.author_id)
+            c.post('/messages/new', data={"text": "popular message"})
+
+        entries = TimelineEntry.query.filter_by(owner_id=self.reader_id).all()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(self.timeline_texts(self.reader_id),
+                         ["popular message", "own message"])
+
+    def test_rebuild_timelines(self):
+        '''Does a rebuild recreate timelines from follows and messages?'''
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        db.session.add(Message(text="seeded", user_id=self.author_id))
+        db.session.commit()
+
+        with app.app_context():
+            timeline.rebuild_timelines()
+            db.session.commit()
+
+        self.assertEqual(self.timeline_texts(self.reader_id), ["seeded"])
+        self.assertEqual(self.timeline_texts(self.author_id), ["seeded"])
+
+    def test_rebuild_limit(self):
+        '''Does a rebuild keep only each followed user's latest messages,
+        like following them does?'''
+        app.config['TIMELINE_BACKFILL_LIMIT'] = 2
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        for text in ["first", "second", "third"]:
+            db.session.add(Message(text=text, user_id=self.author_id))
+            db.session.commit()
+
+        with app.app_context():
+            timeline.rebuild_timelines()
+            db.session.commit()
+
+        self.assertEqual(self.timeline_texts(self.reader_id),
+                         ["third", "second"])
+        self.assertEqual(self.timeline_texts(self.author_id),
+                         ["third", "second", "first"])
+
+    def popular_message(self):
+        """Have reader and another user follow author, over a threshold of
+        one follower, and author post; return the other user's id."""
+
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 1
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="testuser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            for user_id in (self.reader_id, other_id):
+                self.login(c, user_id)
+                c.post(f'/users/follow/{self.author_id}')
+
+            self.login(c, self.author_id)
+            c.post('/messages/new', data={"text": "while popular"})
+
+        self.assertEqual(TimelineEntry.query.filter_by(
+            owner_id=self.reader_id).count(), 0)
+        return other_id
+
+    def test_unfollow_refills(self):
+        '''When an unfollow brings an author back down to the threshold, are
+        their messages copied into their followers' timelines?'''
+        other_id = self.popular_message()
+
+        with self.client as c:
+            self.login(c, other_id)
+            c.post(f'/users/stop-following/{self.author_id}')
+
+        self.assertEqual(TimelineEntry.query.filter_by(
+            owner_id=self.reader_id).count(), 1)
+        self.assertEqual(TimelineEntry.query.filter_by(
+            owner_id=other_id).count(), 0)
+        self.assertEqual(self.timeline_texts(self.reader_id),
+                         ["while popular"])
+
+    def test_deleted_follower_refills(self):
+        '''Does deleting a follower refill the other followers' timelines
+        too?'''
+        other_id = self.popular_message()
+
+        with self.client as c:
+            self.login(c, other_id)
+            c.post('/users/delete')
+
+        self.assertEqual(TimelineEntry.query.filter_by(
+            owner_id=self.reader_id).count(), 1)
+        self.assertEqual(self.timeline_texts(self.reader_id),
+                         ["while popular"])
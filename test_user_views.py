@@ -292,7 +292,7 @@ class MessageViewTestCase(TestCase):
                 sess[CURR_USER_KEY] = self.testuser.id
             resp = c.get('/users/profile')
             html = resp.get_data(as_text=True)
-            self.assertIn('<form method="POST" id="user_form">', html)
+            self.assertIn('<form method="POST" id="user_form" enctype="multipart/form-data">', html)
             self.assertIn('<button class="btn btn-success">Edit this user!</button>', html)
 
             #test updating user
@@ -0,0 +1,104 @@
+"""Viewer-state resolver tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_viewer.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import viewer
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class ViewerStateTestCase(TestCase):
+    """Test resolving likes and follows for the rows on a page."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"user{i}",
+                      email=f"user{i}@test.com",
+                      password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.me, self.followed, self.other = users
+
+        self.liked = Message(text="liked", user_id=self.followed.id)
+        self.unliked = Message(text="unliked", user_id=self.other.id)
+        db.session.add_all([self.liked, self.unliked])
+        db.session.add(Follows(user_being_followed_id=self.followed.id,
+                               user_following_id=self.me.id))
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.me.id, message_id=self.liked.id))
+        db.session.commit()
+
+        self.me_id = self.me.id
+        self.followed_id = self.followed.id
+        self.other_id = self.other.id
+        self.liked_id = self.liked.id
+        self.unliked_id = self.unliked.id
+
+    def test_resolve(self):
+        '''Does the resolver pick out the liked and followed rows?'''
+        state = viewer.resolve(self.me,
+                               messages=[self.liked, self.unliked],
+                               users=[self.followed, self.other])
+
+        self.assertTrue(state.likes(self.liked))
+        self.assertFalse(state.likes(self.unliked))
+        self.assertTrue(state.follows(self.followed))
+        self.assertFalse(state.follows(self.other))
+
+    def test_resolve_anonymous(self):
+        '''Do anonymous viewers get an empty state?'''
+        state = viewer.resolve(None, messages=[self.liked],
+                               users=[self.followed])
+
+        self.assertFalse(state.likes(self.liked))
+        self.assertFalse(state.follows(self.followed))
+
+    def test_stars_on_profile(self):
+        '''Do profile pages show filled stars for liked messages only?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.me_id
+
+            resp = c.get(f'/users/{self.followed_id}')
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'/messages/{self.liked_id}/like', html)
+            self.assertIn('aria-pressed="true"', html)
+            self.assertNotIn('aria-pressed="false"', html)
+            self.assertIn('Unfollow', html)
+
+            resp = c.get(f'/users/{self.other_id}')
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'/messages/{self.unliked_id}/like', html)
+            self.assertIn('aria-pressed="false"', html)
+            self.assertNotIn('aria-pressed="true"', html)
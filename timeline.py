@@ -0,0 +1,269 @@
+"""Home timeline inbox for Warbler.
+
+New messages are fanned out on write into `timeline_entries`, one row per
+follower, so a user's homepage is a single range scan over
+(owner_id, timestamp). Authors with more followers than
+TIMELINE_FANOUT_THRESHOLD are not fanned out; their messages are merged in
+when the timeline is read instead. When losing a follower brings an author
+back down to the threshold, their followers' timelines are refilled with
+their latest messages (see `refill`).
+
+Following someone copies in at most TIMELINE_BACKFILL_LIMIT of their
+latest messages, and `rebuild_timelines` keeps the same number per author.
+"""
+
+from flask import current_app
+from sqlalchemy import exists, func, literal, select, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import Page, keyset
+
+ENTRY_COLUMNS = ['owner_id', 'message_id', 'author_id', 'timestamp']
+
+
+def fanout_threshold():
+    """Follower count above which an author is fanned out on read.
+
+    None turns fan-out-on-read off entirely.
+    """
+
+    return current_app.config.get('TIMELINE_FANOUT_THRESHOLD')
+
+
+def is_read_time_author(user_id):
+    """Are `user_id`'s messages merged in on read rather than fanned out?"""
+
+    threshold = fanout_threshold()
+    if threshold is None:
+        return False
+
+    followers = (db.session
+                 .query(User.followers_count)
+                 .filter(User.id == user_id)
+                 .scalar())
+    return (followers or 0) > threshold
+
+
+def read_time_authors(user_id):
+    """Ids of the users `user_id` follows that are fanned out on read."""
+
+    threshold = fanout_threshold()
+    if threshold is None:
+        return []
+
+    rows = (db.session
+            .query(Follows.user_being_followed_id)
+            .join(User, User.id == Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id,
+                    User.followers_count > threshold)
+            .all())
+    return [row[0] for row in rows]
+
+
+def fan_out_message(msg):
+    """Deliver a new message to its author's and followers' timelines.
+
+    `msg` must already be flushed so it has an id and timestamp.
+    """
+
+    table = TimelineEntry.__table__
+
+    db.session.execute(table.insert().values(
+        owner_id=msg.user_id,
+        message_id=msg.id,
+        author_id=msg.user_id,
+        timestamp=msg.timestamp,
+    ))
+
+    if is_read_time_author(msg.user_id):
+        return
+
+    followers = (select([Follows.user_following_id,
+                         literal(msg.id),
+                         literal(msg.user_id),
+                         literal(msg.timestamp, db.DateTime)])
+                 .where(Follows.user_being_followed_id == msg.user_id)
+                 .where(Follows.user_following_id != msg.user_id))
+
+    db.session.execute(table.insert().from_select(ENTRY_COLUMNS, followers))
+
+
+def backfill(follower_id, followed_id):
+    """Copy `followed_id`'s recent messages into `follower_id`'s timeline."""
+
+    if follower_id == followed_id or is_read_time_author(followed_id):
+        return
+
+    recent = (select([literal(follower_id),
+                      Message.id,
+                      Message.user_id,
+                      Message.timestamp])
+              .where(Message.user_id == followed_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(current_app.config['TIMELINE_BACKFILL_LIMIT']))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, recent))
+
+
+def recent_messages(authors=None):
+    """Subquery of (id, user_id, timestamp) of the latest
+    TIMELINE_BACKFILL_LIMIT messages of each of `authors` (ids or a
+    SELECT of them), or of every user."""
+
+    rank = (func.row_number()
+            .over(partition_by=Message.user_id,
+                  order_by=(Message.timestamp.desc(), Message.id.desc()))
+            .label('rank'))
+    ranked = select([Message.id, Message.user_id, Message.timestamp, rank])
+    if authors is not None:
+        ranked = ranked.where(Message.user_id.in_(authors))
+    ranked = ranked.alias('ranked')
+    return (select([ranked.c.id, ranked.c.user_id, ranked.c.timestamp])
+            .where(ranked.c.rank
+                   <= current_app.config['TIMELINE_BACKFILL_LIMIT'])
+            .alias('recent'))
+
+
+def backfill_many(edges):
+    """`backfill` every (follower id, followed id) in `edges`, which must
+    already be in `follows`, with one INSERT."""
+
+    if not edges:
+        return
+
+    recent = recent_messages({followed for _, followed in edges})
+    followed = (select([Follows.user_following_id, recent.c.id,
+                        recent.c.user_id, recent.c.timestamp])
+                .select_from(Follows.__table__.join(
+                    recent, recent.c.user_id == Follows.user_being_followed_id))
+                .where(tuple_(Follows.user_following_id,
+                              Follows.user_being_followed_id).in_(edges))
+                .where(Follows.user_following_id != recent.c.user_id))
+
+    threshold = fanout_threshold()
+    if threshold is not None:
+        popular = select([User.id]).where(User.followers_count > threshold)
+        followed = followed.where(recent.c.user_id.notin_(popular))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, followed))
+
+
+def refill(authors, former_follower_id):
+    """Backfill the timelines of the followers of those of `authors` that
+    losing `former_follower_id` brought back down to the fan-out threshold.
+
+    Their messages were merged in on read while they were over it, so
+    followers are missing whatever they posted meanwhile. Call after
+    adjusting `followers_count`.
+    """
+
+    threshold = fanout_threshold()
+    if threshold is None:
+        return
+
+    recent = recent_messages(authors)
+    delivered = exists().where(
+        (TimelineEntry.owner_id == Follows.user_following_id)
+        & (TimelineEntry.message_id == recent.c.id))
+    followed = (select([Follows.user_following_id, recent.c.id,
+                        recent.c.user_id, recent.c.timestamp])
+                .select_from(Follows.__table__
+                             .join(recent, recent.c.user_id
+                                   == Follows.user_being_followed_id)
+                             .join(User.__table__,
+                                   User.id == recent.c.user_id))
+                .where(User.followers_count == threshold)
+                .where(Follows.user_following_id != recent.c.user_id)
+                .where(Follows.user_following_id != former_follower_id)
+                .where(~delivered))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, followed))
+
+
+def user_deleted(user_id):
+    """`refill` for a user that is about to be deleted, after
+    counters.user_deleted."""
+
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user_id))
+    refill(followed, user_id)
+
+
+def prune(follower_id, followed_id):
+    """Remove `followed_id`'s messages from `follower_id`'s timeline."""
+
+    if follower_id == followed_id:
+        return
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.owner_id == follower_id,
+             TimelineEntry.author_id == followed_id)
+     .delete(synchronize_session=False))
+
+
+def message_key(msg):
+    """Sort key timelines are paginated on."""
+
+    return (msg.timestamp, msg.id)
+
+
+def home_timeline(user_id, page_size, cursor=None):
+    """Page of `user_id`'s homepage timeline, newest first."""
+
+    query = (Message
+             .query
+             .options(joinedload(Message.user))
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.owner_id == user_id))
+    keys = (TimelineEntry.timestamp, TimelineEntry.message_id)
+    messages = keyset(query, keys, cursor).limit(page_size + 1).all()
+
+    authors = read_time_authors(user_id)
+    if authors:
+        query = (Message
+                 .query
+                 .options(joinedload(Message.user))
+                 .filter(Message.user_id.in_(authors)))
+        keys = (Message.timestamp, Message.id)
+        messages += keyset(query, keys, cursor).limit(page_size + 1).all()
+
+        # an author may have crossed the threshold after some of their
+        # messages were fanned out, so the two halves can overlap
+        unique = {msg.id: msg for msg in messages}
+        messages = sorted(unique.values(), key=message_key, reverse=True)
+
+    return Page.from_rows(messages, page_size, message_key)
+
+
+def rebuild_timelines():
+    """Recompute every user's timeline from messages and follows, with
+    each followed user's latest TIMELINE_BACKFILL_LIMIT messages.
+
+    Uses `users.followers_count`, so counters should be repaired first.
+    """
+
+    table = TimelineEntry.__table__
+    TimelineEntry.query.delete(synchronize_session=False)
+
+    own = select([Message.user_id.label('owner_id'), Message.id,
+                  Message.user_id, Message.timestamp])
+    db.session.execute(table.insert().from_select(ENTRY_COLUMNS, own))
+
+    recent = recent_messages()
+    followed = (select([Follows.user_following_id, recent.c.id,
+                        recent.c.user_id, recent.c.timestamp])
+                .select_from(Follows.__table__.join(
+                    recent, recent.c.user_id == Follows.user_being_followed_id))
+                .where(Follows.user_following_id != recent.c.user_id))
+
+    threshold = fanout_threshold()
+    if threshold is not None:
+        popular = select([User.id]).where(User.followers_count > threshold)
+        followed = followed.where(recent.c.user_id.notin_(popular))
+
+    db.session.execute(table.insert().from_select(ENTRY_COLUMNS, followed))
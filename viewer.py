@@ -0,0 +1,85 @@
+"""What the logged-in user has liked and followed, for one page at a time.
+
+Templates used to ask `message in g.user.likes` and `g.user.is_following()`
+once per row, and each check walked the viewer's whole relationship. Routes
+now resolve a ViewerState for just the messages and users on the page, with
+one set-based query per relationship, and templates check it in O(1).
+"""
+
+from models import db, Likes
+import followgraph
+
+
+class ViewerState:
+    """Likes and follows of one viewer, restricted to the rows on a page."""
+
+    def __init__(self, liked_ids=(), followed_ids=()):
+        self.liked_ids = set(liked_ids)
+        self.followed_ids = set(followed_ids)
+
+    def likes(self, message):
+        """Has the viewer liked `message`?"""
+
+        return message.id in self.liked_ids
+
+    def follows(self, user):
+        """Is the viewer following `user`?"""
+
+        return user.id in self.followed_ids
+
+
+def liked_message_ids(viewer_id, message_ids):
+    """Subset of `message_ids` that `viewer_id` has liked."""
+
+    if not message_ids:
+        return set()
+
+    rows = (db.session
+            .query(Likes.message_id)
+            .filter(Likes.user_id == viewer_id,
+                    Likes.message_id.in_(message_ids))
+            .all())
+    return {row[0] for row in rows}
+
+
+def followed_user_ids(viewer_id, user_ids):
+    """Subset of `user_ids` that `viewer_id` is following."""
+
+    return followgraph.following_among(viewer_id, user_ids)
+
+
+def resolve(viewer, messages=(), users=()):
+    """Resolve `viewer`'s state for the messages and users on a page.
+
+    `viewer` may be None for anonymous pages, which never query.
+    """
+
+    if not viewer:
+        return ViewerState()
+
+    message_ids = {message.id for message in messages}
+    user_ids = {user.id for user in users}
+
+    return ViewerState(liked_message_ids(viewer.id, message_ids),
+                       followed_user_ids(viewer.id, user_ids))
+
+
+class BatchedViewerState(ViewerState):
+    """ViewerState for a page whose rows are resolved a batch at a time.
+
+    The state for `messages` and `users` (e.g. the profile a list belongs
+    to) is kept for the whole page; each `resolve_batch` replaces the rest,
+    so a streamed page never holds more than one batch's worth.
+    """
+
+    def __init__(self, viewer, messages=(), users=()):
+        self.viewer = viewer
+        self.kept = resolve(viewer, messages, users)
+        super().__init__(self.kept.liked_ids, self.kept.followed_ids)
+
+    def resolve_batch(self, messages=(), users=()):
+        """Resolve the viewer's state for the next batch of rows."""
+
+        batch = resolve(self.viewer, messages, users)
+        self.liked_ids = self.kept.liked_ids | batch.liked_ids
+        self.followed_ids = self.kept.followed_ids | batch.followed_ids